@@ -0,0 +1,144 @@
+"""
+Async (ASGI-native) variants of DRF generic views.
+
+DRF's APIView is synchronous, so under ASGI Django runs every request for it
+in a worker thread and concurrency is capped by the thread pool.
+AsyncAPIViewMixin turns a generic view into an async one that keeps its
+queryset, serializer, pagination, permissions and exception handling:
+
+    class AsyncPostListView(AsyncAPIViewMixin, PostListView):
+        async def get(self, request, *args, **kwargs):
+            return await self.alist()
+
+The user is loaded with the async ORM (see app_common.authentication) and so
+are the rows: aget(), acount() and async for over page-number pages. DRF's
+cursor paginator fetches its page itself, so that one runs in a single
+sync_to_async call together with its prefetches. Serializers then run on the
+event loop over fully loaded instances, where a query they would still make
+raises SynchronousOnlyOperation instead of blocking the loop.
+"""
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
+from rest_framework import exceptions
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+class AsyncAPIViewMixin:
+    http_method_names = ['get', 'head', 'options']
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.aperform_authentication(request)
+            # The user is set: what is left of initial() (negotiation, permissions, throttles) runs no query
+            self.initial(request, *args, **kwargs)
+
+            handler = self.http_method_not_allowed
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            response = handler(request, *args, **kwargs)
+            if not isinstance(response, Response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.render(self.response)
+
+    async def head(self, request, *args, **kwargs):
+        return await self.get(request, *args, **kwargs)
+
+    async def aperform_authentication(self, request):
+        """
+        What request.user does, awaiting the authenticators that have aauthenticate()
+        """
+        if any(not hasattr(authenticator, 'aauthenticate') for authenticator in request.authenticators):
+            # Forced authentication (tests) or a class without async support
+            await sync_to_async(request._authenticate)()
+            return
+
+        for authenticator in request.authenticators:
+            try:
+                user_auth_tuple = await authenticator.aauthenticate(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def aget_queryset(self):
+        # Search (?q=) asks the search backend first, a query of its own
+        if self.request.GET.get('q'):
+            return await sync_to_async(self.get_queryset)()
+        return self.get_queryset()
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(await self.aget_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = await aget_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        paginator = self.paginator
+        if paginator is None:
+            return None
+
+        if not isinstance(paginator, PageNumberPagination):
+            return await sync_to_async(self.paginate_queryset)(queryset)
+
+        page_size = paginator.get_page_size(self.request)
+        if not page_size:
+            return None
+
+        django_paginator = paginator.django_paginator_class(queryset, page_size)
+        django_paginator.count = await queryset.acount()
+
+        number = self.request.query_params.get(paginator.page_query_param) or 1
+        if number in paginator.last_page_strings:
+            number = django_paginator.num_pages
+        try:
+            number = django_paginator.validate_number(number)
+        except InvalidPage as exc:
+            raise exceptions.NotFound(paginator.invalid_page_message.format(page_number=number, message=str(exc)))
+
+        bottom = (number - 1) * page_size
+        objects = [obj async for obj in queryset[bottom:bottom + page_size]]
+        paginator.page = django_paginator._get_page(objects, number, django_paginator)
+        paginator.request = self.request
+        return objects
+
+    async def aserialize(self, instances, many=False):
+        if isinstance(instances, QuerySet):
+            instances = [obj async for obj in instances]
+        return self.get_serializer(instances, many=many).data
+
+    async def alist(self):
+        queryset = self.filter_queryset(await self.aget_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is None:
+            return Response(await self.aserialize(queryset, many=True))
+        return self.get_paginated_response(await self.aserialize(page, many=True))
+
+    async def aretrieve(self):
+        return Response(await self.aserialize(await self.aget_object()))
+
+    @staticmethod
+    def render(response):
+        # Django would render a DRF Response in a worker thread, a rendered HttpResponse goes out as is
+        response.render()
+        return HttpResponse(response.content, status=response.status_code, headers=dict(response.items()))
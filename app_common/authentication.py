@@ -0,0 +1,154 @@
+"""
+JWT authentication for the API.
+
+JWTAuthentication is simplejwt's, plus aauthenticate() for the async views
+(see app_common.async_views).
+
+CachedJWTAuthentication builds request.user without a query on most requests:
+
+- user rows are cached per user id for AUTH_USER_CACHE_TTL seconds. Saving or
+  deleting a user drops its entry (see app_user.signals), so a deactivation
+  through save() takes effect on the next request and one through
+  QuerySet.update() within AUTH_USER_CACHE_TTL
+- views with user_from_claims = True only need the requester's id, so they get
+  an unsaved user built from the token's claims and skip the row altogether.
+  A deactivated user is marked in the cache for as long as their access tokens
+  live, which those views check; if the cache loses the mark, the token's
+  expiry (ACCESS_TOKEN_LIFETIME) still bounds the delay.
+
+As with simplejwt itself, blacklisting applies to refresh tokens, so access
+tokens of a blacklisted refresh token are accepted until they expire.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def inactive_key(user_id):
+    return f'auth:user:{user_id}:inactive'
+
+
+def invalidate_user(user, deleted=False):
+    """
+    Drops the cached row of user, marking them inactive for the claims-only views if they are
+    """
+    cache = _cache()
+    cache.delete(user_key(user.pk))
+    if deleted or not user.is_active:
+        cache.set(inactive_key(user.pk), True, timeout=api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    else:
+        cache.delete(inactive_key(user.pk))
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication, plus aauthenticate() which loads the user with the async ORM
+    """
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        lookup = self.user_lookup(validated_token)
+        try:
+            user = self.user_model.objects.get(**lookup)
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        lookup = self.user_lookup(validated_token)
+        try:
+            user = await self.user_model.objects.aget(**lookup)
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        return self.check_user(user, validated_token)
+
+    @staticmethod
+    def user_lookup(validated_token):
+        try:
+            return {api_settings.USER_ID_FIELD: validated_token[api_settings.USER_ID_CLAIM]}
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+    @staticmethod
+    def check_user(user, validated_token):
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if (api_settings.CHECK_REVOKE_TOKEN
+                and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        self.view = request.parser_context.get('view') if request.parser_context else None
+        return super().authenticate(request)
+
+    async def aauthenticate(self, request):
+        self.view = request.parser_context.get('view') if request.parser_context else None
+        return await super().aauthenticate(request)
+
+    def from_claims(self):
+        return getattr(self.view, 'user_from_claims', False)
+
+    def claims_user(self, validated_token, inactive):
+        if inactive:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        # Unsaved, only good for its id: never save() it
+        return self.user_model(**self.user_lookup(validated_token), is_active=True)
+
+    def get_user(self, validated_token):
+        lookup = self.user_lookup(validated_token)
+        user_id = lookup[api_settings.USER_ID_FIELD]
+        cache = _cache()
+
+        if self.from_claims():
+            return self.claims_user(validated_token, cache.get(inactive_key(user_id)))
+
+        user = cache.get(user_key(user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(user_key(user_id), user, timeout=_ttl())
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        lookup = self.user_lookup(validated_token)
+        user_id = lookup[api_settings.USER_ID_FIELD]
+        cache = _cache()
+
+        if self.from_claims():
+            return self.claims_user(validated_token, await cache.aget(inactive_key(user_id)))
+
+        user = await cache.aget(user_key(user_id))
+        if user is None:
+            user = await super().aget_user(validated_token)
+            await cache.aset(user_key(user_id), user, timeout=_ttl())
+        return self.check_user(user, validated_token)
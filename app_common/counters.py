@@ -0,0 +1,70 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def adjust_counter(model, pk, field, delta):
+    """
+    Atomically adds delta to a denormalized counter column without loading the row
+    """
+    if not pk or not delta:
+        return 0
+
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        # Never let a counter go below zero, even if it has already drifted
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+
+    return queryset.update(**{field: F(field) + delta})
+
+
+def adjust_counters(model, field, deltas):
+    """
+    Applies {pk: delta} to a counter column with one UPDATE per distinct delta
+    """
+    by_delta = {}
+    for pk, delta in deltas.items():
+        if pk and delta:
+            by_delta.setdefault(delta, []).append(pk)
+
+    updated = 0
+    for delta, pks in by_delta.items():
+        queryset = model.objects.filter(pk__in=pks)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        updated += queryset.update(**{field: F(field) + delta})
+    return updated
+
+
+def count_subquery(related_model, fk_name):
+    """
+    Correlated subquery counting related_model rows pointing at the outer row
+    """
+    counts = (related_model.objects
+              .filter(**{fk_name: OuterRef('pk')})
+              .order_by()
+              .values(fk_name)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def repair_counter(model, field, related_model, fk_name, batch_size=1000, dry_run=False):
+    """
+    Recomputes a counter column and rewrites only the rows that drifted.
+    Returns the number of drifted rows.
+    """
+    drifted = list(
+        model.objects
+        .annotate(actual_count=count_subquery(related_model, fk_name))
+        .exclude(**{field: F('actual_count')})
+        .values_list('pk', flat=True)
+    )
+
+    if dry_run:
+        return len(drifted)
+
+    for start in range(0, len(drifted), batch_size):
+        batch = drifted[start:start + batch_size]
+        model.objects.filter(pk__in=batch).update(**{field: count_subquery(related_model, fk_name)})
+
+    return len(drifted)
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from asgiref.sync import async_to_sync
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app_common.management.commands.bench_endpoints import git_commit, percentile
+from app_post import models
+from app_user.models import UserModel
+
+# name -> (path of the sync view, path of its async variant)
+ENDPOINTS = {
+    'post list': ('api/post/', 'api/post/async/'),
+    'post detail': ('api/post/{post}/', 'api/post/async/{post}/'),
+    'story list': ('api/post/story/', 'api/post/async/story/'),
+    'profile': ('api/auth/profile/{user}/', 'api/auth/async/profile/{user}/'),
+    'followers': ('api/auth/followers/{user}/', 'api/auth/async/followers/{user}/'),
+}
+
+# mode -> (server, whether it requests the async variants)
+MODES = {
+    'wsgi': ('wsgi', False),
+    'asgi-sync': ('asgi', False),
+    'asgi': ('asgi', True),
+}
+
+
+def wsgi_request(application, path, token):
+    url = urlsplit(path)
+    environ = {'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'HTTP_HOST': 'localhost',
+               'HTTP_AUTHORIZATION': f'Bearer {token}'}
+    setup_testing_defaults(environ)
+    status = []
+
+    start = time.perf_counter()
+    response = application(environ, lambda code, headers, exc_info=None: status.append(int(code.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0], (time.perf_counter() - start) * 1000
+
+
+async def asgi_request(application, path, token):
+    url = urlsplit(path)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': 'GET', 'path': url.path, 'raw_path': url.path.encode(), 'query_string': url.query.encode(),
+        'root_path': '', 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    finished = asyncio.Event()
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Django listens for the client going away until the response is sent
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif not message.get('more_body'):
+            finished.set()
+
+    start = time.perf_counter()
+    await application(scope, receive, send)
+    return status[0], (time.perf_counter() - start) * 1000
+
+
+class Command(BaseCommand):
+    help = ('Serves the hot read endpoints through the WSGI and ASGI handlers in process, many requests in flight '
+            'at once, and reports requests/sec and p50/p99 latency of the sync views under WSGI and ASGI and of '
+            'their async variants under ASGI as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=64, help='Requests in flight at once under ASGI')
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help='Threads serving WSGI, requests in flight at once there')
+        parser.add_argument('--viewer', help='Username to make the requests as, the one following most by default')
+        parser.add_argument('--only', help='Only endpoints whose name contains this')
+        parser.add_argument('--mode', action='append', choices=list(MODES), help='Modes to run, all by default')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file to write the results to')
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with override_settings(QUERY_PROFILING=False):
+            results = self.run(**options)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def run(self, requests, concurrency, wsgi_threads, viewer, only, mode, seed, **options):
+        rng = random.Random(seed)
+        viewer = (UserModel.objects.get(username=viewer) if viewer
+                  else UserModel.objects.order_by('-following_count', 'pk').first())
+        if viewer is None:
+            raise SystemExit('The database has no users, run generate_dataset first')
+
+        token = str(RefreshToken.for_user(viewer).access_token)
+        pools = {
+            'user': list(UserModel.objects.order_by('?').values_list('pk', flat=True)[:500]),
+            'post': list(models.PostModel.objects.filter(is_deleted=False)
+                         .order_by('?').values_list('pk', flat=True)[:500]) or [0],
+        }
+        wsgi, asgi = get_wsgi_application(), get_asgi_application()
+
+        results = {}
+        for name, paths in ENDPOINTS.items():
+            if only and only not in name:
+                continue
+
+            # Every mode requests the same ids in the same order
+            ids = [{key: rng.choice(pool) for key, pool in pools.items()} for _ in range(requests)]
+            results[name] = {}
+            for mode_name in mode or MODES:
+                server, is_async = MODES[mode_name]
+                urls = ['/' + paths[is_async].format(**sample) for sample in ids]
+
+                started = time.perf_counter()
+                if server == 'wsgi':
+                    with ThreadPoolExecutor(wsgi_threads) as pool:
+                        responses = list(pool.map(lambda url: wsgi_request(wsgi, url, token), urls))
+                else:
+                    responses = async_to_sync(self.serve_asgi)(asgi, urls, token, concurrency)
+                seconds = time.perf_counter() - started
+
+                timings = [elapsed for _, elapsed in responses]
+                statuses = {}
+                for status, _ in responses:
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+                results[name][mode_name] = {
+                    'path': paths[is_async],
+                    'requests': len(responses),
+                    'statuses': statuses,
+                    'throughput_rps': round(len(responses) / seconds, 1),
+                    'p50_ms': round(percentile(timings, 50), 3),
+                    'p99_ms': round(percentile(timings, 99), 3),
+                }
+                self.report(name, mode_name, results[name][mode_name])
+
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'requests_per_endpoint': requests,
+                'concurrency': concurrency,
+                'wsgi_threads': wsgi_threads,
+                'viewer': viewer.username,
+            },
+            'endpoints': results,
+        }
+
+    @staticmethod
+    async def serve_asgi(application, urls, token, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(url):
+            async with semaphore:
+                return await asgi_request(application, url, token)
+
+        return await asyncio.gather(*(one(url) for url in urls))
+
+    def report(self, name, mode, result):
+        self.stdout.write(f'{name:<12} {mode:<10} {result["throughput_rps"]:>8.1f} req/s  '
+                          f'p50 {result["p50_ms"]:>8.2f} ms  p99 {result["p99_ms"]:>8.2f} ms  {result["statuses"]}')
@@ -0,0 +1,341 @@
+import hashlib
+import io
+import json
+import logging
+import math
+import platform
+import random
+import shutil
+import subprocess
+import argparse
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import django
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app_common import response_cache
+from app_post import models, uploads
+from app_post.urls import urlpatterns as post_urls
+from app_user.models import FollowModel, UserModel
+from app_user.urls import urlpatterns as user_urls
+
+CHUNK = bytes(range(256)) * 256
+IN_MEMORY_TRANSPORTS = {
+    'email': 'app_user.notifications.InMemoryTransport',
+    'sms': 'app_user.notifications.InMemoryTransport',
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def jpeg(size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 80, 40)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def endpoint(method, route, path, data=None, **kwargs):
+    """
+    One benchmarked request: route as in the urlconf (and QUERY_BUDGETS), path
+    with {placeholders} of sampled ids, data as a dict or a function of the ids
+    """
+    return {'method': method, 'route': route, 'path': path, 'data': data, 'kwargs': kwargs}
+
+
+ENDPOINTS = [
+    endpoint('GET', 'api/post/', 'api/post/'),
+    endpoint('GET', 'api/post/', 'api/post/?q=coffee'),
+    endpoint('POST', 'api/post/', 'api/post/',
+             lambda ids: {'description': f'bench #bench{ids["n"]} @{ids["username"]}',
+                          'photos': [SimpleUploadedFile('post.jpg', ids['jpeg'])]},
+             format='multipart'),
+    endpoint('GET', 'api/post/feed/', 'api/post/feed/'),
+    endpoint('GET', 'api/post/<int:pk>/', 'api/post/{post}/'),
+    endpoint('GET', 'api/post/user/<int:user_id>/', 'api/post/user/{user}/'),
+    endpoint('GET', 'api/post/<int:post_id>/like/', 'api/post/{post}/like/'),
+    endpoint('POST', 'api/post/<int:post_id>/like/', 'api/post/{post}/like/'),
+    endpoint('PUT', 'api/post/<int:post_id>/like/', 'api/post/{post}/like/'),
+    endpoint('DELETE', 'api/post/<int:post_id>/like/', 'api/post/{post}/like/'),
+    endpoint('POST', 'api/post/<int:post_id>/connect/user/', 'api/post/{own_post}/connect/user/', {'user_id': '{user}'}),
+    endpoint('GET', 'api/post/comment/', 'api/post/comment/'),
+    endpoint('GET', 'api/post/<int:post_id>/comment/', 'api/post/{post}/comment/'),
+    endpoint('POST', 'api/post/<int:post_id>/comment/', 'api/post/{post}/comment/', {'comment': 'bench'}),
+    endpoint('GET', 'api/post/comment/<int:pk>/', 'api/post/comment/{comment}/'),
+    endpoint('GET', 'api/post/comment/user/<int:user_id>/', 'api/post/comment/user/{user}/'),
+    endpoint('GET', 'api/post/comment/<int:comment_id>/like/', 'api/post/comment/{comment}/like/'),
+    endpoint('POST', 'api/post/comment/<int:comment_id>/like/', 'api/post/comment/{comment}/like/'),
+    endpoint('GET', 'api/post/story/', 'api/post/story/'),
+    endpoint('POST', 'api/post/story/', 'api/post/story/',
+             lambda ids: {'description': 'bench story', 'photo': SimpleUploadedFile('story.jpg', ids['jpeg'])},
+             format='multipart'),
+    endpoint('GET', 'api/post/story/<int:pk>/', 'api/post/story/{story}/'),
+    endpoint('GET', 'api/post/story/user/<int:user_id>/', 'api/post/story/user/{user}/'),
+    endpoint('GET', 'api/post/story/tray/', 'api/post/story/tray/'),
+    endpoint('GET', 'api/post/story/<int:story_id>/like/', 'api/post/story/{story}/like/'),
+    endpoint('POST', 'api/post/story/<int:story_id>/like/', 'api/post/story/{story}/like/'),
+    endpoint('GET', 'api/post/tag/', 'api/post/tag/'),
+    endpoint('GET', 'api/post/tag/<int:pk>/', 'api/post/tag/{tag}/'),
+    endpoint('GET', 'api/post/top/', 'api/post/top/'),
+    endpoint('GET', 'api/post/async/', 'api/post/async/'),
+    endpoint('GET', 'api/post/async/<int:pk>/', 'api/post/async/{post}/'),
+    endpoint('GET', 'api/post/async/story/', 'api/post/async/story/'),
+    endpoint('POST', 'api/post/interactions/', 'api/post/interactions/',
+             lambda ids: {'events': [
+                 {'type': 'view', 'target': 'post', 'id': ids['post']},
+                 {'type': 'like', 'target': 'post', 'id': ids['post']},
+                 {'type': 'mark', 'target': 'post', 'id': ids['post']},
+                 {'type': 'view', 'target': 'story', 'id': ids['story']},
+                 {'type': 'like', 'target': 'story', 'id': ids['story']},
+                 {'type': 'like', 'target': 'comment', 'id': ids['comment']},
+             ]},
+             format='json'),
+    endpoint('POST', 'api/post/upload/', 'api/post/upload/', {'filename': 'bench.mp4', 'size': len(CHUNK)}),
+    endpoint('PUT', 'api/post/upload/<int:pk>/', 'api/post/upload/{upload}/', CHUNK,
+             content_type='application/octet-stream', HTTP_CONTENT_RANGE=f'bytes 0-{len(CHUNK) - 1}/{len(CHUNK)}',
+             HTTP_X_CHUNK_SHA256=hashlib.sha256(CHUNK).hexdigest()),
+    endpoint('POST', 'api/auth/login/', 'api/auth/login/',
+             {'username_or_email_or_phone_number': '{viewer_name}', 'password': '{password}'}),
+    endpoint('POST', 'api/auth/register/', 'api/auth/register/',
+             {'username': 'bench{n}', 'email': 'bench{n}@gmail.com', 'phone_number': '+99899{n:07d}',
+              'password': 'Bench-password-1', 'confirm_password': 'Bench-password-1'}),
+    endpoint('GET', 'api/auth/profile/<int:pk>/', 'api/auth/profile/{user}/'),
+    endpoint('GET', 'api/auth/mark/<int:user_id>/', 'api/auth/mark/{user}/'),
+    endpoint('GET', 'api/auth/<int:user_id>/follow/', 'api/auth/{user}/follow/'),
+    endpoint('POST', 'api/auth/<int:user_id>/follow/', 'api/auth/{user}/follow/'),
+    endpoint('PUT', 'api/auth/<int:user_id>/follow/', 'api/auth/{user}/follow/'),
+    endpoint('DELETE', 'api/auth/<int:user_id>/follow/', 'api/auth/{user}/follow/'),
+    endpoint('GET', 'api/auth/followers/<int:user_id>/', 'api/auth/followers/{user}/'),
+    endpoint('GET', 'api/auth/following/<int:user_id>/', 'api/auth/following/{user}/'),
+    endpoint('GET', 'api/auth/async/profile/<int:pk>/', 'api/auth/async/profile/{user}/'),
+    endpoint('GET', 'api/auth/async/followers/<int:user_id>/', 'api/auth/async/followers/{user}/'),
+    endpoint('POST', 'api/auth/resend-email/', 'api/auth/resend-email/', {'email_or_phone_number': '{viewer_email}'}),
+    endpoint('POST', 'api/auth/verify-email/', 'api/auth/verify-email/',
+             {'email_or_phone_number': '{viewer_email}', 'code': '0000'}),
+    endpoint('POST', 'api/auth/token/', 'api/auth/token/', {'username': '{viewer_name}', 'password': '{password}'}),
+    endpoint('POST', 'api/auth/token/refresh/', 'api/auth/token/refresh/', {'refresh': '{refresh}'}),
+]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(timings, p):
+    ordered = sorted(timings)
+    # Nearest rank
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def fill(value, ids):
+    if isinstance(value, str):
+        return value.format(**ids)
+    if isinstance(value, dict):
+        return {key: fill(item, ids) for key, item in value.items()}
+    return value
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Drives every API endpoint through the test client against the current database (see generate_dataset) '
+            'and reports p50/p95/p99 latency, queries per request, throughput and response cache hits as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per endpoint first')
+        parser.add_argument('--viewer', help='Username to make the requests as, the one following most by default')
+        parser.add_argument('--password', default='password', help="The viewer's password, for the login endpoints")
+        parser.add_argument('--sample', type=int, default=500, help='Random ids sampled per model')
+        parser.add_argument('--only', help='Only endpoints whose route contains this')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file to write the results to')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+        parser.add_argument('--response-cache', action=argparse.BooleanOptionalAction, default=True,
+                            help='Serve cacheable endpoints from the response cache (see app_common.response_cache)')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        # Writes are rolled back; files go to a scratch MEDIA_ROOT and notifications nowhere
+        # Expected 4xx (e.g. the wrong verification code) would log a line per request
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        try:
+            # Rate limits would answer most repeated logins and registrations with 429
+            with override_settings(QUERY_PROFILING=False, MEDIA_ROOT=media_root, THROTTLE_RULES={},
+                                   NOTIFICATION_TRANSPORTS=IN_MEMORY_TRANSPORTS,
+                                   RESPONSE_CACHE_ENABLED=options['response_cache']):
+                with transaction.atomic():
+                    results = self.run(**options)
+                    raise Rollback
+        except Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.compare(json.load(file), results)
+
+    def run(self, requests, warmup, viewer, password, sample, only, seed, **options):
+        rng = random.Random(seed)
+        viewer = (UserModel.objects.get(username=viewer) if viewer
+                  else UserModel.objects.order_by('-following_count', 'pk').first())
+        if viewer is None:
+            raise SystemExit('The database has no users, run generate_dataset first')
+
+        def sample_ids(queryset):
+            return list(queryset.order_by('?').values_list('pk', flat=True)[:sample]) or [0]
+
+        refresh = RefreshToken.for_user(viewer)
+        iterations = requests + warmup
+        pools = {
+            'user': sample_ids(UserModel.objects.all()),
+            'post': sample_ids(models.PostModel.objects.all()),
+            'own_post': sample_ids(models.PostModel.objects.filter(user=viewer)),
+            'comment': sample_ids(models.CommentPostModel.objects.all()),
+            'story': sample_ids(models.StoryModel.objects.filter(is_archived=False)),
+            'tag': sample_ids(models.TagModel.objects.all()),
+        }
+        sessions = iter([uploads.open_session(viewer, 'bench.mp4', len(CHUNK)).pk
+                         for _ in range(iterations)]) if self.selected('api/post/upload/<int:pk>/', only) else iter(())
+        fixed = {
+            'viewer_name': viewer.username, 'viewer_email': viewer.email, 'password': password,
+            'refresh': str(refresh), 'username': viewer.username, 'jpeg': jpeg(),
+        }
+
+        client = APIClient(raise_request_exception=False, HTTP_HOST='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+        self.warn_missing_routes()
+        # Start cold: entries of an earlier run may be built from rows it rolled back
+        response_cache.bump('posts', 'tags')
+        response_cache.reset_stats()
+        results = {}
+        started = time.perf_counter()
+        for spec in ENDPOINTS:
+            if not self.selected(spec['route'], only):
+                continue
+
+            timings, queries, statuses, cached = [], [], {}, {'HIT': [], 'MISS': []}
+            for n in range(iterations):
+                ids = {name: rng.choice(pool) for name, pool in pools.items()}
+                ids.update(fixed, n=n, upload=next(sessions, 0) if '{upload}' in spec['path'] else 0)
+                data = spec['data'](ids) if callable(spec['data']) else fill(spec['data'], ids)
+                request = getattr(client, spec['method'].lower())
+
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    start = time.perf_counter()
+                    response = request('/' + spec['path'].format(**ids), data, **spec['kwargs'])
+                    elapsed = time.perf_counter() - start
+
+                if n >= warmup:
+                    timings.append(elapsed * 1000)
+                    queries.append(counter.count)
+                    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+                    if response.has_header('X-Cache'):
+                        cached[response['X-Cache']].append(elapsed * 1000)
+
+            name = f'{spec["method"]} {spec["path"]}'
+            results[name] = {
+                'route': spec['route'],
+                'requests': len(timings),
+                'statuses': statuses,
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'queries_mean': round(sum(queries) / len(queries), 2),
+                'queries_max': max(queries),
+                # One client sending requests one after another
+                'throughput_rps': round(len(timings) / (sum(timings) / 1000), 1),
+            }
+            if cached['HIT'] or cached['MISS']:
+                results[name]['cache'] = {
+                    'hit_ratio': round(len(cached['HIT']) / (len(cached['HIT']) + len(cached['MISS'])), 3),
+                    'hit_p50_ms': round(percentile(cached['HIT'], 50), 3) if cached['HIT'] else None,
+                    'miss_p50_ms': round(percentile(cached['MISS'], 50), 3) if cached['MISS'] else None,
+                }
+            self.report(name, results[name])
+
+        total = sum(result['requests'] for result in results.values())
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'requests_per_endpoint': requests,
+                'warmup': warmup,
+                'viewer': viewer.username,
+                'database': connection.vendor,
+                'response_cache': options['response_cache'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'dataset': {
+                    'users': UserModel.objects.count(),
+                    'follows': FollowModel.objects.count(),
+                    'posts': models.PostModel.objects.count(),
+                    'likes': models.LikePostModel.objects.count(),
+                    'comments': models.CommentPostModel.objects.count(),
+                    'stories': models.StoryModel.objects.count(),
+                },
+            },
+            'total': {
+                'requests': total,
+                'seconds': round(time.perf_counter() - started, 3),
+                'response_cache': response_cache.stats() if options['response_cache'] else None,
+            },
+            'endpoints': results,
+        }
+
+    @staticmethod
+    def selected(route, only):
+        return not only or only in route
+
+    def warn_missing_routes(self):
+        routes = {f'api/post/{pattern.pattern}' for pattern in post_urls}
+        routes |= {f'api/auth/{pattern.pattern}' for pattern in user_urls}
+        missing = routes - {spec['route'] for spec in ENDPOINTS}
+        if missing:
+            self.stderr.write(f'Not benchmarked: {", ".join(sorted(missing))}')
+
+    def report(self, name, result):
+        line = (f'{name:<48} p50 {result["p50_ms"]:>8.2f} ms  p95 {result["p95_ms"]:>8.2f} ms  '
+                f'p99 {result["p99_ms"]:>8.2f} ms  {result["queries_mean"]:>6.1f} queries  '
+                f'{result["throughput_rps"]:>7.1f} req/s  {result["statuses"]}')
+        if 'cache' in result:
+            line += f'  cache hits {result["cache"]["hit_ratio"]:.0%}'
+        self.stdout.write(line)
+
+    def compare(self, before, after):
+        self.stdout.write(f'\nAgainst {before["meta"].get("commit") or "the earlier run"}:')
+        for name, result in after['endpoints'].items():
+            old = before['endpoints'].get(name)
+            if not old:
+                continue
+            change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0
+            self.stdout.write(f'{name:<48} p95 {old["p95_ms"]:>8.2f} -> {result["p95_ms"]:>8.2f} ms ({change:+.0f}%)  '
+                              f'queries {old["queries_mean"]:>6.1f} -> {result["queries_mean"]:.1f}')
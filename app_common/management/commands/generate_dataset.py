@@ -0,0 +1,164 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_post import models
+from app_user.models import FollowModel, UserModel
+
+WORDS = ('sunset', 'coffee', 'travel', 'friends', 'weekend', 'city', 'music', 'food', 'sea', 'mountains', 'party',
+         'work', 'books', 'cat', 'dog', 'summer', 'winter', 'run', 'art', 'home')
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic social graph in bulk: users with power-law follows, posts with photos, tags, '
+            'marks, likes and comments, and live stories')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows-per-user', type=int, default=30, help='Mean, heavy-tailed')
+        parser.add_argument('--posts-per-user', type=int, default=5, help='Mean, heavy-tailed')
+        parser.add_argument('--likes-per-post', type=int, default=10, help='Mean, heavy-tailed')
+        parser.add_argument('--comments-per-post', type=int, default=3, help='Mean, heavy-tailed')
+        parser.add_argument('--stories-per-user', type=float, default=0.3, help='Mean')
+        parser.add_argument('--tags', type=int, default=500)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of user popularity, higher means fewer users get most follows')
+        parser.add_argument('--prefix', default='gen', help='Prefix of the generated usernames')
+        parser.add_argument('--password', default='password', help='Password of every generated user')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, users, follows_per_user, posts_per_user, likes_per_post, comments_per_post,
+               stories_per_user, tags, skew, prefix, password, seed, batch_size, **options):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+
+        with transaction.atomic():
+            user_ids = self.create_users(users, prefix, password)
+            followers = self.create_follows(user_ids, follows_per_user, skew)
+            tag_ids = self.create_tags(tags, prefix)
+            post_ids = self.create_posts(user_ids, posts_per_user, tag_ids, followers)
+            self.create_engagement(post_ids, user_ids, likes_per_post, comments_per_post, followers)
+            self.create_stories(user_ids, stories_per_user)
+
+        # Bulk inserts skip the signals: recompute what they would have maintained
+        call_command('repair_counters', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_trending', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Generated {len(user_ids)} users and {len(post_ids)} posts, '
+                                             f'log in as {prefix}0 .. {prefix}{users - 1} with "{password}"'))
+
+    def heavy_tailed(self, mean):
+        # Pareto with alpha 1.5 has a mean of 3
+        return int(mean * self.rng.paretovariate(1.5) / 3)
+
+    def create_users(self, count, prefix, password):
+        # Hashing once: every user gets the same hash, a fresh salt per user would take minutes
+        hashed = make_password(password)
+        start = UserModel.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        rows = UserModel.objects.bulk_create([
+            UserModel(username=f'{prefix}{i}', email=f'{prefix}{i}@gmail.com', password=hashed,
+                      phone_number=f'+998{start + i:09d}', is_private=self.rng.random() < 0.1)
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        self.stdout.write(f'{len(rows)} users')
+        return [row.pk for row in rows]
+
+    def create_follows(self, user_ids, mean, skew):
+        """
+        Follows whose targets are drawn by Zipf popularity, returns {followed: [followers]}
+        """
+        popularity = list(user_ids)
+        self.rng.shuffle(popularity)
+        weights = [1 / (rank + 1) ** skew for rank in range(len(popularity))]
+
+        followers = {user_id: [] for user_id in user_ids}
+        rows = []
+        for follower in user_ids:
+            count = min(self.heavy_tailed(mean), len(user_ids) - 1)
+            targets = set(self.rng.choices(popularity, weights, k=count)) - {follower}
+            for followed in targets:
+                followers[followed].append(follower)
+                rows.append(FollowModel(follower_id=follower, followed_id=followed))
+            rows = self.flush(FollowModel, rows)
+
+        self.flush(FollowModel, rows, force=True)
+        self.stdout.write(f'{sum(map(len, followers.values()))} follows')
+        return followers
+
+    def create_tags(self, count, prefix):
+        rows = models.TagModel.objects.bulk_create([
+            models.TagModel(tag=f'#{prefix}{self.rng.choice(WORDS)}{i}') for i in range(count)
+        ], batch_size=self.batch_size, ignore_conflicts=True)
+        return list(models.TagModel.objects.filter(tag__in=[row.tag for row in rows]).values_list('pk', flat=True))
+
+    def create_posts(self, user_ids, mean, tag_ids, followers):
+        # Popular users post more
+        authors = [user_id for user_id in user_ids
+                   for _ in range(self.heavy_tailed(mean) + min(len(followers[user_id]) // 50, 20))]
+        posts = models.PostModel.objects.bulk_create([
+            models.PostModel(user_id=author, description=' '.join(self.rng.sample(WORDS, 6)))
+            for author in authors
+        ], batch_size=self.batch_size)
+        photos = models.PhotoModel.objects.bulk_create([
+            models.PhotoModel(photo=f'Post/Photos/generated_{i % 100}.jpg') for i in range(len(posts))
+        ], batch_size=self.batch_size)
+
+        photo_rows, tag_rows, mark_rows = [], [], []
+        for post, photo in zip(posts, photos):
+            photo_rows.append(models.PostModel.photos.through(postmodel_id=post.pk, photomodel_id=photo.pk))
+            for tag_id in self.rng.sample(tag_ids, min(len(tag_ids), self.rng.randint(0, 4))):
+                tag_rows.append(models.PostModel.tags.through(postmodel_id=post.pk, tagmodel_id=tag_id))
+            for user_id in self.rng.sample(followers[post.user_id], min(len(followers[post.user_id]),
+                                                                        self.rng.randint(0, 2))):
+                mark_rows.append(models.MarkModel(user_id=user_id, post_id=post.pk))
+
+        for model, rows in ((models.PostModel.photos.through, photo_rows), (models.PostModel.tags.through, tag_rows),
+                            (models.MarkModel, mark_rows)):
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+
+        self.stdout.write(f'{len(posts)} posts, {len(tag_rows)} tags on them, {len(mark_rows)} marks')
+        return [(post.pk, post.user_id) for post in posts]
+
+    def create_engagement(self, posts, user_ids, likes_mean, comments_mean, followers):
+        likes = comments = 0
+        like_rows, comment_rows = [], []
+        for post_id, author in posts:
+            # Mostly the author's followers engage, anyone else when there are too few of them
+            audience = followers[author] if len(followers[author]) > likes_mean else user_ids
+            likers = self.rng.sample(audience, min(len(audience), self.heavy_tailed(likes_mean)))
+            like_rows += [models.LikePostModel(user_id=user_id, post_id=post_id) for user_id in likers]
+            commenters = [self.rng.choice(audience) for _ in range(self.heavy_tailed(comments_mean))]
+            comment_rows += [models.CommentPostModel(user_id=user_id, post_id=post_id,
+                                                     comment=' '.join(self.rng.sample(WORDS, 3)))
+                             for user_id in commenters]
+
+            likes += len(likers)
+            comments += len(commenters)
+            like_rows = self.flush(models.LikePostModel, like_rows)
+            comment_rows = self.flush(models.CommentPostModel, comment_rows)
+
+        self.flush(models.LikePostModel, like_rows, force=True)
+        self.flush(models.CommentPostModel, comment_rows, force=True)
+        self.stdout.write(f'{likes} likes, {comments} comments')
+
+    def create_stories(self, user_ids, mean):
+        rows = models.StoryModel.objects.bulk_create([
+            models.StoryModel(user_id=user_id, description=' '.join(self.rng.sample(WORDS, 3)),
+                              photo=f'Story/Photos/generated_{user_id % 100}.jpg')
+            for user_id in user_ids for _ in range(int(mean) + (self.rng.random() < mean % 1))
+        ], batch_size=self.batch_size)
+        self.stdout.write(f'{len(rows)} live stories')
+
+    def flush(self, model, rows, force=False):
+        """
+        Inserts rows once there is a batch of them (or force), returns what is left to insert
+        """
+        if rows and (force or len(rows) >= self.batch_size):
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+            return []
+        return rows
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from app_common.counters import repair_counter
+from app_post import models
+from app_user.models import UserModel, FollowModel
+
+# (model holding the counter, counter field, related model, foreign key on related model)
+COUNTERS = [
+    (models.PostModel, 'likes_count', models.LikePostModel, 'post'),
+    (models.PostModel, 'comments_count', models.CommentPostModel, 'post'),
+    (models.PostModel, 'marks_count', models.MarkModel, 'post'),
+    (models.StoryModel, 'likes_count', models.LikeStoryModel, 'story'),
+    (models.StoryModel, 'marks_count', models.MarkModel, 'story'),
+    (models.CommentPostModel, 'likes_count', models.LikeCommentModel, 'comment'),
+    (UserModel, 'followers_count', FollowModel, 'followed'),
+    (UserModel, 'following_count', FollowModel, 'follower'),
+    (UserModel, 'posts_count', models.PostModel, 'user'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Recomputes denormalized engagement counters and repairs the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows')
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, related_model, fk_name in COUNTERS:
+            drifted = repair_counter(model, field, related_model, fk_name,
+                                     batch_size=options['batch_size'],
+                                     dry_run=options['dry_run'])
+            total += drifted
+            self.stdout.write(f'{model.__name__}.{field}: {drifted} drifted')
+
+        verb = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{total} counters {verb}'))
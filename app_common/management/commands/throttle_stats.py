@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from app_common import throttling
+
+
+class Command(BaseCommand):
+    help = 'Prints how many requests every rate limit shed (see app_common.throttling) as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Start counting again afterwards')
+
+    def handle(self, *args, reset, **options):
+        self.stdout.write(json.dumps(throttling.stats(), indent=2))
+        if reset:
+            throttling.reset_stats()
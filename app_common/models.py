@@ -8,3 +8,19 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class CounterFieldsMixin:
+    """
+    Leaves counter_fields out of save() of existing rows unless update_fields names them.
+    Counters only move by F() updates (see app_common.counters), the values a
+    loaded instance holds are stale by the time it is saved.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (self.counter_fields and not args and not self._state.adding
+                and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.counter_fields]
+        return super().save(*args, **kwargs)
@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Cursor pagination on (created_at, id), newest first, without COUNT(*).
+    The cursor holds the last created_at seen and seeks past it through the index;
+    only rows sharing that exact created_at are skipped with an OFFSET, so deep
+    pages cost about the same as the first one unless many rows share a timestamp.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # Search results (see app_post.search.search_queryset) are paged by relevance instead
+        if 'search_rank' in queryset.query.annotations:
+            return ('search_rank', '-id')
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,224 @@
+"""
+Per-request SQL profiles and query budgets.
+
+With QUERY_PROFILING on, QueryProfilingMiddleware records every query a
+request runs: how many, how long they took in total, which ones repeat (by
+fingerprint, the SQL with its IN lists collapsed) and which serializer, or
+else view or function of ours, ran them.
+
+The count is checked against QUERY_BUDGETS, keyed by route
+('api/post/<int:pk>/') with either one number or one per method. Over budget,
+QUERY_BUDGET_MODE 'warn' logs a warning and 'raise' raises QueryBudgetExceeded,
+which the test runner (QueryBudgetTestRunner) turns on so that every request
+made by a test is checked. With QUERY_PROFILE_DIR set, the profile of the
+costliest request seen per endpoint is written there as JSON.
+
+QueryProfile can also be used directly:
+
+    with QueryProfile() as profile:
+        serializer.data
+    print(profile.summary())
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+WHITESPACE = re.compile(r'\s+')
+APPS_DIR = str(settings.BASE_DIR)
+LIBRARY_DIRS = tuple(path for path in sys.path if 'site-packages' in path)
+
+# endpoint -> query count of the costliest profile written to QUERY_PROFILE_DIR
+_dumped = {}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    return IN_LIST.sub('IN (...)', WHITESPACE.sub(' ', sql).strip())
+
+
+def origin(frame):
+    """
+    Who ran the query: the innermost serializer on the stack, else view, else function of ours
+    """
+    view = code = None
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, ListSerializer):
+            return f'{type(owner.child).__name__}(many=True).{frame.f_code.co_name}'
+        if isinstance(owner, BaseSerializer):
+            return f'{type(owner).__name__}.{frame.f_code.co_name}'
+        if view is None and isinstance(owner, APIView):
+            view = f'{type(owner).__name__}.{frame.f_code.co_name}'
+        filename = frame.f_code.co_filename
+        if (code is None and filename.startswith(APPS_DIR) and not filename.startswith(LIBRARY_DIRS)
+                and filename != __file__):
+            code = f'{frame.f_globals.get("__name__")}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return view or code or 'unknown'
+
+
+class QueryProfile:
+    def __init__(self, endpoint=''):
+        self.endpoint = endpoint
+        self.queries = []
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'time': time.perf_counter() - start,
+                'origin': origin(sys._getframe(1)),
+            })
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        return sum(query['time'] for query in self.queries)
+
+    def duplicates(self):
+        """
+        {fingerprint: times run} of the queries run more than once, the most repeated first
+        """
+        counts = Counter(fingerprint(query['sql']) for query in self.queries)
+        return {sql: count for sql, count in counts.most_common() if count > 1}
+
+    def origins(self):
+        return dict(Counter(query['origin'] for query in self.queries).most_common())
+
+    def summary(self):
+        return {
+            'endpoint': self.endpoint,
+            'count': self.count,
+            'time_ms': round(self.time * 1000, 3),
+            'duplicates': self.duplicates(),
+            'origins': self.origins(),
+        }
+
+
+def budget(method, route):
+    """
+    The query budget of an endpoint, None if it has none
+    """
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    value = budgets.get(route)
+    if isinstance(value, dict):
+        value = value.get(method, value.get('*'))
+    return value
+
+
+def check_budget(profile, method, route):
+    limit = budget(method, route)
+    if limit is None or profile.count <= limit:
+        return
+
+    message = f'{method} {route} ran {profile.count} queries, its budget is {limit}: {profile.summary()}'
+    if getattr(settings, 'QUERY_BUDGET_MODE', 'warn') == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def dump(profile):
+    directory = getattr(settings, 'QUERY_PROFILE_DIR', None)
+    if not directory or profile.count <= _dumped.get(profile.endpoint, -1):
+        return
+
+    _dumped[profile.endpoint] = profile.count
+    os.makedirs(directory, exist_ok=True)
+    name = re.sub(r'[^\w]+', '_', profile.endpoint).strip('_') or 'root'
+    with open(os.path.join(directory, f'{name}.json'), 'w') as file:
+        json.dump({**profile.summary(), 'queries': profile.queries}, file, indent=2)
+
+
+class QueryProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not getattr(settings, 'QUERY_PROFILING', False):
+            return self.get_response(request)
+
+        with QueryProfile() as profile:
+            response = self.get_response(request)
+
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'QUERY_PROFILING', False):
+            return await self.get_response(request)
+
+        # Connections are context-local, the async ORM's worker threads use the wrapped ones
+        with QueryProfile() as profile:
+            response = await self.get_response(request)
+
+        return self.finish(request, response, profile)
+
+    @staticmethod
+    def finish(request, response, profile):
+        match = request.resolver_match
+        if match is None:
+            return response
+
+        route = match.route
+        profile.endpoint = f'{request.method} {route}'
+        response['Server-Timing'] = f'db;dur={profile.time * 1000:.3f};desc="{profile.count} queries"'
+        response.query_profile = profile
+
+        dump(profile)
+        check_budget(profile, request.method, route)
+        return response
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """
+    Runs the tests with every request checked against its query budget
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.budget_settings = override_settings(QUERY_PROFILING=True, QUERY_BUDGET_MODE='raise')
+        self.budget_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.budget_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,179 @@
+"""
+Shared cache of read-heavy GET responses.
+
+A response is cached under its endpoint, host, path with query string, the
+image formats the client accepts (see app_post.images.pick), the viewer's
+visibility class (anonymous, owner or viewer) and the current versions of the
+namespaces it is built from ('posts', 'tags'). Writes bump those versions
+(see app_post.signals), which orphans every entry built from older data at
+once without having to find them; RESPONSE_CACHE_TTL expires the orphans and
+bounds how stale anything written without a signal (e.g. buffered views) can get.
+
+Any Django cache backend works: locmem and file based ones offline, Redis or
+Memcached to share entries and versions between processes. Set RESPONSE_CACHE
+to the alias in CACHES to use. Versions and stats are kept without expiry next
+to the responses, so the cache must be sized (MAX_ENTRIES for locmem, memory
+for the others) to hold a TTL's worth of responses without culling: a culled
+version only restarts from the clock, but culled stats read as zero.
+
+Concurrent misses of the same key are coalesced: the first request takes a
+lock with cache.add() and builds the response, the others wait up to
+RESPONSE_CACHE_LOCK_TIMEOUT seconds for its result instead of building it too,
+and build it themselves as soon as the lock is released without one.
+
+Hits, misses and coalesced waits are counted in the cache, see stats().
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from rest_framework.response import Response
+
+KEY_PREFIX = 'response'
+STATS = ('hits', 'misses', 'coalesced')
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE', 'default')]
+
+
+def enabled():
+    return getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+
+
+def _version_key(namespace):
+    return f'{KEY_PREFIX}:version:{namespace}'
+
+
+def _incr(cache, key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+
+def versions(namespaces):
+    """
+    The current version of every namespace. A version lost with the cache
+    restarts from the clock, so it never goes back to one entries were built at.
+    """
+    cache = _cache()
+    keys = [_version_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+
+    return [found[key] for key in keys]
+
+
+def bump(*namespaces):
+    cache = _cache()
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(*namespaces):
+    """
+    Bumps namespaces now, so the writing transaction reads its own writes, and
+    again after it commits, so nothing built from the old rows meanwhile survives
+    """
+    if not namespaces:
+        return
+
+    bump(*namespaces)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: bump(*namespaces))
+
+
+def response_key(request, endpoint, namespaces, visibility):
+    webp = 'image/webp' in request.headers.get('Accept', '')
+    parts = [endpoint, request.get_host(), request.get_full_path(), 'webp' if webp else 'jpeg', visibility]
+    parts += [f'{namespace}={version}' for namespace, version in zip(namespaces, versions(namespaces))]
+    return f'{KEY_PREFIX}:' + ':'.join(parts)
+
+
+def fetch(key, build):
+    """
+    Returns (cached value of key, True), or (build(), False) stored for the next requests
+    """
+    cache = _cache()
+    value = cache.get(key)
+    if value is not None:
+        _incr(cache, f'{KEY_PREFIX}:stats:hits')
+        return value, True
+
+    lock_key = f'{key}:lock'
+    lock_timeout = getattr(settings, 'RESPONSE_CACHE_LOCK_TIMEOUT', 10)
+    locked = cache.add(lock_key, 1, timeout=lock_timeout)
+    if not locked:
+        # Someone else is building it: wait for theirs rather than build it again
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(getattr(settings, 'RESPONSE_CACHE_POLL_INTERVAL', 0.05))
+            found = cache.get_many([key, lock_key])
+            if found.get(key) is not None:
+                _incr(cache, f'{KEY_PREFIX}:stats:coalesced')
+                return found[key], True
+            if lock_key not in found:
+                # Released without a result (the build failed): no point waiting any longer
+                break
+
+    try:
+        value = build()
+        cache.set(key, value, timeout=getattr(settings, 'RESPONSE_CACHE_TTL', 60))
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+    _incr(cache, f'{KEY_PREFIX}:stats:misses')
+    return value, False
+
+
+def stats():
+    cache = _cache()
+    counts = cache.get_many([f'{KEY_PREFIX}:stats:{name}' for name in STATS])
+    result = {name: counts.get(f'{KEY_PREFIX}:stats:{name}', 0) for name in STATS}
+    served = sum(result.values())
+    result['hit_ratio'] = (result['hits'] + result['coalesced']) / served if served else 0
+    return result
+
+
+def reset_stats():
+    _cache().delete_many([f'{KEY_PREFIX}:stats:{name}' for name in STATS])
+
+
+class CachedResponseMixin:
+    """
+    Serves GET from the response cache. cache_namespaces lists what the
+    response is built from, personalize() fills in what differs per viewer.
+    """
+    cache_namespaces = ()
+
+    def get_visibility(self):
+        return 'viewer' if self.request.user.is_authenticated else 'anonymous'
+
+    def personalize(self, data):
+        pass
+
+    def get(self, request, *args, **kwargs):
+        get = super().get
+        if not enabled():
+            return get(request, *args, **kwargs)
+
+        endpoint = type(self).__name__
+        key = response_key(request, endpoint, self.cache_namespaces, self.get_visibility())
+        # Errors are raised out of build(), so only successful responses are cached
+        data, hit = fetch(key, lambda: get(request, *args, **kwargs).data)
+
+        if hit:
+            self.personalize(data)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
@@ -1,3 +1,556 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app_common import authentication, profiling, response_cache, throttling, toggles
+from app_common.profiling import QueryBudgetExceeded, QueryProfile
+from app_post import models
+from app_post.serializers import CommentPostSerializer
+from app_post.tests import create_post, create_user
+from app_post.urls import urlpatterns as post_urls
+from app_post.view_buffer import record_view
+from app_user.models import FollowModel, UserModel
+from app_user.urls import urlpatterns as user_urls
+
+
+@override_settings(QUERY_PROFILING=True, QUERY_BUDGET_MODE='raise')
+class QueryBudgetTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        fans = [create_user(f'fan{i}') for i in range(3)]
+        FollowModel.objects.create(follower=self.user, followed=self.author)
+        for fan in fans:
+            FollowModel.objects.create(follower=fan, followed=self.author)
+
+        self.post = create_post(self.author, likers=fans, commenters=fans)
+        self.story = models.StoryModel.objects.create(user=self.author, description='story')
+        self.comment = self.post.comments.first()
+        self.client.force_authenticate(self.user)
+
+    def test_every_route_has_a_budget(self):
+        routes = [f'api/post/{pattern.pattern}' for pattern in post_urls]
+        routes += [f'api/auth/{pattern.pattern}' for pattern in user_urls]
+
+        missing = [route for route in routes if route not in settings.QUERY_BUDGETS]
+        self.assertEqual(missing, [])
+
+    def test_endpoints_stay_within_budget(self):
+        urls = [
+            '/api/post/', '/api/post/feed/', f'/api/post/{self.post.pk}/', f'/api/post/user/{self.author.pk}/',
+            f'/api/post/{self.post.pk}/like/', '/api/post/comment/', f'/api/post/{self.post.pk}/comment/',
+            f'/api/post/comment/{self.comment.pk}/', f'/api/post/comment/user/{self.author.pk}/',
+            f'/api/post/comment/{self.comment.pk}/like/', '/api/post/story/', f'/api/post/story/{self.story.pk}/',
+            f'/api/post/story/user/{self.author.pk}/', '/api/post/story/tray/',
+            f'/api/post/story/{self.story.pk}/like/', '/api/post/tag/', '/api/post/top/',
+            f'/api/auth/profile/{self.author.pk}/', f'/api/auth/mark/{self.author.pk}/',
+            f'/api/auth/{self.author.pk}/follow/', f'/api/auth/followers/{self.author.pk}/',
+            f'/api/auth/following/{self.user.pk}/',
+        ]
+
+        # Over budget, the middleware raises QueryBudgetExceeded through the test client
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('queries', response['Server-Timing'])
+
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/auth/login/', {'username_or_email_or_phone_number': 'viewer',
+                                                         'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_deletes_stay_within_budget(self):
+        # Deleting sends post_delete for every like, comment, mark and follow it takes along,
+        # so these budgets hold for rows with a few of each
+        self.client.force_authenticate(self.comment.user)
+        self.assertEqual(self.client.delete(f'/api/post/comment/{self.comment.pk}/').status_code, 204)
+
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.delete(f'/api/post/story/{self.story.pk}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'/api/post/{self.post.pk}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'/api/auth/profile/{self.author.pk}/').status_code, 204)
+
+    @override_settings(QUERY_BUDGETS={'api/post/': {'GET': 1}})
+    def test_over_budget_raises(self):
+        with self.assertRaisesRegex(QueryBudgetExceeded, 'GET api/post/ ran'):
+            self.client.get('/api/post/')
+
+    @override_settings(QUERY_BUDGETS={'api/post/': 1}, QUERY_BUDGET_MODE='warn')
+    def test_over_budget_warns(self):
+        with self.assertLogs('app_common.profiling', 'WARNING') as logs:
+            response = self.client.get('/api/post/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('its budget is 1', logs.output[0])
+
+    def test_profile_reports_duplicates_and_serializers(self):
+        request = self.client.get('/api/post/').wsgi_request
+        comments = models.CommentPostModel.objects.filter(post=self.post)
+        with QueryProfile() as profile:
+            CommentPostSerializer(comments, many=True, context={'request': request}).data
+
+        # Without setup_eager_loading the serializer reads the post of every comment one by one
+        self.assertGreater(max(profile.duplicates().values()), 1)
+        self.assertIn('CommentPostSerializer.to_representation', profile.origins())
+        self.assertEqual(profile.summary()['count'], profile.count)
+
+    def test_query_profile_as_context_manager(self):
+        with QueryProfile() as profile:
+            list(models.CommentPostModel.objects.filter(post=self.post))
+            list(models.CommentPostModel.objects.filter(post=self.post))
+
+        self.assertEqual(profile.count, 2)
+        self.assertEqual(list(profile.duplicates().values()), [2])
+
+    def test_dump_writes_the_costliest_profile_per_endpoint(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with override_settings(QUERY_PROFILE_DIR=directory), mock.patch.dict(profiling._dumped, clear=True):
+            self.client.get(f'/api/post/story/{self.story.pk}/')
+
+        [name] = os.listdir(directory)
+        with open(os.path.join(directory, name)) as file:
+            profile = json.load(file)
+
+        self.assertEqual(profile['endpoint'], 'GET api/post/story/<int:pk>/')
+        self.assertEqual(profile['count'], len(profile['queries']))
+        self.assertIn('origin', profile['queries'][0])
+
+
+PAGE = 100
+
+
+@override_settings(QUERY_PROFILING=True, QUERY_BUDGET_MODE='raise',
+                   REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'PAGE_SIZE': PAGE})
+@mock.patch.object(PageNumberPagination, 'page_size', PAGE)
+class QueryBudgetFullPageTest(APITestCase):
+    """
+    Budgets hold at the largest page a client can ask for, with every row on it liked, commented and marked
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.author = create_user('author')
+        cls.fans = UserModel.objects.bulk_create([
+            UserModel(username=f'fan{i}', email=f'fan{i}@gmail.com', phone_number=f'+999{i:09d}',
+                      password=cls.user.password)
+            for i in range(PAGE)
+        ])
+        FollowModel.objects.bulk_create(
+            [FollowModel(follower=cls.user, followed=cls.author)]
+            + [FollowModel(follower=fan, followed=cls.author) for fan in cls.fans]
+            + [FollowModel(follower=cls.user, followed=fan) for fan in cls.fans]
+        )
+
+        cls.posts = models.PostModel.objects.bulk_create([
+            models.PostModel(user=cls.author, description=f'post {i} with @viewer', trending_score=PAGE - i)
+            for i in range(PAGE)
+        ])
+        cls.stories = models.StoryModel.objects.bulk_create(
+            [models.StoryModel(user=cls.author, description=f'story {i}') for i in range(PAGE)]
+            + [models.StoryModel(user=fan, description='story') for fan in cls.fans]
+        )
+        tags = models.TagModel.objects.bulk_create([models.TagModel(tag=f'#tag{i}') for i in range(PAGE)])
+        photos = models.PhotoModel.objects.bulk_create([models.PhotoModel(photo='Post/Photos/photo.jpg')
+                                                       for _ in cls.posts])
+        videos = models.VideoModel.objects.bulk_create([models.VideoModel(video='Post/Videos/video.mp4')
+                                                       for _ in cls.posts])
+
+        for name, related in [('photos', photos), ('videos', videos), ('tags', tags), ('connected_users', cls.fans)]:
+            field = models.PostModel._meta.get_field(name)
+            through = field.remote_field.through
+            through.objects.bulk_create([through(**{field.m2m_field_name(): post, field.m2m_reverse_field_name(): row})
+                                         for post, row in zip(cls.posts, related)])
+
+        # The first fan likes, comments and marks every post, everybody does the first post
+        pairs = [(cls.posts[0], fan) for fan in cls.fans[1:]] + [(post, cls.fans[0]) for post in cls.posts]
+        models.LikePostModel.objects.bulk_create([models.LikePostModel(post=post, user=fan) for post, fan in pairs])
+        models.MarkModel.objects.bulk_create([models.MarkModel(post=post, user=fan) for post, fan in pairs])
+        cls.comments = models.CommentPostModel.objects.bulk_create([
+            models.CommentPostModel(post=post, user=fan, comment='nice') for post, fan in pairs
+        ])
+        models.LikeCommentModel.objects.bulk_create(
+            [models.LikeCommentModel(comment=cls.comments[0], user=fan) for fan in cls.fans]
+            + [models.LikeCommentModel(comment=comment, user=fan) for comment, fan in zip(cls.comments[1:], cls.fans)]
+        )
+        models.LikeStoryModel.objects.bulk_create([models.LikeStoryModel(story=cls.stories[0], user=fan)
+                                                   for fan in cls.fans])
+        call_command('repair_counters', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_full_pages_stay_within_budget(self):
+        post, comment, story = self.posts[0], self.comments[0], self.stories[0]
+        urls = [
+            '/api/post/', '/api/post/feed/', f'/api/post/user/{self.author.pk}/', f'/api/post/{post.pk}/like/',
+            '/api/post/comment/', f'/api/post/{post.pk}/comment/', f'/api/post/comment/user/{self.fans[0].pk}/',
+            f'/api/post/comment/{comment.pk}/like/', '/api/post/story/', f'/api/post/story/user/{self.author.pk}/',
+            f'/api/post/story/{story.pk}/like/', '/api/post/tag/', '/api/post/top/',
+            f'/api/auth/{self.author.pk}/follow/', f'/api/auth/followers/{self.author.pk}/',
+            f'/api/auth/following/{self.user.pk}/', f'/api/auth/mark/{self.fans[0].pk}/',
+            '/api/post/async/', '/api/post/async/story/', f'/api/auth/async/followers/{self.author.pk}/',
+        ]
+
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, {'page_size': PAGE})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), PAGE)
+
+        for url in [f'/api/post/{post.pk}/', f'/api/post/comment/{comment.pk}/', f'/api/post/story/{story.pk}/',
+                    f'/api/auth/profile/{self.author.pk}/', '/api/post/story/tray/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_updates_stay_within_budget(self):
+        self.client.force_authenticate(self.comments[0].user)
+        response = self.client.patch(f'/api/post/comment/{self.comments[0].pk}/', {'comment': 'edited'})
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.patch(f'/api/post/{self.posts[0].pk}/', {'description': 'edited'}).status_code, 200)
+        response = self.client.patch(f'/api/post/story/{self.stories[0].pk}/', {'description': 'edited'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_full_batch_stays_within_budget(self):
+        events = [{'type': kind, 'target': target, 'id': obj.pk}
+                  for kind, target, objects in [('like', 'post', self.posts), ('mark', 'post', self.posts),
+                                                ('like', 'comment', self.comments), ('view', 'story', self.stories),
+                                                ('unlike', 'story', self.stories)]
+                  for obj in objects[:PAGE]]
+
+        # Every post mentions the requester, so marks go on all of them
+        response = self.client.post('/api/post/interactions/', {'events': events}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('forbidden', {result['status'] for result in response.data['results']})
+
+
+class CachedAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def queries(self, url, status=200):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, status)
+        return len(queries)
+
+    def test_cached_row_saves_a_query(self):
+        url = f'/api/auth/profile/{self.author.pk}/'
+        warm = self.queries(url) and self.queries(url)
+        cache.delete(authentication.user_key(self.user.pk))
+        self.assertEqual(self.queries(url), warm + 1)
+        self.assertEqual(self.queries(url), warm)
+
+    def test_claims_views_never_load_the_row(self):
+        url = f'/api/auth/followers/{self.author.pk}/'
+        cold = self.queries(url)
+        self.assertEqual(self.queries(url), cold)
+        cache.clear()
+        self.assertEqual(self.queries(url), cold)
+        self.assertFalse(cache.get(authentication.user_key(self.user.pk)))
+
+    def test_deactivation_takes_effect_at_once(self):
+        for url in (f'/api/auth/profile/{self.author.pk}/', f'/api/auth/followers/{self.author.pk}/'):
+            self.queries(url)
+        self.user.is_active = False
+        self.user.save()
+
+        for url in (f'/api/auth/profile/{self.author.pk}/', f'/api/auth/followers/{self.author.pk}/'):
+            with self.subTest(url=url):
+                self.queries(url, status=401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.queries(f'/api/auth/followers/{self.author.pk}/')
+
+    def test_deleted_user_is_rejected(self):
+        self.queries(f'/api/auth/profile/{self.author.pk}/')
+        self.user.delete()
+        self.queries(f'/api/auth/profile/{self.author.pk}/', status=401)
+        self.queries(f'/api/auth/followers/{self.author.pk}/', status=401)
+
+
+@override_settings(THROTTLE_RULES={'test': {'ip': (3, 10), 'destination': (2, 10)}})
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_window_slides(self):
+        for store in ('app_common.throttling.CacheStore', 'app_common.throttling.LocalStore'):
+            with self.subTest(store=store), override_settings(THROTTLE_STORE=store):
+                keys = {'ip': store}
+                for _ in range(3):
+                    self.assertIsNone(throttling.limit('test', keys, now=1002))
+                self.assertEqual(throttling.limit('test', keys, now=1005), 5)
+
+                # Half the previous window is still in: 1.5 of its 3
+                for _ in range(2):
+                    self.assertIsNone(throttling.limit('test', keys, now=1015))
+                self.assertEqual(throttling.limit('test', keys, now=1015), 5)
+                # Then only 0.3 of it
+                self.assertIsNone(throttling.limit('test', keys, now=1019))
+
+    def test_every_key_counts(self):
+        keys = {'ip': '10.0.0.1', 'destination': ['a@gmail.com', 'b@gmail.com'], 'unknown': 'ignored'}
+        for _ in range(2):
+            self.assertIsNone(throttling.limit('test', keys, now=1000))
+        self.assertIsNotNone(throttling.limit('test', {'destination': 'b@gmail.com'}, now=1000))
+        self.assertIsNone(throttling.limit('test', {'destination': 'c@gmail.com'}, now=1000))
+
+        throttling.reset('test', {'destination': 'b@gmail.com'}, now=1000)
+        self.assertIsNone(throttling.limit('test', {'destination': 'b@gmail.com'}, now=1000))
+
+    @override_settings(THROTTLE_RULES={'resend': {'ip': (100, 600), 'destination': (2, 600)}})
+    def test_floods_are_shed_before_any_work(self):
+        user = create_user('newcomer', is_active=False)
+        client = APIClient()
+
+        with mock.patch('app_user.views.send_confirmation', return_value=True) as send:
+            statuses = [client.post('/api/auth/resend-email/', {'email_or_phone_number': user.email}).status_code
+                        for _ in range(5)]
+            with self.assertNumQueries(0):
+                client.post('/api/auth/resend-email/', {'email_or_phone_number': user.email.upper()})
+
+        self.assertEqual(statuses, [200, 200, 429, 429, 429])
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(throttling.stats()['resend'], {'ip': 0, 'destination': 4})
+
+        out = StringIO()
+        call_command('throttle_stats', reset=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['resend']['destination'], 4)
+        self.assertEqual(throttling.stats()['resend']['destination'], 0)
+
+    @override_settings(THROTTLE_RULES={'resend': {'ip': (2, 600), 'destination': (100, 600)}})
+    def test_forwarded_for_headers_do_not_change_the_client_ip(self):
+        client = APIClient()
+
+        with mock.patch('app_user.views.send_confirmation', return_value=True):
+            statuses = [client.post('/api/auth/resend-email/', {'email_or_phone_number': f'user{n}@gmail.com'},
+                                    REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'192.168.0.{n}').status_code
+                        for n in range(4)]
+
+        self.assertEqual(statuses[2:], [429, 429])
+        self.assertEqual(throttling.stats()['resend']['ip'], 2)
+
+
+class TogglesTest(TestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        author = create_user('author')
+        self.posts = [create_post(author, description=f'post{i}') for i in range(4)]
+        self.pks = [post.pk for post in self.posts]
+
+    def test_add_and_remove_change_a_row_once(self):
+        post = self.posts[0]
+
+        like = toggles.add(models.LikePostModel, user=self.user, post=post)
+        self.assertIsNotNone(like.pk)
+        self.assertIsNone(toggles.add(models.LikePostModel, user=self.user, post=post))
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+
+        self.assertEqual(toggles.remove(models.LikePostModel, user=self.user, post=post).pk, like.pk)
+        self.assertIsNone(toggles.remove(models.LikePostModel, user=self.user, post=post))
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+    def test_many_report_only_the_rows_they_changed(self):
+        models.LikePostModel.objects.create(user=self.user, post=self.posts[0])
+        rows = [{'user_id': self.user.pk, 'post_id': pk} for pk in self.pks]
+
+        inserted = toggles.add_many(models.LikePostModel, rows)
+        self.assertEqual(sorted(like.post_id for like in inserted), self.pks[1:])
+        self.assertTrue(all(like.pk for like in inserted))
+        self.assertEqual(toggles.add_many(models.LikePostModel, rows), [])
+
+        likes = models.LikePostModel.objects.filter(post_id__in=self.pks[:2])
+        self.assertEqual(sorted(like.post_id for like in toggles.remove_many(likes)), self.pks[:2])
+        self.assertEqual(toggles.remove_many(likes), [])
+        self.assertEqual(models.LikePostModel.objects.count(), 2)
+
+    def test_rows_inserted_since_the_read_are_not_reported(self):
+        rows = [{'user_id': self.user.pk, 'post_id': pk} for pk in self.pks]
+        models.LikePostModel.objects.create(user=self.user, post=self.posts[0])
+
+        # As if another request inserted it between the read and the INSERT
+        with mock.patch('app_common.toggles._existing', return_value=set()):
+            inserted = toggles.add_many(models.LikePostModel, rows)
+
+        self.assertEqual(sorted(like.post_id for like in inserted), self.pks[1:])
+        self.assertEqual(models.LikePostModel.objects.count(), len(self.pks))
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        self.post = create_post(self.author, likers=[self.author])
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_second_request_is_a_hit(self):
+        url = f'/api/post/user/{self.author.pk}/'
+        self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(1):
+            # is_liked of the requester
+            response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.get(f'{url}?page_size=1')['X-Cache'], 'MISS')
+        self.assertEqual(response_cache.stats(), {'hits': 1, 'misses': 2, 'coalesced': 0, 'hit_ratio': 1 / 3})
+
+    def test_writes_invalidate(self):
+        url = f'/api/post/user/{self.author.pk}/'
+        tag = self.post.tags.get()
+        self.get(url)
+        self.get(f'/api/post/tag/{tag.pk}/')
+
+        models.LikePostModel.objects.create(user=self.user, post=self.post)
+        tag.tag = '#renamed'
+        tag.save()
+
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['total_likes'], 2)
+        self.assertEqual(self.get(f'/api/post/tag/{tag.pk}/').data['tag'], '#renamed')
+
+    def test_is_liked_is_the_requesters(self):
+        url = f'/api/post/user/{self.author.pk}/'
+        fan = create_user('fan')
+        self.client.force_authenticate(self.author)
+        self.assertTrue(self.get(url).data['results'][0]['is_liked'])
+
+        self.client.force_authenticate(self.user)
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')  # the author is the owner, the viewer is not
+        self.assertFalse(response.data['results'][0]['is_liked'])
+
+        # Written without signals, so the cached page is not invalidated
+        models.LikePostModel.objects.bulk_create([models.LikePostModel(user=fan, post=self.post)])
+        self.client.force_authenticate(fan)
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertTrue(response.data['results'][0]['is_liked'])
+
+    def test_concurrent_misses_are_coalesced(self):
+        key = 'response:test'
+        cache.add(f'{key}:lock', 1)
+        # The request holding the lock stores its result a little later
+        timer = threading.Timer(0.1, cache.set, (key, 'built'))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        value, hit = response_cache.fetch(key, mock.Mock(side_effect=AssertionError('built twice')))
+
+        self.assertEqual((value, hit), ('built', True))
+        self.assertEqual(response_cache.stats()['coalesced'], 1)
+
+    @override_settings(RESPONSE_CACHE_LOCK_TIMEOUT=30)
+    def test_waiters_build_once_the_lock_is_released_without_a_result(self):
+        key = 'response:test'
+        cache.add(f'{key}:lock', 1)
+        # The request holding the lock fails
+        timer = threading.Timer(0.1, cache.delete, (f'{key}:lock',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        started = time.monotonic()
+        value, hit = response_cache.fetch(key, lambda: 'built')
+
+        self.assertEqual((value, hit), ('built', False))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_versions_never_go_back(self):
+        [before] = response_cache.versions(['posts'])
+        response_cache.bump('posts')
+        cache.clear()
+
+        [after] = response_cache.versions(['posts'])
+        self.assertGreater(after, before + 1)
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.get('/api/post/tag/')
+        self.assertNotIn('X-Cache', self.get('/api/post/tag/'))
+
+
+class BenchmarkCommandsTest(TestCase):
+    def test_generate_dataset_then_bench_every_endpoint(self):
+        call_command('generate_dataset', users=40, follows_per_user=8, posts_per_user=2, stdout=StringIO())
+
+        self.assertEqual(UserModel.objects.filter(username__startswith='gen').count(), 40)
+        self.assertTrue(FollowModel.objects.exists())
+        # Counters were repaired after the bulk inserts
+        post = models.PostModel.objects.order_by('-likes_count').first()
+        self.assertEqual(post.likes_count, post.likes.count())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'bench.json')
+        call_command('bench_endpoints', requests=2, warmup=0, output=output, stdout=StringIO(), stderr=StringIO())
+
+        with open(output) as file:
+            results = json.load(file)
+
+        routes = {result['route'] for result in results['endpoints'].values()}
+        self.assertEqual(routes, set(settings.QUERY_BUDGETS))
+        for name, result in results['endpoints'].items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(result['requests'], 2)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertNotIn('500', result['statuses'])
+        # Nothing the benchmark wrote is kept
+        self.assertFalse(UserModel.objects.filter(username__startswith='bench').exists())
+
+
+class AsgiBenchmarkTest(TransactionTestCase):
+    # WSGI requests are served from other threads, which only see committed rows
+
+    def test_every_mode_serves_every_endpoint(self):
+        call_command('generate_dataset', users=10, follows_per_user=4, posts_per_user=1, stdout=StringIO())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'bench.json')
+        # The in-memory test database fails concurrent writes at once instead of waiting: the view
+        # buffer is flushed here, so that no request flushes it while other threads use the database
+        with override_settings(ALLOWED_HOSTS=['localhost'], VIEW_BUFFER_FLUSH_INTERVAL=3600):
+            record_view(models.PostModel.objects.first())
+            call_command('bench_asgi', requests=4, concurrency=4, wsgi_threads=2, output=output, stdout=StringIO())
+
+        with open(output) as file:
+            results = json.load(file)
+
+        self.assertEqual(set(results['endpoints']), {'post list', 'post detail', 'story list', 'profile', 'followers'})
+        for name, modes in results['endpoints'].items():
+            self.assertEqual(set(modes), {'wsgi', 'asgi-sync', 'asgi'})
+            for mode, result in modes.items():
+                with self.subTest(endpoint=name, mode=mode):
+                    self.assertEqual(result['statuses'], {'200': 4})
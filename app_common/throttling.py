@@ -0,0 +1,224 @@
+"""
+Sliding window rate limits.
+
+THROTTLE_RULES maps a scope (e.g. 'resend') to rules per kind of key:
+{'ip': (10, 600), 'destination': (3, 600)} allows 10 requests per client IP
+and 3 per email address or phone number in any 600 seconds.
+
+The window slides by weighting the previous fixed window with the share of it
+still inside the sliding one:
+
+    count = previous * (1 - elapsed / window) + current
+
+which takes two counters per key and O(1) work per check, however high the
+rate. Counters live in a store, THROTTLE_STORE names its class:
+
+- CacheStore keeps them in THROTTLE_CACHE, shared between processes when the
+  cache is (Redis, Memcached)
+- LocalStore keeps them in this process, with no I/O at all, up to
+  THROTTLE_LOCAL_MAX_KEYS keys
+
+Views opt in with SlidingWindowThrottle and a throttle_scope, and return the
+keys other than the client IP from get_throttle_keys(request). The client IP
+is client_ip(request), X-Forwarded-For is only trusted for the NUM_PROXIES of
+REST_FRAMEWORK in front of the app. Refused
+requests are counted per scope and kind, see stats() and
+`manage.py throttle_stats`.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+KEY_PREFIX = 'throttle'
+
+
+class CacheStore:
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def incr(self, key, timeout):
+        if not self.cache.add(key, 1, timeout=timeout):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Expired between the two
+                self.cache.add(key, 1, timeout=timeout)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(keys)
+
+
+class LocalStore:
+    def __init__(self):
+        self.counters = OrderedDict()  # key -> [count, expires_at], oldest first
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            return {key: self.counters[key][0] for key in keys
+                    if key in self.counters and self.counters[key][1] > now}
+
+    def incr(self, key, timeout):
+        now = time.monotonic()
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None or counter[1] <= now:
+                self.counters[key] = [1, now + timeout if timeout is not None else float('inf')]
+                self.counters.move_to_end(key)
+            else:
+                counter[0] += 1
+
+            while len(self.counters) > getattr(settings, 'THROTTLE_LOCAL_MAX_KEYS', 100000):
+                self.counters.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.counters.pop(key, None)
+
+
+_stores = {}
+
+
+def store():
+    path = getattr(settings, 'THROTTLE_STORE', 'app_common.throttling.CacheStore')
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+def rules(scope):
+    return getattr(settings, 'THROTTLE_RULES', {}).get(scope, {})
+
+
+def _pairs(scope, keys):
+    """
+    (kind, key) of keys ({kind: key or list of keys}) the scope has a rule for
+    """
+    scope_rules = rules(scope)
+    for kind, values in keys.items():
+        if kind not in scope_rules:
+            continue
+        for value in values if isinstance(values, (list, tuple, set)) else [values]:
+            if value:
+                yield kind, value
+
+
+def _counter_keys(scope, kind, key, window, now):
+    # Keys are user input (addresses, identifiers), a digest is a safe key for any backend
+    digest = hashlib.sha256(str(key).encode()).hexdigest()[:32]
+    bucket = int(now // window)
+    base = f'{KEY_PREFIX}:{scope}:{kind}:{digest}:{window}'
+    return f'{base}:{bucket}', f'{base}:{bucket - 1}'
+
+
+def _shed_key(scope, kind):
+    return f'{KEY_PREFIX}:shed:{scope}:{kind}'
+
+
+def check(scope, keys, now=None):
+    """
+    Seconds to wait if one of keys is over its limit in scope (counted as shed), else None
+    """
+    now = now or time.time()
+    counters = {}
+    for kind, key in _pairs(scope, keys):
+        _, window = rules(scope)[kind]
+        counters[kind, key] = _counter_keys(scope, kind, key, window, now)
+
+    counts = store().get_many([name for pair in counters.values() for name in pair])
+    for (kind, key), (current, previous) in counters.items():
+        allowed, window = rules(scope)[kind]
+        elapsed = now % window / window
+        if counts.get(previous, 0) * (1 - elapsed) + counts.get(current, 0) >= allowed:
+            store().incr(_shed_key(scope, kind), timeout=None)
+            # By then the previous window has slid out
+            return window - now % window
+
+    return None
+
+
+def hit(scope, keys, now=None):
+    now = now or time.time()
+    for kind, key in _pairs(scope, keys):
+        _, window = rules(scope)[kind]
+        current, _ = _counter_keys(scope, kind, key, window, now)
+        # Read until the end of the next window
+        store().incr(current, timeout=2 * window)
+
+
+def limit(scope, keys, now=None):
+    """
+    check() and, when allowed, hit(): seconds to wait or None
+    """
+    wait = check(scope, keys, now=now)
+    if wait is None:
+        hit(scope, keys, now=now)
+    return wait
+
+
+def reset(scope, keys, now=None):
+    now = now or time.time()
+    names = []
+    for kind, key in _pairs(scope, keys):
+        _, window = rules(scope)[kind]
+        names += _counter_keys(scope, kind, key, window, now)
+    store().delete_many(names)
+
+
+def stats():
+    """
+    {scope: {kind: requests shed}} for every rule
+    """
+    all_rules = getattr(settings, 'THROTTLE_RULES', {})
+    names = {(scope, kind): _shed_key(scope, kind) for scope, kinds in all_rules.items() for kind in kinds}
+    counts = store().get_many(list(names.values()))
+    result = {}
+    for (scope, kind), name in names.items():
+        result.setdefault(scope, {})[kind] = counts.get(name, 0)
+    return result
+
+
+def reset_stats():
+    store().delete_many([_shed_key(scope, kind)
+                         for scope, kinds in getattr(settings, 'THROTTLE_RULES', {}).items() for kind in kinds])
+
+
+def client_ip(request):
+    """
+    The IP request came from, as the 'ip' keys of THROTTLE_RULES count it
+    """
+    return BaseThrottle().get_ident(request)
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Limits a view by the THROTTLE_RULES of its throttle_scope: 'ip' per client IP,
+    other kinds per the keys view.get_throttle_keys(request) returns
+    """
+    retry_after = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            return True
+
+        keys = {'ip': client_ip(request)}
+        if hasattr(view, 'get_throttle_keys'):
+            keys.update(view.get_throttle_keys(request))
+
+        self.retry_after = limit(scope, keys)
+        return self.retry_after is None
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,197 @@
+"""
+Race-free add/remove of rows that exist at most once per unique constraint,
+such as likes and follows.
+
+add() saves the row in a savepoint and remove() deletes it by primary key, so
+concurrent double taps can neither create duplicates nor fail: the database
+decides which request changed the row. The unique constraint fails the other
+INSERTs, and the other DELETEs come back empty. post_save and post_delete are
+sent as save() and delete() would, but only by the request that did, so the
+receivers maintaining counters, trending scores, profiles and timelines run
+exactly once per change.
+
+add_many() and remove_many() do the same for many rows with one INSERT and
+one DELETE but send no signals: their callers apply what the receivers would
+have done in bulk (see app_post.interactions).
+
+remove() and remove_many() delete without collecting related rows, so they
+are only for rows nothing references with a foreign key.
+
+Only public API is used (save(), bulk_create(), select_for_update() and
+plain SQL for the DELETE), so nothing here depends on the ORM's internals.
+
+ToggleViewMixin serves likes and follows over them.
+"""
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models.signals import post_delete
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+# Primary keys per DELETE, below every backend's limit on query parameters
+DELETE_BATCH_SIZE = 500
+
+
+def add(model, **values):
+    """
+    Inserts model(**values) unless the unique constraint already holds such a row.
+    Returns the new instance, or None if nothing was inserted.
+    """
+    using = router.db_for_write(model)
+    instance = model(**values)
+    try:
+        # Only the savepoint is rolled back when the row exists, save() sends post_save otherwise
+        with transaction.atomic(using=using):
+            instance.save(force_insert=True, using=using)
+    except IntegrityError:
+        return None
+    return instance
+
+
+def _existing(model, rows, using):
+    """
+    Values of the given keys of rows (all with the same keys) that model already holds
+    """
+    names = list(rows[0])
+    return set(model.objects.using(using)
+               .filter(**{f'{name}__in': {values[name] for values in rows} for name in names})
+               .values_list(*names))
+
+
+def add_many(model, rows):
+    """
+    Inserts model(**values) for every values in rows (all with the same keys)
+    that no unique constraint already holds. Returns the inserted instances.
+    """
+    if not rows:
+        return []
+
+    using = router.db_for_write(model)
+    existing = _existing(model, rows, using)
+    instances = [model(**values) for values in rows if tuple(values.values()) not in existing]
+    if not instances:
+        return []
+
+    with transaction.atomic(using=using, savepoint=False):
+        try:
+            with transaction.atomic(using=using):
+                return model.objects.using(using).bulk_create(instances)
+        except IntegrityError:
+            pass
+
+        # Some were inserted concurrently since the read: one by one, each ignored if it fails alone
+        inserted = []
+        for instance in instances:
+            try:
+                with transaction.atomic(using=using):
+                    inserted += model.objects.using(using).bulk_create([instance])
+            except IntegrityError:
+                pass
+        return inserted
+
+
+def remove(model, **values):
+    """
+    Deletes the row matching values. Returns the deleted instance, or None if there was none.
+    """
+    using = router.db_for_write(model)
+
+    with transaction.atomic(using=using):
+        instance = model.objects.using(using).filter(**values).select_for_update().first()
+        # Whoever deletes the row sends the signal, a concurrent remove() deletes nothing
+        if instance is None or not _delete(model, [instance.pk], using):
+            return None
+
+        post_delete.send(sender=model, instance=instance, using=using, origin=instance)
+
+    return instance
+
+
+def remove_many(queryset):
+    """
+    Deletes the rows of queryset in one DELETE. Returns the deleted instances.
+    """
+    using = queryset.db
+
+    with transaction.atomic(using=using, savepoint=False):
+        instances = list(queryset.select_for_update())
+        deleted = _delete(queryset.model, [instance.pk for instance in instances], using)
+
+    return [instance for instance in instances if instance.pk in deleted]
+
+
+def _delete(model, pks, using):
+    """
+    Deletes the rows of pks without collecting or signalling anything.
+    Returns the pks this call deleted, not those a concurrent delete got to first.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+
+    deleted = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), DELETE_BATCH_SIZE):
+            batch = pks[start:start + DELETE_BATCH_SIZE]
+            sql = f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(batch))})'
+            if connection.features.can_return_columns_from_insert:
+                cursor.execute(f'{sql} RETURNING {column}', batch)
+                deleted.update(pk for pk, in cursor.fetchall())
+            else:
+                cursor.execute(sql, batch)
+                # Without RETURNING, the caller's select_for_update() kept concurrent deletes off these rows
+                if cursor.rowcount:
+                    deleted.update(batch)
+    return deleted
+
+
+class ToggleViewMixin:
+    """
+    PUT adds and DELETE removes the requester's row (of the view's queryset model)
+    pointing at the target, both idempotent, POST toggles. Every change is one
+    add() or remove() and the answer is {state_key: ..., counter_field: <counter after the change>}.
+    """
+    target_queryset = None  # the rows that can be targeted
+    target_kwarg = None  # URL keyword argument holding the target's pk
+    target_field = None  # foreign key to the target
+    actor_field = 'user'  # foreign key to the requester
+    counter_field = None  # counter of rows on the target
+    state_key = None
+
+    def get_target_queryset(self):
+        return self.target_queryset.all()
+
+    def get_target(self):
+        target = self.get_target_queryset().filter(pk=self.kwargs.get(self.target_kwarg)).first()
+        if not target:
+            self.request.failed_status_code = status.HTTP_404_NOT_FOUND
+            raise NotFound(f'{self.target_kwarg.removesuffix("_id").capitalize()} not found')
+        return target
+
+    def respond(self, target, state, created=False):
+        count = type(target).objects.filter(pk=target.pk).values_list(self.counter_field, flat=True).first()
+        return Response({self.state_key: state, self.counter_field: count},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def add(self, target):
+        return add(self.queryset.model, **{self.actor_field: self.request.user, self.target_field: target})
+
+    def remove(self, target):
+        return remove(self.queryset.model, **{self.actor_field: self.request.user, self.target_field: target})
+
+    def put(self, request, *args, **kwargs):
+        target = self.get_target()
+        return self.respond(target, True, created=self.add(target) is not None)
+
+    def delete(self, request, *args, **kwargs):
+        target = self.get_target()
+        self.remove(target)
+        return self.respond(target, False)
+
+    def post(self, request, *args, **kwargs):
+        target = self.get_target()
+        if self.add(target) is not None:
+            return self.respond(target, True, created=True)
+
+        self.remove(target)
+        return self.respond(target, False)
@@ -85,13 +85,13 @@ class LikeCommentModelAdmin(admin.ModelAdmin):
 
 @admin.register(models.StoryModel)
 class StoryModelAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user__username', 'description', 'created_at', 'is_cached')
+    list_display = ('id', 'user__username', 'description', 'created_at', 'expires_at', 'is_archived', 'is_cached')
     list_display_links = list_display
     search_fields = ('user__username',
                      'user__email',
                      'user__phone_number',
                      'description')
-    list_filter = ('user', 'created_at', 'is_deleted', 'is_cached')
+    list_filter = ('user', 'created_at', 'is_deleted', 'is_archived', 'is_cached')
     ordering = ('-created_at',)
 
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AppPostConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_post'
+
+    def ready(self):
+        import app_post.signals
@@ -0,0 +1,72 @@
+"""
+#tags and @mentions of post and story captions.
+
+The caption is parsed once, mentions are resolved with one IN query and tags,
+marks and their M2M rows are written with bulk inserts, so creating a post
+costs the same number of queries whatever the caption holds.
+
+Bulk inserts skip the post_save receivers of app_post.signals, so what they
+would do for tags and marks (search index, marks_count, trending score,
+profile cache) is done here in bulk as well.
+"""
+import re
+
+from app_common.counters import adjust_counter
+from app_post import search, trending
+from app_post.models import MarkModel, PostModel, TagModel
+from app_user.cache import invalidate_profile
+from app_user.models import UserModel
+
+TAG = re.compile(r'#\w+')
+# Usernames may contain . + - but do not end with them ("thanks @bob.")
+MENTION = re.compile(r'@([\w.+-]*\w)')
+
+
+def extract(text):
+    """
+    Returns (tags, usernames) of text, each once and in order of appearance
+    """
+    tags = list(dict.fromkeys(TAG.findall(text or '')))
+    usernames = list(dict.fromkeys(name.lower() for name in MENTION.findall(text or '')))
+    return tags, usernames
+
+
+def attach_tags(instance, tags):
+    if not tags:
+        return
+
+    TagModel.objects.bulk_create([TagModel(tag=tag) for tag in tags], ignore_conflicts=True)
+    tag_objects = list(TagModel.objects.filter(tag__in=tags))
+    search.get_backend().index_many(tag_objects)
+
+    through = instance.tags.through
+    source = f'{type(instance)._meta.model_name}_id'
+    through.objects.bulk_create([through(**{source: instance.pk, 'tagmodel_id': tag.pk}) for tag in tag_objects],
+                                ignore_conflicts=True)
+
+
+def mark_users(instance, usernames):
+    """
+    Marks the mentioned users that exist on instance (a new post or story)
+    """
+    if not usernames:
+        return
+
+    user_ids = list(UserModel.objects.filter(username__in=usernames).values_list('pk', flat=True))
+    if not user_ids:
+        return
+
+    target = 'post' if isinstance(instance, PostModel) else 'story'
+    MarkModel.objects.bulk_create([MarkModel(user_id=user_id, **{target: instance}) for user_id in user_ids],
+                                  ignore_conflicts=True)
+
+    adjust_counter(type(instance), instance.pk, 'marks_count', len(user_ids))
+    if target == 'post':
+        trending.record([instance.pk], 'mark', count=len(user_ids))
+    invalidate_profile(*user_ids)
+
+
+def attach_caption(instance, text):
+    tags, usernames = extract(text)
+    attach_tags(instance, tags)
+    mark_users(instance, usernames)
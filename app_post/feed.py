@@ -0,0 +1,203 @@
+"""
+Home feed timelines.
+
+Every follower's timeline is a capped list of post ids (newest first) kept in
+the cache. Creating a post pushes its id into the timelines of the author's
+followers (fan-out-on-write), so reading a feed page only slices that list.
+
+Authors with more than FEED_FANOUT_MAX_FOLLOWERS followers are not fanned out;
+their posts are pulled when a follower reads the feed (fan-out-on-read).
+
+Timelines are built lazily from FollowModel on the first read and only cached
+ones are updated on write, so inactive followers cost nothing.
+
+Updates read a timeline, change it and write it back, each holding that
+timeline's lock (a cache.add() key) so concurrent ones do not overwrite each
+other. A timeline still locked after FEED_LOCK_TIMEOUT seconds is dropped
+instead, to be rebuilt from the database on its next read.
+"""
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from operator import neg
+
+from django.conf import settings
+from django.core.cache import caches
+
+from app_post.models import PostModel
+from app_user.models import FollowModel, UserModel
+
+FANOUT_BATCH_SIZE = 500
+LOCK_POLL_INTERVAL = 0.01
+
+
+def _cache():
+    return caches[getattr(settings, 'FEED_CACHE', 'default')]
+
+
+def _timeline_size():
+    return getattr(settings, 'FEED_TIMELINE_SIZE', 800)
+
+
+def _timeline_ttl():
+    return getattr(settings, 'FEED_TIMELINE_TTL', 60 * 60 * 24 * 7)
+
+
+def _max_followers():
+    return getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 10000)
+
+
+def timeline_key(user_id):
+    return f'feed:timeline:{user_id}'
+
+
+@contextmanager
+def _locked(cache, keys):
+    """
+    Holds the locks of the timeline keys it yields, the ones it could take in time
+    """
+    timeout = getattr(settings, 'FEED_LOCK_TIMEOUT', 5)
+    deadline = time.monotonic() + timeout
+    held, waiting = [], list(keys)
+    try:
+        while True:
+            taken = {key for key in waiting if cache.add(f'{key}:lock', 1, timeout=timeout)}
+            held += taken
+            waiting = [key for key in waiting if key not in taken]
+            if not waiting or time.monotonic() >= deadline:
+                break
+            time.sleep(LOCK_POLL_INTERVAL)
+
+        if waiting:
+            # Rebuilt from the database on their next read, with this update in it
+            cache.delete_many(waiting)
+        yield held
+    finally:
+        cache.delete_many([f'{key}:lock' for key in held])
+
+
+def _followed_ids(user_id, celebrities):
+    queryset = UserModel.objects.filter(followers__follower_id=user_id)
+    if celebrities:
+        queryset = queryset.filter(followers_count__gt=_max_followers())
+    else:
+        queryset = queryset.filter(followers_count__lte=_max_followers())
+    return queryset.values('pk')
+
+
+def _recent_post_ids(user_ids, before=None, limit=None):
+    queryset = PostModel.objects.filter(user_id__in=user_ids, is_deleted=False)
+    if before:
+        queryset = queryset.filter(pk__lt=before)
+    return list(queryset.order_by('-pk').values_list('pk', flat=True)[:limit or _timeline_size()])
+
+
+def _merge(*id_lists, limit=None):
+    return sorted(set().union(*id_lists), reverse=True)[:limit or _timeline_size()]
+
+
+def get_timeline(user_id):
+    """
+    Returns the cached timeline of user_id, building it from FollowModel on a miss
+    """
+    cache = _cache()
+    timeline = cache.get(timeline_key(user_id))
+
+    if timeline is None:
+        timeline = _recent_post_ids(_followed_ids(user_id, celebrities=False))
+        cache.set(timeline_key(user_id), timeline, timeout=_timeline_ttl())
+
+    return timeline
+
+
+def feed_page(user_id, before=None, limit=10):
+    """
+    Post ids of one feed page, newest first, older than `before` if given
+    """
+    timeline = get_timeline(user_id)
+    if before:
+        # The timeline is sorted newest first, so skip to the first id below `before`
+        timeline = timeline[bisect_right(timeline, -before, key=neg):]
+
+    # Posts of high-follower accounts are merged in at read time
+    pulled = _recent_post_ids(_followed_ids(user_id, celebrities=True), before=before, limit=limit)
+
+    return _merge(timeline[:limit], pulled, limit=limit)
+
+
+def fan_out_post(post):
+    """
+    Pushes a new post into the cached timelines of the author's followers
+    """
+    # Read the counter from the database, the author instance may be stale
+    is_celebrity = UserModel.objects.filter(pk=post.user_id, followers_count__gt=_max_followers()).exists()
+    if not post.user_id or is_celebrity:
+        return
+
+    cache = _cache()
+    follower_ids = (FollowModel.objects
+                    .filter(followed_id=post.user_id)
+                    .values_list('follower_id', flat=True)
+                    .iterator(chunk_size=FANOUT_BATCH_SIZE))
+
+    batch = []
+    for follower_id in follower_ids:
+        batch.append(timeline_key(follower_id))
+        if len(batch) == FANOUT_BATCH_SIZE:
+            _push(cache, batch, post.pk)
+            batch = []
+
+    if batch:
+        _push(cache, batch, post.pk)
+
+
+def _push(cache, keys, post_id):
+    with _locked(cache, keys) as held:
+        timelines = cache.get_many(held)
+        cache.set_many(
+            {key: _merge(timeline, [post_id]) for key, timeline in timelines.items()},
+            timeout=_timeline_ttl()
+        )
+
+
+def backfill(follower_id, followed_id):
+    """
+    Merges the recent posts of a newly followed account into the follower's timeline
+    """
+    cache = _cache()
+    if cache.get(timeline_key(follower_id)) is None:
+        return
+
+    if UserModel.objects.filter(pk=followed_id, followers_count__gt=_max_followers()).exists():
+        return
+
+    recent = _recent_post_ids([followed_id])
+    with _locked(cache, [timeline_key(follower_id)]) as held:
+        timeline = cache.get(timeline_key(follower_id)) if held else None
+        if timeline is not None:
+            cache.set(timeline_key(follower_id), _merge(timeline, recent), timeout=_timeline_ttl())
+
+
+def trim(follower_id, followed_id):
+    """
+    Drops the posts of an unfollowed account from the follower's timeline
+    """
+    cache = _cache()
+    timeline = cache.get(timeline_key(follower_id))
+
+    if not timeline:
+        return
+
+    removed = set(PostModel.objects
+                  .filter(user_id=followed_id, pk__in=timeline)
+                  .values_list('pk', flat=True))
+    if not removed:
+        return
+
+    with _locked(cache, [timeline_key(follower_id)]) as held:
+        # Re-read under the lock, posts pushed since stay
+        timeline = cache.get(timeline_key(follower_id)) if held else None
+        if timeline:
+            cache.set(timeline_key(follower_id),
+                      [pk for pk in timeline if pk not in removed],
+                      timeout=_timeline_ttl())
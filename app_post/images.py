@@ -0,0 +1,212 @@
+"""
+Renditions of uploaded photos (PhotoModel.photo and StoryModel.photo).
+
+Every upload is resized to the IMAGE_RENDITIONS sizes (longest side, never
+upscaled) and encoded as WebP and JPEG without EXIF, after applying the EXIF
+orientation. The result is stored next to the original and recorded in the
+model's renditions JSON field:
+
+    {'source': <original name>, 'width': ..., 'height': ...,
+     'thumbnail': {'width': ..., 'height': ..., 'webp': <name>, 'jpeg': <name>}, ...}
+
+Reading and resizing run in a process pool of IMAGE_PROCESSING_WORKERS
+processes once the upload's transaction commits, so requests never wait for
+the disk or Pillow; workers read the original by its path in the (local)
+media storage. With IMAGE_PROCESSING_SYNC it runs inline instead (tests,
+management commands).
+
+Until its renditions exist an image is served as pending, never as the
+original, which still carries the uploader's EXIF (location, camera).
+
+render() and render_file() only need Pillow, so this module must not import models.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from threading import Lock
+
+from PIL import ExifTags, Image, ImageOps
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+# Faster encoder settings; optimize/progressive JPEG and WebP method >= 3 cost several times more CPU
+SAVE_OPTIONS = {'WEBP': {'method': 2}, 'JPEG': {}}
+# EXIF orientations that swap width and height
+ROTATED = {5, 6, 7, 8}
+
+_pool = None
+_pool_lock = Lock()
+
+
+def rendition_sizes():
+    return getattr(settings, 'IMAGE_RENDITIONS', {'thumbnail': 320, 'feed': 1080, 'full': 2048})
+
+
+def image_quality():
+    return getattr(settings, 'IMAGE_QUALITY', 80)
+
+
+def _encode(image, fmt, quality):
+    if fmt == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel, flatten on white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+
+    buffer = BytesIO()
+    # Saving without exif= drops every EXIF/XMP block of the source
+    image.save(buffer, fmt, quality=quality, **SAVE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def render(data, sizes, quality):
+    """
+    Builds every rendition of the encoded image `data`.
+    Returns (width, height, {name: (width, height, {ext: bytes})}).
+    """
+    with Image.open(BytesIO(data)) as source:
+        width, height = source.size
+        if source.getexif().get(ExifTags.Base.Orientation) in ROTATED:
+            width, height = height, width
+
+        # Lets JPEG decode straight at a fraction of the size when that is still big enough
+        source.draft('RGB', (max(sizes.values()),) * 2)
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    renditions = {}
+
+    # Largest first, so every smaller rendition is resized from the previous one
+    for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        image = image.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        renditions[name] = (image.width, image.height,
+                            {ext: _encode(image, fmt, quality) for ext, fmt in FORMATS.items()})
+
+    return width, height, renditions
+
+
+def render_file(path, sizes, quality):
+    """
+    render() of the image file at path
+    """
+    with open(path, 'rb') as source:
+        return render(source.read(), sizes, quality)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: workers must not inherit the web process' threads and connections
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', None),
+                                        mp_context=get_context('forkserver'))
+        return _pool
+
+
+def needs_processing(instance, field, renditions_field):
+    file = getattr(instance, field)
+    return bool(file) and getattr(instance, renditions_field).get('source') != file.name
+
+
+def schedule(instance, field='photo', renditions_field='renditions'):
+    """
+    Builds the renditions of instance.<field> once the current transaction commits
+    """
+    model, pk, name = type(instance), instance.pk, getattr(instance, field).name
+    transaction.on_commit(lambda: process(model, pk, name, field, renditions_field))
+
+
+def source_path(model, name, field='photo'):
+    return model._meta.get_field(field).storage.path(name)
+
+
+def process(model, pk, name, field='photo', renditions_field='renditions'):
+    """
+    Renders and stores the renditions of one image. Missing or unreadable
+    files are left without renditions, so the image stays pending.
+    """
+    path = source_path(model, name, field)
+
+    if getattr(settings, 'IMAGE_PROCESSING_SYNC', False):
+        try:
+            result = render_file(path, rendition_sizes(), image_quality())
+        except OSError:
+            return
+        store(model, pk, name, field, renditions_field, result)
+        return
+
+    future = get_pool().submit(render_file, path, rendition_sizes(), image_quality())
+    future.add_done_callback(lambda done: _store_result(done, model, pk, name, field, renditions_field))
+
+
+def _store_result(future, model, pk, name, field, renditions_field):
+    # Runs on the pool's thread, which has its own database connection
+    try:
+        if future.exception() is None:
+            store(model, pk, name, field, renditions_field, future.result())
+    finally:
+        close_old_connections()
+
+
+def store(model, pk, name, field, renditions_field, result):
+    """
+    Saves rendered files and records them, unless the image was replaced meanwhile.
+    The files are blobs of the media storage, counted as references of the row.
+    """
+    width, height, renditions = result
+    storage = model._meta.get_field(field).storage
+    stem = name.rsplit('.', 1)[0]
+
+    recorded = {'source': name, 'width': width, 'height': height}
+    for rendition, (rendition_width, rendition_height, files) in renditions.items():
+        recorded[rendition] = {'width': rendition_width, 'height': rendition_height}
+        for ext, content in files.items():
+            recorded[rendition][ext] = storage.save(f'{stem}_{rendition}.{ext}', ContentFile(content))
+
+    # Imported here, the pool workers only need render()
+    from app_common import response_cache
+    from app_post import media
+    from app_post.signals import RESPONSE_NAMESPACES
+
+    with transaction.atomic():
+        rows = model.objects.select_for_update().filter(pk=pk, **{field: name})
+        previous = rows.values_list(renditions_field, flat=True).first()
+
+        if previous is None:
+            # Replaced or deleted meanwhile, nothing references the new files
+            media.orphan(media.rendition_names(recorded))
+            return
+
+        rows.update(**{renditions_field: recorded})
+        media.retain(media.rendition_names(recorded))
+        media.release(media.rendition_names(previous))
+
+        # Cached responses still point at the original
+        response_cache.invalidate(*RESPONSE_NAMESPACES.get(model, ()))
+
+
+def pick(file, renditions, request=None, size=None):
+    """
+    The rendition of an image to send to the client making request:
+    ?image_size= (thumbnail, feed or full, feed by default) and ?image_format=
+    (webp or jpeg, WebP if the Accept header lists image/webp, JPEG otherwise).
+    While renditions are pending the url is None and pending is True.
+    """
+    if not file:
+        return None
+
+    size = size or (request.GET.get('image_size') if request else None) or 'feed'
+    rendition = renditions.get(size) if renditions.get('source') == file.name else None
+
+    if not rendition:
+        return {'url': None, 'width': renditions.get('width'), 'height': renditions.get('height'), 'pending': True}
+
+    ext = request.GET.get('image_format') if request else None
+    if ext not in FORMATS:
+        ext = 'webp' if request is not None and 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    name = rendition[ext]
+    return {'url': file.storage.url(name), 'width': rendition['width'], 'height': rendition['height']}
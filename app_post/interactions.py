@@ -0,0 +1,178 @@
+"""
+Batches of likes, views and marks (POST /api/post/interactions/).
+
+A client sends up to INTERACTION_BATCH_MAX events such as
+{'type': 'like', 'target': 'post', 'id': 1} at once. They are applied as if
+one after the other, every event gets its own result, but the number of
+queries does not grow with the batch:
+
+- the targets are looked up with one IN query per kind of target, and the
+  requester's likes and marks on them with one IN query per table
+- the events are replayed in memory against that state, so a like followed by
+  an unlike of the same post nets out to nothing
+- what is left is written per table with one INSERT and one DELETE (see
+  app_common.toggles), in one transaction
+- counters get one UPDATE per table and distinct delta, trending scores one
+  read and one write, and views go through the view buffer.
+
+Counters and scores follow the rows the database reports as inserted or
+deleted, so a concurrent like of the same post is never counted twice.
+
+Marks are the @mentions of captions (see app_post.captions), and a batch
+only ever marks or unmarks its requester: a mark is forbidden on a post or
+story whose caption does not mention them, whoever wrote it, so nobody tags
+themselves where they were not named. Removing one's own mark is always
+allowed.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from app_common import response_cache, toggles
+from app_common.counters import adjust_counters
+from app_post import captions, models, stories, trending
+from app_post.signals import COUNTERS, RESPONSE_NAMESPACES, TRENDING_EVENTS
+from app_post.view_buffer import record_views
+from app_user.cache import invalidate_profile
+
+APPLIED = 'applied'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+INVALID = 'invalid'
+
+# action -> (relation, whether the requester has it afterwards)
+ACTIONS = {
+    'like': ('like', True),
+    'unlike': ('like', False),
+    'mark': ('mark', True),
+    'unmark': ('mark', False),
+}
+
+# (relation, target) -> (model of the requester's rows, foreign key to the target)
+RELATIONS = {
+    ('like', 'post'): (models.LikePostModel, 'post'),
+    ('like', 'story'): (models.LikeStoryModel, 'story'),
+    ('like', 'comment'): (models.LikeCommentModel, 'comment'),
+    ('mark', 'post'): (models.MarkModel, 'post'),
+    ('mark', 'story'): (models.MarkModel, 'story'),
+}
+
+VIEWABLE = {'post': models.PostModel, 'story': models.StoryModel}
+
+# target -> field of its caption, the mentions in it are who may be marked
+CAPTIONS = {'post': 'description', 'story': 'description'}
+
+TYPES = [*ACTIONS, 'view']
+TARGETS = ['post', 'story', 'comment']
+
+
+def batch_max():
+    return getattr(settings, 'INTERACTION_BATCH_MAX', 500)
+
+
+def supports(action, target):
+    if action == 'view':
+        return target in VIEWABLE
+    return (ACTIONS[action][0], target) in RELATIONS
+
+
+def targets(target):
+    """
+    What events may point at: what the single like endpoints and detail views serve
+    """
+    if target == 'post':
+        return models.PostModel.objects.filter(is_deleted=False)
+    if target == 'story':
+        return stories.live().filter(is_deleted=False)
+    return models.CommentPostModel.objects.filter(is_deleted=False)
+
+
+def apply(user, events):
+    """
+    Applies validated events ({'type', 'target', 'id'}) of user in order.
+    Returns one status per event: applied, unchanged, not_found or forbidden.
+    """
+    ids = {}
+    for event in events:
+        ids.setdefault(event['target'], set()).add(event['id'])
+
+    # target -> {pk: caption}, None for targets without one
+    found = {}
+    for target, pks in ids.items():
+        rows = targets(target).filter(pk__in=pks)
+        found[target] = (dict(rows.values_list('pk', CAPTIONS[target])) if target in CAPTIONS
+                         else dict.fromkeys(rows.values_list('pk', flat=True)))
+    username = user.username.lower()
+
+    # (relation, target) -> target ids the requester has that relation with, before and after the batch
+    wanted = {(ACTIONS[event['type']][0], event['target']) for event in events if event['type'] in ACTIONS}
+    before = {}
+    for relation in wanted:
+        model, fk = RELATIONS[relation]
+        before[relation] = set(model.objects.filter(user=user, **{f'{fk}_id__in': found[relation[1]]})
+                               .values_list(f'{fk}_id', flat=True))
+    after = {relation: set(pks) for relation, pks in before.items()}
+
+    statuses, views = [], {}
+    for event in events:
+        action, target, pk = event['type'], event['target'], event['id']
+        if pk not in found[target]:
+            statuses.append(NOT_FOUND)
+        elif action == 'mark' and username not in captions.extract(found[target][pk])[1]:
+            statuses.append(FORBIDDEN)
+        elif action == 'view':
+            views.setdefault(target, []).append(pk)
+            statuses.append(APPLIED)
+        else:
+            relation, state = ACTIONS[action]
+            current = after[(relation, target)]
+            statuses.append(UNCHANGED if (pk in current) == state else APPLIED)
+            (current.add if state else current.discard)(pk)
+
+    with transaction.atomic():
+        changes = {}
+        for relation, pks in after.items():
+            model, fk = RELATIONS[relation]
+            inserted, deleted = changes.setdefault(model, ([], []))
+            inserted += toggles.add_many(model, [{'user_id': user.pk, f'{fk}_id': pk}
+                                                 for pk in sorted(pks - before[relation])])
+            removed = before[relation] - pks
+            if removed:
+                deleted += toggles.remove_many(model.objects.filter(user=user, **{f'{fk}_id__in': removed}))
+
+        apply_side_effects(user, changes)
+
+    for target, pks in views.items():
+        transaction.on_commit(lambda model=VIEWABLE[target], pks=pks: record_views(model, pks))
+
+    return statuses
+
+
+def apply_side_effects(user, changes):
+    """
+    What the post_save and post_delete receivers of app_post.signals do for
+    {model: (inserted, deleted)}, in bulk
+    """
+    events, namespaces = [], set()
+    for model, (inserted, deleted) in changes.items():
+        if inserted or deleted:
+            namespaces.update(RESPONSE_NAMESPACES.get(model, ()))
+
+        for counter_model, fk, field in COUNTERS.get(model, []):
+            deltas = Counter(getattr(instance, fk) for instance in inserted)
+            deltas.subtract(getattr(instance, fk) for instance in deleted)
+            adjust_counters(counter_model, field, deltas)
+
+        if model in TRENDING_EVENTS:
+            kind = TRENDING_EVENTS[model]
+            events += [(instance.post_id, kind, 1, instance.created_at) for instance in inserted]
+            # Taking back exactly what each event added when it was created
+            events += [(instance.post_id, kind, -1, instance.created_at) for instance in deleted]
+
+    trending.record_events(events)
+    response_cache.invalidate(*sorted(namespaces))
+
+    if any(inserted or deleted for inserted, deleted in changes.values()):
+        invalidate_profile(user.pk)
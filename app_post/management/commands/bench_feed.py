@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_post import feed
+from app_post.models import PostModel
+from app_user.models import FollowModel, UserModel
+
+
+class Rollback(Exception):
+    pass
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.mean(timings), statistics.quantiles(timings, n=100)[94]
+
+
+class Command(BaseCommand):
+    help = 'Compares feed page latency of cached timelines against a naive JOIN query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follows', type=int, default=10000)
+        parser.add_argument('--posts-per-author', type=int, default=3)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, follows, posts_per_author, page_size, repeat, **options):
+        self.stdout.write(f'Creating {follows} follows and {follows * posts_per_author} posts...')
+
+        # bulk_create skips post_save, so no confirmation codes are sent
+        viewer, *authors = UserModel.objects.bulk_create([
+            UserModel(username='bench_viewer', email='bench_viewer@gmail.com', phone_number='+998000000000')
+        ] + [
+            UserModel(username=f'bench_{i}', email=f'bench_{i}@gmail.com', phone_number=f'+997{i:09d}')
+            for i in range(follows)
+        ], batch_size=1000)
+        FollowModel.objects.bulk_create([
+            FollowModel(follower=viewer, followed=author) for author in authors
+        ], batch_size=1000)
+        PostModel.objects.bulk_create([
+            PostModel(user=author, description=f'post {i}')
+            for i in range(posts_per_author) for author in authors
+        ], batch_size=1000)
+
+        def naive():
+            return list(PostModel.objects
+                        .filter(user__followers__follower=viewer, is_deleted=False)
+                        .order_by('-pk')
+                        .values_list('pk', flat=True)[:page_size])
+
+        def timeline():
+            return feed.feed_page(viewer.pk, limit=page_size)
+
+        cache.delete(feed.timeline_key(viewer.pk))
+        start = time.perf_counter()
+        timeline()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        assert naive() == timeline()
+
+        for name, func in (('naive JOIN', naive), ('timeline', timeline)):
+            mean, p95 = measure(func, repeat)
+            self.stdout.write(f'{name:>12}: mean {mean:.3f} ms, p95 {p95:.3f} ms')
+
+        self.stdout.write(f'{"cold build":>12}: {build_ms:.3f} ms (first read after a cache miss)')
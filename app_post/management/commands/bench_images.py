@@ -0,0 +1,57 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+
+from PIL import Image
+
+from django.core.management.base import BaseCommand
+
+from app_post import images
+
+
+def synthetic_photo(width, height):
+    """
+    A camera-sized JPEG with enough noise to compress like a real photo
+    """
+    noise = Image.effect_noise((width // 4, height // 4), 64).resize((width, height))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    photo = Image.merge('RGB', (noise, gradient, Image.eval(noise, lambda value: 255 - value)))
+
+    buffer = BytesIO()
+    photo.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Measures rendition throughput (images per second) for 1..N worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', dest='count', type=int, default=40)
+        parser.add_argument('--width', type=int, default=4032)
+        parser.add_argument('--height', type=int, default=3024)
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, count, width, height, max_workers, **options):
+        data = synthetic_photo(width, height)
+        sizes, quality = images.rendition_sizes(), images.image_quality()
+        self.stdout.write(f'{count} photos of {width}x{height} ({len(data) // 1024} KiB), renditions {sizes}')
+
+        start = time.perf_counter()
+        for _ in range(count):
+            images.render(data, sizes, quality)
+        inline = count / (time.perf_counter() - start)
+        self.stdout.write(f'inline:    {inline:6.1f} images/s')
+
+        for workers in range(1, max_workers + 1):
+            with ProcessPoolExecutor(workers, mp_context=get_context('forkserver')) as pool:
+                # Warm the workers up so process start-up is not measured
+                list(pool.map(images.render, [data] * workers, [sizes] * workers, [quality] * workers))
+
+                start = time.perf_counter()
+                list(pool.map(images.render, [data] * count, [sizes] * count, [quality] * count))
+                throughput = count / (time.perf_counter() - start)
+
+            self.stdout.write(f'{workers} worker(s): {throughput:6.1f} images/s, {throughput / workers:6.1f} per core')
+
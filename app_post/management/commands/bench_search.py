@@ -0,0 +1,67 @@
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_post.models import PostModel
+from app_post.search import IcontainsSearchBackend, SQLiteFTSSearchBackend
+
+
+class Rollback(Exception):
+    pass
+
+
+def measure(func, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.mean(timings), statistics.quantiles(timings, n=100)[94]
+
+
+class Command(BaseCommand):
+    help = 'Compares full-text search against the icontains scan on a synthetic post table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--words-per-post', type=int, default=12)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, rows, words_per_post, queries, limit, **options):
+        rng = random.Random(0)
+        vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(20000)]
+        # Zipf-like weights so some words are common and most are rare
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+        self.stdout.write(f'Inserting {rows} posts...')
+        for start in range(0, rows, 10000):
+            PostModel.objects.bulk_create([
+                PostModel(description=' '.join(rng.choices(vocabulary, weights, k=words_per_post)))
+                for _ in range(min(10000, rows - start))
+            ])
+
+        fts = SQLiteFTSSearchBackend()
+        start = time.perf_counter()
+        fts.rebuild()
+        self.stdout.write(f'Index rebuilt in {time.perf_counter() - start:.1f} s')
+
+        terms = [(PostModel, rng.choice(vocabulary[100:]), limit) for _ in range(queries)]
+        prefixes = [(model, word[:4], limit) for model, word, limit in terms]
+
+        for name, backend in (('icontains', IcontainsSearchBackend()), ('fts5', fts)):
+            for label, args_list in (('word', terms), ('prefix', prefixes)):
+                mean, p95 = measure(backend.search, args_list)
+                self.stdout.write(f'{name:>10} {label:>6}: mean {mean:.2f} ms, p95 {p95:.2f} ms')
@@ -0,0 +1,47 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from app_post import images
+from app_post.signals import IMAGE_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Builds the missing renditions of uploaded photos in the process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, batch_size, **options):
+        built = 0
+        for model, (field, renditions_field) in IMAGE_FIELDS.items():
+            batch = []
+            for instance in model.objects.only('pk', field, renditions_field).iterator(chunk_size=batch_size):
+                if images.needs_processing(instance, field, renditions_field):
+                    batch.append((model, instance.pk, getattr(instance, field).name, field, renditions_field))
+
+                if len(batch) == batch_size:
+                    built += self.build(batch)
+                    batch = []
+
+            built += self.build(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'{built} images processed'))
+
+    def build(self, batch):
+        pool = images.get_pool()
+        futures = {
+            pool.submit(images.render_file, images.source_path(model, name, field),
+                        images.rendition_sizes(), images.image_quality()): (model, pk, name, field, renditions_field)
+            for model, pk, name, field, renditions_field in batch
+        }
+
+        for future in as_completed(futures):
+            try:
+                images.store(*futures[future], future.result())
+            except Exception as error:
+                model, pk, name = futures[future][:3]
+                self.stderr.write(f'{model._meta.label} {pk} ({name}): {error}')
+                continue
+
+        return len(futures)
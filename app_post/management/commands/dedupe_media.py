@@ -0,0 +1,100 @@
+import hashlib
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_post import media
+from app_post.models import MediaBlobModel
+from app_post.storage import ContentAddressedStorage, media_storage
+
+
+class Command(BaseCommand):
+    help = 'Moves media saved under upload names into content-addressed blobs and recounts blob references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only report how much would be freed')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        self.storage = media_storage()
+        self.dry_run = dry_run
+        self.blobs = set(MediaBlobModel.objects.values_list('name', flat=True))
+        self.moved = {}
+        self.duplicates = self.freed = self.missing = 0
+
+        for model, fields in media.MEDIA_FIELDS.items():
+            renditions_field = media.RENDITION_FIELDS.get(model)
+            columns = fields + ((renditions_field,) if renditions_field else ())
+
+            for values in model.objects.values('pk', *columns).iterator(chunk_size=batch_size):
+                updates = {field: self.move(values[field]) for field in fields
+                           if self.needs_move(values[field])}
+                if renditions_field and values[renditions_field]:
+                    renditions = self.move_renditions(values[renditions_field])
+                    if renditions != values[renditions_field]:
+                        updates[renditions_field] = renditions
+
+                if updates and not dry_run:
+                    model.objects.filter(pk=values['pk']).update(**updates)
+
+        verb = 'would be' if dry_run else 'were'
+        self.stdout.write(f'{len(self.moved)} files {verb} moved into blobs, {self.duplicates} of them duplicates, '
+                          f'{self.freed / 1024 ** 2:.1f} MiB {verb} freed, {self.missing} files are missing')
+
+        if not dry_run:
+            with transaction.atomic():
+                unreferenced = media.recount()
+                transaction.on_commit(self.delete_originals)
+            self.stdout.write(self.style.SUCCESS(f'References recounted, {unreferenced} unreferenced blobs '
+                                                 f'left to sweep_media'))
+
+    def delete_originals(self):
+        for name in self.moved:
+            self.storage.delete(name)
+
+    def needs_move(self, name):
+        return bool(name) and not ContentAddressedStorage.is_blob(name)
+
+    def move(self, name):
+        """
+        The blob holding the content of the file `name`, stored (or, in a dry run, named) on first use
+        """
+        if name in self.moved:
+            return self.moved[name]
+
+        if not self.storage.exists(name):
+            self.missing += 1
+            return name
+
+        size = self.storage.size(name)
+        with self.storage.open(name) as file:
+            if self.dry_run:
+                digest = hashlib.sha256()
+                for chunk in file.chunks():
+                    digest.update(chunk)
+                blob = self.storage.blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+            else:
+                # Hashes while copying, an identical blob is reused
+                blob = self.storage.save(name, file)
+
+        if blob in self.blobs:
+            self.duplicates += 1
+            self.freed += size
+        self.blobs.add(blob)
+
+        self.moved[name] = blob
+        return blob
+
+    def move_renditions(self, renditions):
+        moved = {}
+        for key, value in renditions.items():
+            if key == 'source':
+                moved[key] = self.move(value) if self.needs_move(value) else value
+            elif isinstance(value, dict):
+                moved[key] = {ext: self.move(name) if ext not in ('width', 'height') and self.needs_move(name)
+                              else name
+                              for ext, name in value.items()}
+            else:
+                moved[key] = value
+        return moved
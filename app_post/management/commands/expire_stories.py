@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app_post import stories
+
+
+class Command(BaseCommand):
+    help = 'Archives expired stories, and deletes the ones archived for longer than STORY_ARCHIVE_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, batch_size, **options):
+        archived = stories.archive_expired(batch_size=batch_size)
+        deleted = stories.delete_archived(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'{archived} stories archived, {deleted} archived stories deleted'))
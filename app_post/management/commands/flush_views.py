@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_post.view_buffer import flush_views
+
+
+class Command(BaseCommand):
+    help = 'Writes buffered post and story views to the database'
+
+    def handle(self, *args, **options):
+        total = flush_views()
+        self.stdout.write(self.style.SUCCESS(f'{total} views flushed'))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_post.models import UploadSessionModel
+from app_post.uploads import discard
+
+
+class Command(BaseCommand):
+    help = 'Deletes unfinished uploads that have not received a chunk for UPLOAD_SESSION_TTL seconds'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'UPLOAD_SESSION_TTL', 60 * 60 * 24))
+        sessions = UploadSessionModel.objects.filter(video__isnull=True, updated_at__lt=cutoff)
+
+        pruned = 0
+        for session in sessions.iterator():
+            discard(session)
+            pruned += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{pruned} uploads pruned'))
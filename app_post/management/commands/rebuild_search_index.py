@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_post.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of posts, stories, comments and tags'
+
+    def handle(self, *args, **options):
+        get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_post.trending import rebuild_scores, top_post_ids
+
+
+class Command(BaseCommand):
+    help = 'Recomputes trending scores from the stored counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_scores(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Trending scores rebuilt, {len(top_post_ids())} posts trending'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_post import media
+
+
+class Command(BaseCommand):
+    help = 'Deletes the media blobs left unreferenced for longer than MEDIA_ORPHAN_GRACE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        deleted = media.sweep(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'{deleted} unreferenced blobs deleted'))
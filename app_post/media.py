@@ -0,0 +1,177 @@
+"""
+Reference counting for the blobs of app_post.storage.ContentAddressedStorage.
+
+A row references the blobs in its media fields (MEDIA_FIELDS) and the
+renditions recorded for them (RENDITION_FIELDS). app_post.signals calls
+retain() and release() as rows are created, changed and deleted.
+`manage.py dedupe_media` moves pre-existing files into blobs and calls recount().
+
+A blob whose count drops to zero is not deleted at once: an upload of the same
+content may have found its file and skipped writing it, and only references
+it once its row is saved. sweep() (`manage.py sweep_media`) deletes blobs left
+unreferenced for MEDIA_ORPHAN_GRACE seconds, file first, under their row
+locks. An upload that reuses a file calls touch() first, which waits for a
+sweep holding the row and restarts the grace period otherwise.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app_post import images
+from app_post.models import MediaBlobModel, PhotoModel, StoryModel, VideoModel
+from app_post.storage import ContentAddressedStorage, media_storage
+
+# model -> its file fields stored in the media storage
+MEDIA_FIELDS = {
+    PhotoModel: ('photo',),
+    VideoModel: ('video',),
+    StoryModel: ('photo', 'video'),
+}
+
+# model -> JSON field with the renditions of its photo (see app_post.images)
+RENDITION_FIELDS = {
+    PhotoModel: 'renditions',
+    StoryModel: 'photo_renditions',
+}
+
+
+def rendition_names(renditions):
+    return [name
+            for rendition in (renditions or {}).values() if isinstance(rendition, dict)
+            for key, name in rendition.items() if key not in ('width', 'height')]
+
+
+def references(model, values):
+    """
+    Blob names referenced by a row of model, given its field values as a dict
+    """
+    names = [str(values.get(field) or '') for field in MEDIA_FIELDS[model]]
+    if model in RENDITION_FIELDS:
+        names += rendition_names(values.get(RENDITION_FIELDS[model]))
+    return [name for name in names if ContentAddressedStorage.is_blob(name)]
+
+
+def instance_references(instance):
+    model = type(instance)
+    fields = MEDIA_FIELDS[model] + ((RENDITION_FIELDS[model],) if model in RENDITION_FIELDS else ())
+    return references(model, {field: getattr(instance, field) for field in fields})
+
+
+def stored_references(model, pk):
+    fields = MEDIA_FIELDS[model] + ((RENDITION_FIELDS[model],) if model in RENDITION_FIELDS else ())
+    values = model.objects.filter(pk=pk).values(*fields).first()
+    return references(model, values) if values else []
+
+
+def _adjust(names, sign):
+    # One UPDATE per distinct number of references, like the view buffer flush
+    by_count = {}
+    for name, count in Counter(names).items():
+        by_count.setdefault(count, []).append(name)
+
+    for count, group in by_count.items():
+        MediaBlobModel.objects.filter(name__in=group).update(ref_count=F('ref_count') + sign * count)
+
+
+def retain(names):
+    if not names:
+        return
+    MediaBlobModel.objects.bulk_create([MediaBlobModel(name=name) for name in set(names)], ignore_conflicts=True)
+    _adjust(names, 1)
+
+
+def release(names):
+    if not names:
+        return
+    _adjust(names, -1)
+    MediaBlobModel.objects.filter(name__in=set(names), ref_count__lte=0).update(released_at=timezone.now())
+
+
+def orphan(names):
+    """
+    Hands stored files nothing references, e.g. renditions of an image replaced meanwhile, to sweep()
+    """
+    if not names:
+        return
+    now = timezone.now()
+    MediaBlobModel.objects.bulk_create([MediaBlobModel(name=name, released_at=now) for name in set(names)],
+                                       ignore_conflicts=True)
+    MediaBlobModel.objects.filter(name__in=set(names), ref_count__lte=0).update(released_at=now)
+
+
+def touch(name):
+    """
+    Keeps sweep() off a blob whose file an upload is about to reuse
+    """
+    MediaBlobModel.objects.filter(name=name, released_at__isnull=False).update(released_at=timezone.now())
+
+
+def sweep(now=None, batch_size=1000):
+    """
+    Deletes the blobs, file and row, unreferenced for MEDIA_ORPHAN_GRACE seconds.
+    Returns the number of blobs deleted.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=getattr(settings, 'MEDIA_ORPHAN_GRACE', 60 * 60))
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    storage = media_storage()
+    deleted = 0
+
+    while True:
+        with transaction.atomic():
+            # Rows an upload is touching are left for the next sweep
+            names = list(MediaBlobModel.objects
+                         .select_for_update(skip_locked=skip_locked)
+                         .filter(ref_count=0, released_at__lt=cutoff)
+                         .values_list('name', flat=True)[:batch_size])
+            if not names:
+                return deleted
+
+            # Files first: a rollback leaves rows without files, never a referenced row without its file
+            for name in names:
+                storage.delete(name)
+            MediaBlobModel.objects.filter(name__in=names).delete()
+        deleted += len(names)
+
+
+def recount():
+    """
+    Rebuilds every ref_count from the media rows and hands unreferenced blobs to sweep().
+    Returns the number of unreferenced blobs.
+    """
+    counts = Counter()
+    for model, fields in MEDIA_FIELDS.items():
+        fields = fields + ((RENDITION_FIELDS[model],) if model in RENDITION_FIELDS else ())
+        for values in model.objects.values(*fields).iterator(chunk_size=2000):
+            counts.update(references(model, values))
+
+    with transaction.atomic():
+        MediaBlobModel.objects.bulk_create([MediaBlobModel(name=name) for name in counts], ignore_conflicts=True)
+        blobs = list(MediaBlobModel.objects.select_for_update())
+        for blob in blobs:
+            blob.ref_count = counts.get(blob.name, 0)
+        MediaBlobModel.objects.bulk_update(blobs, ['ref_count'], batch_size=1000)
+
+        orphans = [blob.name for blob in blobs if not blob.ref_count]
+        MediaBlobModel.objects.filter(name__in=orphans, released_at__isnull=True).update(released_at=timezone.now())
+
+    return len(orphans)
+
+
+def create_many(model, files):
+    """
+    Bulk-inserts one row of model per uploaded file, doing what the post_save
+    receivers would: counting blob references and scheduling renditions
+    """
+    [field] = MEDIA_FIELDS[model]
+    rows = model.objects.bulk_create([model(**{field: file}) for file in files])
+    retain([name for row in rows for name in instance_references(row)])
+
+    if model in RENDITION_FIELDS:
+        for row in rows:
+            images.schedule(row, field, RENDITION_FIELDS[model])
+
+    return rows
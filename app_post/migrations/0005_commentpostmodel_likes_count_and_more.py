@@ -0,0 +1,73 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def repair_counter(model, field, related_model, fk_name):
+    # Frozen copy of app_common.counters.repair_counter as of this migration
+    counts = (related_model.objects
+              .filter(**{fk_name: OuterRef('pk')})
+              .order_by()
+              .values(fk_name)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    model.objects.update(**{field: Coalesce(Subquery(counts), Value(0))})
+
+
+def backfill_counters(apps, schema_editor):
+    PostModel = apps.get_model('app_post', 'PostModel')
+    StoryModel = apps.get_model('app_post', 'StoryModel')
+    CommentPostModel = apps.get_model('app_post', 'CommentPostModel')
+    UserModel = apps.get_model('app_user', 'UserModel')
+
+    repair_counter(PostModel, 'likes_count', apps.get_model('app_post', 'LikePostModel'), 'post')
+    repair_counter(PostModel, 'comments_count', CommentPostModel, 'post')
+    repair_counter(PostModel, 'marks_count', apps.get_model('app_post', 'MarkModel'), 'post')
+    repair_counter(StoryModel, 'likes_count', apps.get_model('app_post', 'LikeStoryModel'), 'story')
+    repair_counter(StoryModel, 'marks_count', apps.get_model('app_post', 'MarkModel'), 'story')
+    repair_counter(CommentPostModel, 'likes_count', apps.get_model('app_post', 'LikeCommentModel'), 'comment')
+    repair_counter(UserModel, 'posts_count', PostModel, 'user')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0004_postmodel_connected_users_postmodel_views_and_more'),
+        ('app_user', '0003_usermodel_followers_count_usermodel_following_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commentpostmodel',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='postmodel',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='postmodel',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='postmodel',
+            name='marks_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storymodel',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storymodel',
+            name='marks_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
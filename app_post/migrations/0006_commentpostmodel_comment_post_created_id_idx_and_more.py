@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0005_commentpostmodel_likes_count_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commentpostmodel',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likecommentmodel',
+            index=models.Index(fields=['comment', '-created_at', '-id'], name='likecomment_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likepostmodel',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='likepost_post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likestorymodel',
+            index=models.Index(fields=['story', '-created_at', '-id'], name='likestory_story_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def repair_counter(model, field, related_model, fk_name):
+    # Frozen copy of app_common.counters.repair_counter as of this migration
+    counts = (related_model.objects
+              .filter(**{fk_name: OuterRef('pk')})
+              .order_by()
+              .values(fk_name)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    model.objects.update(**{field: Coalesce(Subquery(counts), Value(0))})
+
+
+def delete_duplicates(apps, schema_editor):
+    """
+    Keeps the oldest row of every (user, target) pair so the unique constraints can be created
+    """
+    for model_name, target, counter_model_name in (
+            ('LikePostModel', 'post', 'PostModel'),
+            ('LikeStoryModel', 'story', 'StoryModel'),
+            ('LikeCommentModel', 'comment', 'CommentPostModel'),
+            ('MarkModel', 'post', 'PostModel'),
+            ('MarkModel', 'story', 'StoryModel'),
+    ):
+        model = apps.get_model('app_post', model_name)
+        duplicates = (model.objects
+                      .filter(**{f'{target}__isnull': False})
+                      .values('user', target)
+                      .annotate(keep_id=Min('id'), total=Count('id'))
+                      .filter(total__gt=1))
+
+        for duplicate in duplicates:
+            (model.objects
+             .filter(user=duplicate['user'], **{target: duplicate[target]})
+             .exclude(id=duplicate['keep_id'])
+             .delete())
+
+        counter = 'marks_count' if model_name == 'MarkModel' else 'likes_count'
+        repair_counter(apps.get_model('app_post', counter_model_name), counter, model, target)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0006_commentpostmodel_comment_post_created_id_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='commentpostmodel',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['post'], name='comment_post_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', '-id'], name='post_user_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(condition=models.Q(('views__gt', 1)), fields=['-views'], name='post_top_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storymodel',
+            index=models.Index(fields=['-created_at', '-id'], name='story_created_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='likecommentmodel',
+            constraint=models.UniqueConstraint(fields=('user', 'comment'), name='unique_comment_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='likepostmodel',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_post_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='likestorymodel',
+            constraint=models.UniqueConstraint(fields=('user', 'story'), name='unique_story_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='markmodel',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', False)), fields=('user', 'post'), name='unique_post_mark'),
+        ),
+        migrations.AddConstraint(
+            model_name='markmodel',
+            constraint=models.UniqueConstraint(condition=models.Q(('story__isnull', False)), fields=('user', 'story'), name='unique_story_mark'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+TABLES = {
+    'app_post_postmodel': 'description',
+    'app_post_storymodel': 'description',
+    'app_post_commentpostmodel': 'comment',
+    'app_post_tagmodel': 'tag',
+}
+
+
+def create_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for table, field in TABLES.items():
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5(body, prefix='2 3')")
+        schema_editor.execute(f'INSERT INTO {table}_fts (rowid, body) SELECT id, {field} FROM {table}')
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for table in TABLES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0007_index_plan'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
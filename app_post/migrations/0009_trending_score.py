@@ -0,0 +1,52 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:53
+
+from math import log2
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_scores(apps, schema_editor):
+    # Frozen copy of app_post.trending.rebuild_scores as of this migration
+    PostModel = apps.get_model('app_post', 'PostModel')
+    weights = settings.TRENDING_WEIGHTS
+    rows = PostModel.objects.values_list('pk', 'created_at', 'views', 'likes_count', 'comments_count', 'marks_count')
+    batch = []
+
+    for pk, created_at, views, likes, comments, marks in rows.iterator(chunk_size=1000):
+        total = (views * weights['view'] + likes * weights['like']
+                 + comments * weights['comment'] + marks * weights['mark'])
+        half_lives = (created_at - settings.TRENDING_EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+        batch.append(PostModel(pk=pk, trending_score=log2(total) + half_lives if total else 0))
+
+        if len(batch) == 1000:
+            PostModel.objects.bulk_update(batch, ['trending_score'])
+            batch = []
+
+    if batch:
+        PostModel.objects.bulk_update(batch, ['trending_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0008_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='postmodel',
+            name='post_top_views_idx',
+        ),
+        migrations.AddField(
+            model_name='postmodel',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(fields=['-trending_score'], name='post_trending_idx'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0009_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photomodel',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='storymodel',
+            name='photo_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
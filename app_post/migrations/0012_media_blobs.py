@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:12
+
+import app_post.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0011_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlobModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Media Blob',
+                'verbose_name_plural': 'Media Blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='photomodel',
+            name='photo',
+            field=models.ImageField(storage=app_post.storage.media_storage, upload_to='Post/Photos/'),
+        ),
+        migrations.AlterField(
+            model_name='storymodel',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=app_post.storage.media_storage, upload_to='Story/Photos/'),
+        ),
+        migrations.AlterField(
+            model_name='storymodel',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=app_post.storage.media_storage, upload_to='Story/Videos/'),
+        ),
+        migrations.AlterField(
+            model_name='videomodel',
+            name='video',
+            field=models.FileField(storage=app_post.storage.media_storage, upload_to='Post/Videos/'),
+        ),
+    ]
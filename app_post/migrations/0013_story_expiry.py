@@ -0,0 +1,51 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:20
+
+from datetime import timedelta
+
+import app_post.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def expire_from_creation(apps, schema_editor):
+    """
+    Existing stories expire STORY_TTL after they were created, the sweeper archives the old ones
+    """
+    StoryModel = apps.get_model('app_post', 'StoryModel')
+    ttl = timedelta(seconds=getattr(settings, 'STORY_TTL', 60 * 60 * 24))
+    StoryModel.objects.update(expires_at=F('created_at') + ttl)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0012_media_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storymodel',
+            name='expires_at',
+            field=models.DateTimeField(default=app_post.models.story_expiry),
+        ),
+        migrations.AddField(
+            model_name='storymodel',
+            name='is_archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(expire_from_creation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='storymodel',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['expires_at', 'id'], name='story_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storymodel',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['user', 'expires_at'], name='story_user_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storymodel',
+            index=models.Index(condition=models.Q(('is_archived', True)), fields=['expires_at'], name='story_archived_idx'),
+        ),
+    ]
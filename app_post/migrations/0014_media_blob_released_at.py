@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_post', '0013_story_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablobmodel',
+            name='released_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mediablobmodel',
+            index=models.Index(condition=models.Q(('ref_count', 0)), fields=['released_at'], name='media_blob_orphan_idx'),
+        ),
+    ]
@@ -1,11 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-from app_common.models import BaseModel
+from app_common.models import BaseModel, CounterFieldsMixin
+from app_post.storage import media_storage
 from app_user.models import UserModel
 
 
 class PhotoModel(models.Model):
-    photo = models.ImageField(upload_to='Post/Photos/')
+    photo = models.ImageField(upload_to='Post/Photos/', storage=media_storage)
+    # Resized copies and dimensions, filled in by app_post.images
+    renditions = models.JSONField(default=dict, blank=True)
 
     class Meta:
         verbose_name = 'Photo'
@@ -16,7 +23,7 @@ class PhotoModel(models.Model):
 
 
 class VideoModel(models.Model):
-    video = models.FileField(upload_to='Post/Videos/')
+    video = models.FileField(upload_to='Post/Videos/', storage=media_storage)
 
     class Meta:
         verbose_name = 'Video'
@@ -26,6 +33,54 @@ class VideoModel(models.Model):
         return self.video.name
 
 
+class MediaBlobModel(models.Model):
+    """
+    A file of the content-addressed media storage and how many references
+    (media fields and renditions) point at it, kept up to date by app_post.media
+    """
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # When ref_count last dropped to zero, or an upload last reused the file
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Media Blob'
+        verbose_name_plural = 'Media Blobs'
+        indexes = [
+            models.Index(fields=['released_at'], condition=models.Q(ref_count=0), name='media_blob_orphan_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
+class UploadSessionModel(BaseModel):
+    """
+    A resumable chunked upload (see app_post.uploads). The bytes received so
+    far are in `part`, once all `size` bytes are there they become `video`.
+    """
+    user = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    part = models.CharField(max_length=255)
+    video = models.OneToOneField(VideoModel, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='upload')
+
+    class Meta:
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+
+    def __str__(self):
+        return f"{self.filename} {self.received}/{self.size}"
+
+    @property
+    def is_complete(self):
+        return self.video_id is not None
+
+
 class TagModel(BaseModel):
     tag = models.CharField(max_length=50, unique=True)
 
@@ -45,7 +100,7 @@ class TagModel(BaseModel):
         return self.stories.count()
 
 
-class PostModel(BaseModel):
+class PostModel(CounterFieldsMixin, BaseModel):
     description = models.TextField()
     user = models.ForeignKey(UserModel, on_delete=models.SET_NULL, null=True, related_name='posts')
     connected_users = models.ManyToManyField(UserModel, related_name='connected_posts')
@@ -54,9 +109,25 @@ class PostModel(BaseModel):
     tags = models.ManyToManyField(TagModel, related_name='posts')
     views = models.PositiveIntegerField(default=0)
 
+    # Denormalized counters, kept in sync by app_post.signals
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    marks_count = models.PositiveIntegerField(default=0)
+
+    # Time-decayed engagement score, kept up to date by app_post.trending
+    trending_score = models.FloatField(default=0)
+
+    counter_fields = ('views', 'likes_count', 'comments_count', 'marks_count', 'trending_score')
+
     class Meta:
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_id_idx'),
+            models.Index(fields=['user', '-id'], condition=models.Q(is_deleted=False), name='post_user_live_idx'),
+            models.Index(fields=['-trending_score'], name='post_trending_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}/{self.description}"
@@ -69,43 +140,50 @@ class PostModel(BaseModel):
     def videos_count(self):
         return self.videos.count()
 
-    @property
-    def comments_count(self):
-        return self.comments.count()
-
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
     @property
     def tags_count(self):
         return self.tags.count()
 
-    @property
-    def marks_count(self):
-        return self.marks.count()
+
+def story_expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'STORY_TTL', 60 * 60 * 24))
 
 
-class StoryModel(BaseModel):
+class StoryModel(CounterFieldsMixin, BaseModel):
     user = models.ForeignKey(UserModel, on_delete=models.SET_NULL, null=True, related_name='stories')
-    photo = models.ImageField(upload_to='Story/Photos/', null=True, blank=True)
-    video = models.FileField(upload_to='Story/Videos/', null=True, blank=True)
+    photo = models.ImageField(upload_to='Story/Photos/', storage=media_storage, null=True, blank=True)
+    # Resized copies and dimensions, filled in by app_post.images
+    photo_renditions = models.JSONField(default=dict, blank=True)
+    video = models.FileField(upload_to='Story/Videos/', storage=media_storage, null=True, blank=True)
     tags = models.ManyToManyField(TagModel, related_name='stories')
     description = models.TextField()
     is_cached = models.BooleanField(default=False)
     views = models.PositiveIntegerField(default=0)
+    # Live until expires_at, then archived by app_post.stories
+    expires_at = models.DateTimeField(default=story_expiry)
+    is_archived = models.BooleanField(default=False)
+
+    # Denormalized counters, kept in sync by app_post.signals
+    likes_count = models.PositiveIntegerField(default=0)
+    marks_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('views', 'likes_count', 'marks_count')
 
     class Meta:
         verbose_name = 'Story'
         verbose_name_plural = 'Stories'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='story_created_id_idx'),
+            # Only unarchived rows: live stories plus the ones the sweeper has yet to archive
+            models.Index(condition=models.Q(is_archived=False), fields=['expires_at', 'id'], name='story_live_idx'),
+            models.Index(condition=models.Q(is_archived=False), fields=['user', 'expires_at'],
+                         name='story_user_live_idx'),
+            models.Index(condition=models.Q(is_archived=True), fields=['expires_at'], name='story_archived_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}/{self.description[:10]}"
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
     @property
     def comments_count(self):
         return self.comments.count()
@@ -114,10 +192,6 @@ class StoryModel(BaseModel):
     def tags_count(self):
         return self.tags.count()
 
-    @property
-    def marks_count(self):
-        return self.marks.count()
-
 
 class MarkModel(BaseModel):
     user = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name='marks')
@@ -127,28 +201,39 @@ class MarkModel(BaseModel):
     class Meta:
         verbose_name = 'Mark'
         verbose_name_plural = 'Marks'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], condition=models.Q(post__isnull=False),
+                                    name='unique_post_mark'),
+            models.UniqueConstraint(fields=['user', 'story'], condition=models.Q(story__isnull=False),
+                                    name='unique_story_mark'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}/{self.post.description[:10]}" \
             if self.post else f"{self.user.username}/{self.story.description[:10]}"
 
 
-class CommentPostModel(BaseModel):
+class CommentPostModel(CounterFieldsMixin, BaseModel):
     comment = models.TextField()
     post = models.ForeignKey(PostModel, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name='comments')
 
+    # Denormalized counter, kept in sync by app_post.signals
+    likes_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('likes_count',)
+
     class Meta:
         verbose_name = 'Comment Post'
         verbose_name_plural = 'Comments Post'
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_id_idx'),
+            models.Index(fields=['post'], condition=models.Q(is_deleted=False), name='comment_post_live_idx'),
+        ]
 
     def __str__(self):
         return f"{self.comment}/{self.user.username}"
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
 
 class LikePostModel(BaseModel):
     post = models.ForeignKey(PostModel, on_delete=models.CASCADE, related_name='likes')
@@ -157,6 +242,12 @@ class LikePostModel(BaseModel):
     class Meta:
         verbose_name = 'Like Post'
         verbose_name_plural = 'Likes Post'
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='likepost_post_created_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_post_like'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}/{self.post.description[:10]}"
@@ -169,6 +260,12 @@ class LikeStoryModel(BaseModel):
     class Meta:
         verbose_name = 'Like Story'
         verbose_name_plural = 'Likes Story'
+        indexes = [
+            models.Index(fields=['story', '-created_at', '-id'], name='likestory_story_created_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'story'], name='unique_story_like'),
+        ]
 
     def __str__(self):
         return f'{self.user.username}/{self.story.description[:10]}'
@@ -181,6 +278,12 @@ class LikeCommentModel(BaseModel):
     class Meta:
         verbose_name = 'Like Comment'
         verbose_name_plural = 'Like Comments'
+        indexes = [
+            models.Index(fields=['comment', '-created_at', '-id'], name='likecomment_created_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'comment'], name='unique_comment_like'),
+        ]
 
     def __str__(self):
         return f'{self.user.username}/{self.comment.comment[:10]}'
@@ -0,0 +1,147 @@
+"""
+Full-text search for posts, stories, comments and tags.
+
+The backend is chosen by the SEARCH_BACKEND setting. The default,
+SQLiteFTSSearchBackend, keeps one FTS5 table per model (created by migration
+0008) whose rowid is the object's pk; app_post.signals keeps it in sync and
+`manage.py rebuild_search_index` rebuilds it from scratch.
+IcontainsSearchBackend is the old LIKE '%q%' scan, for databases without FTS5.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.utils.module_loading import import_string
+
+from app_post import models
+
+# model -> text field that is searched
+SEARCH_FIELDS = {
+    models.PostModel: 'description',
+    models.StoryModel: 'description',
+    models.CommentPostModel: 'comment',
+    models.TagModel: 'tag',
+}
+
+
+class BaseSearchBackend:
+    def search(self, model, query, limit, within=None):
+        """
+        Returns up to limit pks of model matching query, best match first,
+        among the rows of the queryset within if given
+        """
+        raise NotImplementedError
+
+    def index(self, instance):
+        pass
+
+    def index_many(self, instances):
+        for instance in instances:
+            self.index(instance)
+
+    def remove(self, instance):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class IcontainsSearchBackend(BaseSearchBackend):
+    def search(self, model, query, limit, within=None):
+        field = SEARCH_FIELDS[model]
+        return list((within if within is not None else model.objects)
+                    .filter(**{f'{field}__icontains': query})
+                    .order_by('-pk')
+                    .values_list('pk', flat=True)[:limit])
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    @staticmethod
+    def table(model):
+        return f'{model._meta.db_table}_fts'
+
+    @staticmethod
+    def match_expression(query):
+        """
+        Every word must match; the last one may also be the prefix of a longer word
+        """
+        terms = [f'"{word}"' for word in re.findall(r'\w+', query.lower())]
+        if terms:
+            terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, model, query, limit, within=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+
+        table = self.table(model)
+        sql, params = f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [expression]
+        if within is not None:
+            # Scoped before the limit, so the best matches in scope are not crowded out by the rest
+            scope_sql, scope_params = within.order_by().values('pk').query.sql_with_params()
+            sql, params = f'{sql} AND rowid IN ({scope_sql})', params + list(scope_params)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'{sql} ORDER BY rank LIMIT %s', params + [limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, instance):
+        model = type(instance)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {self.table(model)} (rowid, body) VALUES (%s, %s)',
+                [instance.pk, getattr(instance, SEARCH_FIELDS[model])]
+            )
+
+    def index_many(self, instances):
+        if not instances:
+            return
+
+        model = type(instances[0])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {self.table(model)} (rowid, body) VALUES (%s, %s)',
+                [(instance.pk, getattr(instance, SEARCH_FIELDS[model])) for instance in instances]
+            )
+
+    def remove(self, instance):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table(type(instance))} WHERE rowid = %s', [instance.pk])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for model, field in SEARCH_FIELDS.items():
+                cursor.execute(f'DELETE FROM {self.table(model)}')
+                cursor.execute(
+                    f'INSERT INTO {self.table(model)} (rowid, body) '
+                    f'SELECT id, {field} FROM {model._meta.db_table}'
+                )
+
+
+@lru_cache
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_backend():
+    return _load_backend(getattr(settings, 'SEARCH_BACKEND', 'app_post.search.SQLiteFTSSearchBackend'))
+
+
+def search_queryset(queryset, query):
+    """
+    Narrows queryset to the objects matching query and annotates their
+    relevance as search_rank (0 is the best match)
+    """
+    limit = getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+    pks = get_backend().search(queryset.model, query, limit, within=queryset)
+
+    if not pks:
+        return queryset.none()
+
+    return queryset.filter(pk__in=pks).annotate(search_rank=Case(
+        *[When(pk=pk, then=Value(rank)) for rank, pk in enumerate(pks)],
+        output_field=IntegerField()
+    )).order_by('search_rank')
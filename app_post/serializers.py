@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
 
 from rest_framework import serializers
 
-from app_post import models
+from app_common.counters import count_subquery
+from app_post import captions, images, interactions, media, models, uploads
 
 UserModel = get_user_model()
 
@@ -12,11 +16,20 @@ class TagSerializer(serializers.ModelSerializer):
         model = models.TagModel
         fields = ['id', 'tag']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related('posts').annotate(
+            posts_total=count_subquery(models.PostModel.tags.through, 'tagmodel'),
+            stories_total=count_subquery(models.StoryModel.tags.through, 'tagmodel'),
+        )
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
 
-        data['posts_count'] = instance.posts_count
-        data['stories_count'] = instance.stories_count
+        posts_total = getattr(instance, 'posts_total', None)
+        stories_total = getattr(instance, 'stories_total', None)
+        data['posts_count'] = instance.posts_count if posts_total is None else posts_total
+        data['stories_count'] = instance.stories_count if stories_total is None else stories_total
 
         if instance.posts:
             data['posts'] = [
@@ -84,15 +97,48 @@ class MarkSerializer(serializers.ModelSerializer):
         return data
 
 
+def uploaded_videos(user, video_ids):
+    """
+    The videos of user's finished uploads with the given ids
+    """
+    videos = list(models.VideoModel.objects.filter(pk__in=video_ids, upload__user=user))
+    if len(videos) != len(set(video_ids)):
+        raise serializers.ValidationError('Unknown or unfinished upload')
+    return videos
+
+
 class PostSerializer(serializers.ModelSerializer):
     photos = serializers.ListField(child=serializers.ImageField(), write_only=True, required=False)
     videos = serializers.ListField(child=serializers.FileField(), write_only=True, required=False)
+    # Videos finished through /api/post/upload/
+    video_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True, required=False)
 
     class Meta:
         model = models.PostModel
-        fields = ['id', 'photos', 'videos', 'description', 'user', 'tags', 'views']
+        fields = ['id', 'photos', 'videos', 'video_ids', 'description', 'user', 'tags', 'views']
         read_only_fields = ['user', 'tags', 'views']
 
+    @staticmethod
+    def setup_eager_loading(queryset, user):
+        """
+        Loads everything to_representation reads, so a page of posts costs
+        the same number of queries no matter how many posts, likes or comments it has
+        """
+        return queryset.select_related('user').prefetch_related(
+            'connected_users',
+            'tags',
+            'photos',
+            'videos',
+            Prefetch('likes', queryset=models.LikePostModel.objects.select_related('user')),
+            Prefetch('comments', queryset=models.CommentPostModel.objects.select_related('user')),
+            Prefetch('marks', queryset=models.MarkModel.objects.select_related('user')),
+        ).annotate(
+            is_liked=Exists(models.LikePostModel.objects.filter(post=OuterRef('pk'), user_id=user.pk))
+        )
+
+    def validate_video_ids(self, value):
+        return uploaded_videos(self.context['request'].user, value)
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['user'] = {
@@ -108,7 +154,8 @@ class PostSerializer(serializers.ModelSerializer):
                 for user in instance.connected_users.all()
             ]
             user = self.context['request'].user
-            data['is_liked'] = instance.likes.filter(user=user).exists()
+            is_liked = getattr(instance, 'is_liked', None)
+            data['is_liked'] = instance.likes.filter(user=user).exists() if is_liked is None else is_liked
 
             data['total_likes'] = instance.likes_count
             data['likes'] = [
@@ -148,7 +195,9 @@ class PostSerializer(serializers.ModelSerializer):
                 for mark in instance.marks.all()
             ]
 
-            data['photos'] = [{'id': photo.pk, 'url': photo.photo.url} for photo in instance.photos.all()]
+            request = self.context.get('request')
+            data['photos'] = [{'id': photo.pk, **images.pick(photo.photo, photo.renditions, request)}
+                              for photo in instance.photos.all()]
             data['videos'] = [{'id': video.pk, 'url': video.video.url} for video in instance.videos.all()]
 
         else:
@@ -156,48 +205,61 @@ class PostSerializer(serializers.ModelSerializer):
 
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context['request'].user
         photos_data = validated_data.pop('photos', [])
         videos_data = validated_data.pop('videos', [])
-        description = validated_data.get('description').split(' ')
+        uploaded = validated_data.pop('video_ids', [])
 
-        tags = [tag for tag in description if tag.startswith('#')]
-        marks = [mark.lower() for mark in description
-                 if mark.startswith('@') and UserModel.objects.filter(username=mark[1:].lower()).exists()]
-
-        if not videos_data and not photos_data:
+        if not videos_data and not photos_data and not uploaded:
             raise serializers.ValidationError('Either photos or videos are required')
 
         post = models.PostModel.objects.create(user=user, **validated_data)
 
-        for photo_data in photos_data:
-            photo = models.PhotoModel.objects.create(photo=photo_data)
-            post.photos.add(photo)
-
-        for video_data in videos_data:
-            video = models.VideoModel.objects.create(video=video_data)
-            post.videos.add(video)
-
-        for tag in tags:
-            tag_instance, _ = models.TagModel.objects.get_or_create(tag=tag)
-            post.tags.add(tag_instance)
+        photos = media.create_many(models.PhotoModel, photos_data)
+        videos = media.create_many(models.VideoModel, videos_data) + uploaded
+        models.PostModel.photos.through.objects.bulk_create([
+            models.PostModel.photos.through(postmodel_id=post.pk, photomodel_id=photo.pk) for photo in photos
+        ])
+        models.PostModel.videos.through.objects.bulk_create([
+            models.PostModel.videos.through(postmodel_id=post.pk, videomodel_id=video.pk) for video in videos
+        ])
 
-        for mark in marks:
-            if mark:
-                mark_instance, _ = models.MarkModel.objects.get_or_create(user_id=user.pk, post_id=post.pk)
+        captions.attach_caption(post, validated_data.get('description'))
 
         return post
 
 
-
 class StorySerializer(serializers.ModelSerializer):
+    # A video finished through /api/post/upload/
+    video_id = serializers.IntegerField(write_only=True, required=False)
+
     class Meta:
         model = models.StoryModel
-        fields = ['id', 'photo', 'video', 'description', 'user', 'tags', 'views']
-        read_only_fields = ['user', 'tags', 'views']
+        fields = ['id', 'photo', 'video', 'video_id', 'description', 'user', 'tags', 'views', 'created_at',
+                  'expires_at', 'is_archived']
+        read_only_fields = ['user', 'tags', 'views', 'created_at', 'expires_at', 'is_archived']
+
+    @staticmethod
+    def setup_eager_loading(queryset, user):
+        """
+        Loads everything to_representation reads, like PostSerializer.setup_eager_loading
+        """
+        return queryset.select_related('user').prefetch_related(
+            'tags',
+            Prefetch('likes', queryset=models.LikeStoryModel.objects.select_related('user')),
+            Prefetch('marks', queryset=models.MarkModel.objects.select_related('user')),
+        ).annotate(
+            is_liked=Exists(models.LikeStoryModel.objects.filter(story=OuterRef('pk'), user_id=user.pk))
+        )
 
     def validate(self, attrs):
+        video_id = attrs.pop('video_id', None)
+        if video_id is not None:
+            [video] = uploaded_videos(self.context['request'].user, [video_id])
+            attrs['video'] = video.video.name
+
         if self.context['request'].method == 'POST':
             if not 'photo' in attrs and not 'video' in attrs:
                 raise serializers.ValidationError('Either photo or video is required')
@@ -205,6 +267,10 @@ class StorySerializer(serializers.ModelSerializer):
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
+        photo = images.pick(instance.photo, instance.photo_renditions, self.context.get('request'))
+        if photo:
+            data['photo'] = photo['url']
+            data['photo_width'], data['photo_height'] = photo['width'], photo['height']
         data['user'] = {'id': instance.user.pk,
                         'username': instance.user.username,
                         'email': instance.user.email,
@@ -212,7 +278,11 @@ class StorySerializer(serializers.ModelSerializer):
 
         if instance.user.is_private is False:
             user = self.context['request'].user
-            if user.is_authenticated:
+            is_liked = getattr(instance, 'is_liked', None)
+            if is_liked is not None:
+                data['is_liked'] = is_liked
+
+            elif user.is_authenticated:
                 data['is_liked'] = instance.likes.filter(user=user).exists()
 
             else:
@@ -253,24 +323,11 @@ class StorySerializer(serializers.ModelSerializer):
 
         return data
     
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context['request'].user
-        description = validated_data.get('description').split(' ')
-
         story = models.StoryModel.objects.create(user=user, **validated_data)
-
-        tags = [tag for tag in description if tag.startswith('#')]
-        marks = [mark.lower() for mark in description
-                 if mark.startswith('@') and UserModel.objects.filter(username=mark[1:].lower()).exists()]
-
-        for tag in tags:
-            tag_instance, _ = models.TagModel.objects.get_or_create(tag=tag)
-            story.tags.add(tag_instance)
-
-        for mark in marks:
-            if mark:
-                mark_instance, _ = models.MarkModel.objects.get_or_create(user_id=user.pk, story_id=story.pk)
-
+        captions.attach_caption(story, validated_data.get('description'))
         return story
 
 
@@ -279,7 +336,18 @@ class CommentPostSerializer(serializers.ModelSerializer):
         model = models.CommentPostModel
         fields = ['id', 'comment', 'post', 'user']
         read_only_fields = ['user', 'post']
-    
+
+    @staticmethod
+    def setup_eager_loading(queryset, user):
+        """
+        Loads everything to_representation reads, like PostSerializer.setup_eager_loading
+        """
+        return queryset.select_related('user', 'post__user').prefetch_related(
+            Prefetch('likes', queryset=models.LikeCommentModel.objects.select_related('user')),
+        ).annotate(
+            is_liked=Exists(models.LikeCommentModel.objects.filter(comment=OuterRef('pk'), user_id=user.pk))
+        )
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['user'] = {'id': instance.user.pk,
@@ -289,20 +357,21 @@ class CommentPostSerializer(serializers.ModelSerializer):
 
         if instance.post.user.is_private is False:
             user = self.context['request'].user
-            if user.is_authenticated:
+            is_liked = getattr(instance, 'is_liked', None)
+            if not user.is_authenticated:
+                data['is_liked'] = False
+
+            elif is_liked is None:
                 data['is_liked'] = instance.likes.filter(user=user).exists()
 
             else:
-                data['is_liked'] = False
+                data['is_liked'] = is_liked
 
             data['total_likes'] = instance.likes_count
-            data['likes'] = []
-            if instance.likes.exists():
-                for likes in instance.likes.all():
-                    data['likes'].append({'id': likes.pk,
-                                          'user': {'id': likes.user.pk,
-                                                   'username': likes.user.username}
-                                        })
+            data['likes'] = [
+                {'id': like.pk, 'user': {'id': like.user.pk, 'username': like.user.username}}
+                for like in instance.likes.all()
+            ]
 
         else:
             data['message'] = "This Video is uploaded by private account"
@@ -419,4 +488,48 @@ class ConnectUsersToPostSerializer(serializers.Serializer):
         if not UserModel.objects.filter(pk=value).exists():
             raise serializers.ValidationError("User not found.")
 
-        return value
\ No newline at end of file
+        return value
+
+
+class InteractionSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=interactions.TYPES)
+    target = serializers.ChoiceField(choices=interactions.TARGETS)
+    id = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        if not interactions.supports(attrs['type'], attrs['target']):
+            raise serializers.ValidationError(f"A {attrs['target']} cannot be given a {attrs['type']}.")
+
+        return attrs
+
+
+class InteractionBatchSerializer(serializers.Serializer):
+    """
+    Events are validated one by one, so that an invalid event fails alone
+    """
+    events = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
+
+    def validate_events(self, value):
+        if len(value) > interactions.batch_max():
+            raise serializers.ValidationError(f'At most {interactions.batch_max()} events per batch.')
+
+        return value
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', write_only=True, required=False)
+
+    class Meta:
+        model = models.UploadSessionModel
+        fields = ['id', 'filename', 'size', 'sha256', 'received', 'video', 'is_complete']
+        read_only_fields = ['received', 'video', 'is_complete']
+
+    def validate_size(self, value):
+        max_size = getattr(settings, 'UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+        if value > max_size:
+            raise serializers.ValidationError(f'Uploads are limited to {max_size} bytes')
+        return value
+
+    def create(self, validated_data):
+        return uploads.open_session(self.context['request'].user, **validated_data)
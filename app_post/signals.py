@@ -0,0 +1,165 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from app_common import response_cache
+from app_common.counters import adjust_counter
+from app_post import feed, images, media, models, search, trending
+from app_user.cache import invalidate_profile
+from app_user.models import FollowModel, UserModel
+
+# sender -> [(model holding the counter, foreign key on sender, counter field)]
+COUNTERS = {
+    models.LikePostModel: [(models.PostModel, 'post_id', 'likes_count')],
+    models.LikeStoryModel: [(models.StoryModel, 'story_id', 'likes_count')],
+    models.LikeCommentModel: [(models.CommentPostModel, 'comment_id', 'likes_count')],
+    models.CommentPostModel: [(models.PostModel, 'post_id', 'comments_count')],
+    models.MarkModel: [(models.PostModel, 'post_id', 'marks_count'),
+                       (models.StoryModel, 'story_id', 'marks_count')],
+    models.PostModel: [(UserModel, 'user_id', 'posts_count')],
+}
+
+# senders whose rows show up in (or are counted on) their user's profile
+PROFILE_SENDERS = (
+    models.PostModel, models.StoryModel, models.CommentPostModel, models.MarkModel,
+    models.LikePostModel, models.LikeStoryModel, models.LikeCommentModel,
+)
+
+# sender -> (image field, JSON field holding its renditions)
+IMAGE_FIELDS = {
+    models.PhotoModel: ('photo', 'renditions'),
+    models.StoryModel: ('photo', 'photo_renditions'),
+}
+
+# sender -> kind of trending event it is for its post
+TRENDING_EVENTS = {
+    models.LikePostModel: 'like',
+    models.CommentPostModel: 'comment',
+    models.MarkModel: 'mark',
+}
+
+# sender -> cached responses its writes make stale (see app_common.response_cache)
+RESPONSE_NAMESPACES = {
+    models.PostModel: ('posts', 'tags'),
+    models.PhotoModel: ('posts',),
+    models.VideoModel: ('posts',),
+    models.LikePostModel: ('posts',),
+    models.CommentPostModel: ('posts',),
+    models.MarkModel: ('posts',),
+    models.TagModel: ('tags',),
+    models.StoryModel: ('tags',),
+    UserModel: ('posts',),
+}
+
+
+def adjust_counters(sender, instance, delta):
+    for model, fk, field in COUNTERS.get(sender, []):
+        adjust_counter(model, getattr(instance, fk), field, delta)
+
+
+@receiver(post_save)
+def increment_counters(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        adjust_counters(sender, instance, 1)
+
+
+@receiver(post_delete)
+def decrement_counters(sender, instance, **kwargs):
+    adjust_counters(sender, instance, -1)
+
+
+@receiver(post_save)
+def score_engagement(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw and sender in TRENDING_EVENTS and instance.post_id:
+        trending.record([instance.post_id], TRENDING_EVENTS[sender], at=instance.created_at)
+
+
+@receiver(post_delete)
+def unscore_engagement(sender, instance, **kwargs):
+    if sender in TRENDING_EVENTS and instance.post_id:
+        # Take back exactly what the event added when it was created
+        trending.record([instance.post_id], TRENDING_EVENTS[sender], count=-1, at=instance.created_at)
+
+
+@receiver(post_save, sender=models.PostModel)
+def fan_out_post(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: feed.fan_out_post(instance))
+
+
+@receiver(post_save, sender=FollowModel)
+def backfill_timeline(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        feed.backfill(instance.follower_id, instance.followed_id)
+
+
+@receiver(post_delete, sender=FollowModel)
+def trim_timeline(sender, instance, **kwargs):
+    feed.trim(instance.follower_id, instance.followed_id)
+
+
+@receiver(post_save)
+def index_for_search(sender, instance, raw=False, **kwargs):
+    if sender in search.SEARCH_FIELDS and not raw:
+        search.get_backend().index(instance)
+
+
+@receiver(post_delete)
+def remove_from_search(sender, instance, **kwargs):
+    if sender in search.SEARCH_FIELDS:
+        search.get_backend().remove(instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_owner_profile(sender, instance, **kwargs):
+    if sender in PROFILE_SENDERS:
+        invalidate_profile(instance.user_id)
+
+
+@receiver(post_save)
+def build_renditions(sender, instance, raw=False, **kwargs):
+    # Archived stories are served from the original, see app_post.stories
+    if getattr(instance, 'is_archived', False):
+        return
+    if sender in IMAGE_FIELDS and not raw and images.needs_processing(instance, *IMAGE_FIELDS[sender]):
+        images.schedule(instance, *IMAGE_FIELDS[sender])
+
+
+@receiver(pre_save)
+def remember_media(sender, instance, raw=False, **kwargs):
+    if sender in media.MEDIA_FIELDS and not raw and instance.pk:
+        instance._stored_media = media.stored_references(sender, instance.pk)
+
+
+@receiver(post_save)
+def count_media_references(sender, instance, raw=False, **kwargs):
+    if sender in media.MEDIA_FIELDS and not raw:
+        before = Counter(getattr(instance, '_stored_media', []))
+        after = Counter(media.instance_references(instance))
+        media.retain(list((after - before).elements()))
+        media.release(list((before - after).elements()))
+        instance._stored_media = list(after.elements())
+
+
+@receiver(pre_delete)
+def remember_deleted_media(sender, instance, **kwargs):
+    # Renditions are recorded by a queryset update, the instance may not have them
+    if sender in media.MEDIA_FIELDS:
+        instance._stored_media = media.stored_references(sender, instance.pk)
+
+
+@receiver(post_delete)
+def release_media(sender, instance, **kwargs):
+    if sender in media.MEDIA_FIELDS:
+        media.release(getattr(instance, '_stored_media', None) or media.instance_references(instance))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_responses(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Logging in only touches last_login, which no cached response shows
+    if sender in RESPONSE_NAMESPACES and not raw and set(update_fields or ()) != {'last_login'}:
+        response_cache.invalidate(*RESPONSE_NAMESPACES[sender])
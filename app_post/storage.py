@@ -0,0 +1,74 @@
+"""
+Content-addressed storage for uploaded media.
+
+Every file is stored once as blobs/<first 2 hex digits>/<sha256><ext>,
+whatever name it was uploaded under. The hash is computed while the upload is
+written, so the content is never read twice. Saving bytes that are already
+stored returns the existing name.
+
+Which rows reference a blob is tracked in MediaBlobModel (see app_post.media),
+which deletes the file some time after the last reference goes away.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, storages
+
+BLOB_PREFIX = 'blobs'
+
+
+def media_storage():
+    """
+    Storage of the PhotoModel, VideoModel and StoryModel files, the STORAGES['media'] alias
+    """
+    return storages['media']
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The name is derived from the content in _save(), equal names mean equal files
+        return name
+
+    @staticmethod
+    def blob_name(sha256, ext=''):
+        return f'{BLOB_PREFIX}/{sha256[:2]}/{sha256}{ext.lower()}'
+
+    def _save(self, name, content):
+        directory = self.path(BLOB_PREFIX)
+        os.makedirs(directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as file:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                file.write(chunk)
+
+        return self.adopt(file.name, digest.hexdigest(), os.path.splitext(name)[1])
+
+    def adopt(self, path, sha256, ext=''):
+        """
+        Moves the local file at path (whose hash is sha256) into place, returns its blob name
+        """
+        name = self.blob_name(sha256, ext)
+        target = self.path(name)
+
+        if os.path.exists(target):
+            # Imported here, app_post.models imports this module
+            from app_post.media import touch
+
+            # Waits out a sweep deleting the blob (see app_post.media), so look again after
+            touch(name)
+            if os.path.exists(target):
+                os.remove(path)
+                return name
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        os.replace(path, target)
+        return name
+
+    @staticmethod
+    def is_blob(name):
+        return bool(name) and name.startswith(f'{BLOB_PREFIX}/')
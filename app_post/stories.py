@@ -0,0 +1,101 @@
+"""
+24 hour stories.
+
+A story is live until its expires_at, STORY_TTL seconds after it was created.
+Live stories are read through partial indexes that hold only unarchived rows,
+so serving them costs O(live stories) however many stories were ever posted.
+
+archive_expired() (`manage.py expire_stories`, run every few minutes) archives
+expired stories in batches: they are flagged is_archived and their renditions
+are released, keeping the original photo or video for the author's archive.
+With STORY_ARCHIVE_TTL set, archived stories are deleted, with their media,
+that many seconds after they expired.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app_post import media
+from app_post.models import StoryModel
+from app_user.models import FollowModel
+
+
+def _batch_size():
+    return getattr(settings, 'STORY_SWEEP_BATCH_SIZE', 500)
+
+
+def live(queryset=None, now=None):
+    queryset = StoryModel.objects.all() if queryset is None else queryset
+    return queryset.filter(is_archived=False, expires_at__gt=now or timezone.now())
+
+
+def tray(user_id, queryset=None, now=None):
+    """
+    Live stories of the users user_id follows as [(author, [stories, oldest first])],
+    the author who posted most recently first
+    """
+    following = FollowModel.objects.filter(follower_id=user_id).values('followed_id')
+    stories = live(queryset, now).filter(user_id__in=following).order_by('created_at', 'id')
+
+    groups = {}
+    for story in stories:
+        groups.setdefault(story.user_id, []).append(story)
+
+    return sorted(((group[0].user, group) for group in groups.values()),
+                  key=lambda item: item[1][-1].created_at, reverse=True)
+
+
+def archive_expired(now=None, batch_size=None):
+    """
+    Archives the stories that expired by now, returns how many
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or _batch_size()
+    archived = 0
+
+    while True:
+        with transaction.atomic():
+            batch = list(StoryModel.objects
+                         .select_for_update()
+                         .filter(is_archived=False, expires_at__lte=now)
+                         .only('pk', 'photo_renditions')[:batch_size])
+            if not batch:
+                return archived
+
+            # Bulk updates skip count_media_references, release the renditions here
+            media.release([name for story in batch for name in media.rendition_names(story.photo_renditions)])
+            for story in batch:
+                story.is_archived = True
+                # The original is served from now on, keep its dimensions
+                story.photo_renditions = {key: value for key, value in story.photo_renditions.items()
+                                          if key in ('width', 'height')}
+            StoryModel.objects.bulk_update(batch, ['is_archived', 'photo_renditions'])
+
+        archived += len(batch)
+
+
+def delete_archived(now=None, batch_size=None):
+    """
+    Deletes the stories archived for longer than STORY_ARCHIVE_TTL, returns how many
+    """
+    ttl = getattr(settings, 'STORY_ARCHIVE_TTL', None)
+    if ttl is None:
+        return 0
+
+    cutoff = (now or timezone.now()) - timedelta(seconds=ttl)
+    batch_size = batch_size or _batch_size()
+    deleted = 0
+
+    while True:
+        ids = list(StoryModel.objects
+                   .filter(is_archived=True, expires_at__lte=cutoff)
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+
+        # One by one through the signals, which release the blobs and fix the counters
+        with transaction.atomic():
+            StoryModel.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
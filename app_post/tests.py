@@ -1,3 +1,1265 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PIL import ExifTags, Image
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app_common.pagination import CreatedAtCursorPagination
+from app_post import captions, feed, images, media, models, stories, trending
+from app_post.view_buffer import flush_views, record_view
+from app_user.models import FollowModel
+
+UserModel = get_user_model()
+
+
+def create_user(username, **kwargs):
+    with mock.patch('app_user.signals.send_confirmation'):
+        return UserModel.objects.create_user(
+            username=username,
+            email=f'{username}@gmail.com',
+            phone_number=f'+998{abs(hash(username)) % 10 ** 9:09d}',
+            password='password',
+            **kwargs
+        )
+
+
+def create_post(user, likers=(), commenters=(), description='post'):
+    post = models.PostModel.objects.create(user=user, description=description)
+    post.photos.add(models.PhotoModel.objects.create(photo='Post/Photos/photo.jpg'))
+    post.videos.add(models.VideoModel.objects.create(video='Post/Videos/video.mp4'))
+    post.tags.add(models.TagModel.objects.get_or_create(tag=f'#{description}')[0])
+    post.connected_users.add(*likers)
+
+    for liker in likers:
+        models.LikePostModel.objects.create(user=liker, post=post)
+        models.MarkModel.objects.create(user=liker, post=post)
+
+    for commenter in commenters:
+        models.CommentPostModel.objects.create(user=commenter, post=post, comment='nice')
+
+    return post
+
+
+class PostListQueryCountTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.users = [create_user(f'user{i}') for i in range(4)]
+        self.client.force_authenticate(self.user)
+
+    def test_post_list_query_count_does_not_grow_with_posts(self):
+        create_post(self.users[0], likers=self.users[:1], commenters=self.users[:1])
+
+        with self.assertNumQueries(8):
+            response = self.client.get('/api/post/')
+        self.assertEqual(response.status_code, 200)
+
+        for i in range(4):
+            create_post(self.users[i], likers=self.users, commenters=self.users, description=f'post{i}')
+
+        with self.assertNumQueries(8):
+            response = self.client.get('/api/post/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_post_by_user_list_query_count(self):
+        for i in range(3):
+            create_post(self.users[0], likers=self.users, commenters=self.users, description=f'post{i}')
+
+        with self.assertNumQueries(9):
+            response = self.client.get(f'/api/post/user/{self.users[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_is_liked_and_totals(self):
+        post = create_post(self.users[0], likers=[self.user, self.users[1]], commenters=self.users[:3])
+
+        response = self.client.get('/api/post/')
+        data = response.data['results'][0]
+
+        self.assertEqual(data['id'], post.pk)
+        self.assertTrue(data['is_liked'])
+        self.assertEqual(data['total_likes'], 2)
+        self.assertEqual(data['total_comments'], 3)
+        self.assertEqual(data['marks_count'], 2)
+        self.assertEqual(len(data['likes']), 2)
+
+
+class CursorPaginationTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.client.force_authenticate(self.user)
+        self.post = create_post(self.user)
+        self.comments = [
+            models.CommentPostModel.objects.create(user=self.user, post=self.post, comment=f'comment {i}')
+            for i in range(7)
+        ]
+
+    def test_walks_comments_newest_first(self):
+        response = self.client.get(f'/api/post/{self.post.pk}/comment/')
+        self.assertNotIn('count', response.data)
+        ids = [comment['id'] for comment in response.data['results']]
+
+        response = self.client.get(response.data['next'])
+        ids += [comment['id'] for comment in response.data['results']]
+
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, [comment.pk for comment in reversed(self.comments)])
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(f'/api/post/{self.post.pk}/comment/', {'page_size': 6})
+        self.assertEqual(len(response.data['results']), 6)
+
+        with mock.patch.object(CreatedAtCursorPagination, 'max_page_size', 3):
+            response = self.client.get(f'/api/post/{self.post.pk}/comment/', {'page_size': 6})
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class CounterTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        self.post = create_post(self.author)
+        self.client.force_authenticate(self.user)
+
+    def test_like_toggle_keeps_counter(self):
+        self.client.post(f'/api/post/{self.post.pk}/like/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+        self.client.post(f'/api/post/{self.post.pk}/like/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_comment_and_comment_like_counters(self):
+        self.client.post(f'/api/post/{self.post.pk}/comment/', {'comment': 'hello'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+        comment = self.post.comments.get()
+        self.client.post(f'/api/post/comment/{comment.pk}/like/')
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 1)
+
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_posts_count_follows_create_and_delete(self):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.posts_count, 1)
+
+        self.post.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.posts_count, 0)
+
+    def test_repair_counters_fixes_drift(self):
+        models.LikePostModel.objects.create(user=self.user, post=self.post)
+        models.PostModel.objects.filter(pk=self.post.pk).update(likes_count=42, marks_count=7)
+
+        out = StringIO()
+        call_command('repair_counters', stdout=out)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.post.marks_count, 0)
+        self.assertIn('2 counters repaired', out.getvalue())
+
+    def test_saving_a_loaded_row_keeps_counters(self):
+        post = models.PostModel.objects.get(pk=self.post.pk)
+        author = UserModel.objects.get(pk=self.author.pk)
+        # Counters move while the instances are held
+        self.client.post(f'/api/post/{self.post.pk}/like/')
+        FollowModel.objects.create(follower=self.user, followed=self.author)
+
+        post.description = 'edited'
+        post.save()
+        author.first_name = 'edited'
+        author.save()
+
+        post.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual((post.description, post.likes_count), ('edited', 1))
+        self.assertEqual((author.first_name, author.followers_count, author.posts_count), ('edited', 1, 1))
+
+    def test_deleting_a_user_takes_back_what_they_did(self):
+        other = create_post(self.author, description='other')
+        self.client.post(f'/api/post/{self.post.pk}/like/')
+        self.client.post(f'/api/post/{self.post.pk}/comment/', {'comment': 'hello'})
+        comment = self.post.comments.get()
+        models.LikeCommentModel.objects.create(user=self.author, comment=comment)
+        models.MarkModel.objects.create(user=self.user, post=self.post)
+        FollowModel.objects.create(follower=self.user, followed=self.author)
+        FollowModel.objects.create(follower=self.author, followed=self.user)
+        self.client.post(f'/api/post/{other.pk}/like/')
+
+        self.assertEqual(self.client.delete(f'/api/auth/profile/{self.user.pk}/').status_code, 204)
+
+        self.post.refresh_from_db()
+        other.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count, self.post.marks_count), (0, 0, 0))
+        self.assertEqual((other.likes_count, other.trending_score), (0, 0))
+        self.assertEqual((self.author.followers_count, self.author.following_count), (0, 0))
+        self.assertFalse(models.LikeCommentModel.objects.exists())
+
+
+class LikeToggleTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.post = create_post(create_user('author'))
+        self.url = f'/api/post/{self.post.pk}/like/'
+        self.client.force_authenticate(self.user)
+
+    def test_put_and_delete_are_idempotent(self):
+        response = self.client.put(self.url)
+        self.assertEqual((response.status_code, response.data), (201, {'liked': True, 'likes_count': 1}))
+        response = self.client.put(self.url)
+        self.assertEqual((response.status_code, response.data), (200, {'liked': True, 'likes_count': 1}))
+
+        for _ in range(2):
+            response = self.client.delete(self.url)
+            self.assertEqual((response.status_code, response.data), (200, {'liked': False, 'likes_count': 0}))
+        self.assertFalse(models.LikePostModel.objects.exists())
+
+    def test_post_toggles(self):
+        response = self.client.post(self.url)
+        self.assertEqual((response.status_code, response.data), (201, {'liked': True, 'likes_count': 1}))
+        response = self.client.post(self.url)
+        self.assertEqual((response.status_code, response.data), (200, {'liked': False, 'likes_count': 0}))
+
+    def test_story_and_comment_likes(self):
+        story = models.StoryModel.objects.create(user=self.user, description='story')
+        comment = models.CommentPostModel.objects.create(user=self.user, post=self.post, comment='nice')
+
+        self.assertEqual(self.client.put(f'/api/post/story/{story.pk}/like/').data['likes_count'], 1)
+        self.assertEqual(self.client.put(f'/api/post/comment/{comment.pk}/like/').data['likes_count'], 1)
+        self.assertEqual(self.client.put(f'/api/post/story/{story.pk + 1}/like/').status_code, 404)
+
+    def test_unlike_takes_back_the_trending_score(self):
+        self.client.put(self.url)
+        self.client.delete(self.url)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.trending_score, 0)
+
+
+class ConcurrentLikeTest(TransactionTestCase):
+    def run_in_threads(self, requests):
+        """
+        Sends (user, method, url) requests at once from one thread each, returns their status codes
+        """
+        barrier = threading.Barrier(len(requests))
+        statuses = [None] * len(requests)
+
+        def send(index, user, method, url):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                while statuses[index] is None:
+                    try:
+                        statuses[index] = getattr(client, method)(url).status_code
+                    except OperationalError as error:
+                        # SQLite's shared in-memory test database fails concurrent writers instead of
+                        # making them wait; the request was rolled back, send it again
+                        if 'locked' not in str(error):
+                            raise
+                        time.sleep(0.01)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=send, args=(index, *request)) for index, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_double_taps_like_once(self):
+        user = create_user('viewer')
+        post = create_post(create_user('author'))
+
+        statuses = self.run_in_threads([(user, 'put', f'/api/post/{post.pk}/like/')] * 8)
+
+        # One of them created the like (a retried request may have seen its own like already)
+        self.assertLessEqual(statuses.count(201), 1)
+        self.assertEqual(set(statuses) - {201}, {200})
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual(models.LikePostModel.objects.filter(post=post).count(), 1)
+
+        statuses = self.run_in_threads([(user, 'delete', f'/api/post/{post.pk}/like/')] * 8)
+
+        self.assertEqual(statuses, [200] * 8)
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+    def test_parallel_likes_of_many_users_are_all_counted(self):
+        users = [create_user(f'fan{i}') for i in range(8)]
+        post = create_post(create_user('author'))
+
+        self.run_in_threads([(user, 'put', f'/api/post/{post.pk}/like/') for user in users])
+
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 8)
+        self.assertEqual(models.LikePostModel.objects.filter(post=post).count(), 8)
+
+
+class InteractionBatchTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        self.posts = [create_post(self.author, description=f'post{i}') for i in range(10)]
+        self.story = models.StoryModel.objects.create(user=self.author, description='story')
+        self.comment = models.CommentPostModel.objects.create(user=self.author, post=self.posts[0], comment='nice')
+        self.client.force_authenticate(self.user)
+
+    def send(self, *events):
+        return self.client.post('/api/post/interactions/', {'events': list(events)}, format='json')
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [result['status'] for result in response.data['results']]
+
+    def test_events_are_applied_in_order(self):
+        post = self.posts[0]
+        models.LikePostModel.objects.create(user=self.user, post=self.posts[1])
+        mentioned_post = create_post(self.author, description='with @viewer')
+        mentioned_story = models.StoryModel.objects.create(user=self.author, description='with @viewer')
+
+        response = self.send(
+            {'type': 'like', 'target': 'post', 'id': post.pk},
+            {'type': 'like', 'target': 'post', 'id': post.pk},
+            {'type': 'mark', 'target': 'post', 'id': mentioned_post.pk},
+            {'type': 'unlike', 'target': 'post', 'id': self.posts[1].pk},
+            {'type': 'like', 'target': 'story', 'id': self.story.pk},
+            {'type': 'mark', 'target': 'story', 'id': mentioned_story.pk},
+            {'type': 'like', 'target': 'comment', 'id': self.comment.pk},
+            {'type': 'like', 'target': 'post', 'id': 10 ** 6},
+        )
+
+        self.assertEqual(self.statuses(response), ['applied', 'unchanged', 'applied', 'applied', 'applied',
+                                                   'applied', 'applied', 'not_found'])
+        for instance in (post, mentioned_post, self.posts[1], self.story, mentioned_story, self.comment):
+            instance.refresh_from_db()
+        self.assertEqual((post.likes_count, mentioned_post.marks_count), (1, 1))
+        self.assertEqual(self.posts[1].likes_count, 0)
+        self.assertEqual((self.story.likes_count, mentioned_story.marks_count), (1, 1))
+        self.assertEqual(self.comment.likes_count, 1)
+        self.assertTrue(models.MarkModel.objects.filter(user=self.user, story=mentioned_story).exists())
+        self.assertFalse(models.LikePostModel.objects.filter(user=self.user, post=self.posts[1]).exists())
+        # Liking and unliking took back exactly what the like had added
+        self.assertGreater(post.trending_score, 0)
+        self.assertEqual(self.posts[1].trending_score, 0)
+
+    def test_like_then_unlike_nets_out(self):
+        post = self.posts[2]
+
+        response = self.send({'type': 'like', 'target': 'post', 'id': post.pk},
+                             {'type': 'unlike', 'target': 'post', 'id': post.pk})
+
+        self.assertEqual(self.statuses(response), ['applied', 'applied'])
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.trending_score), (0, 0))
+        self.assertFalse(models.LikePostModel.objects.exists())
+
+    def test_views_go_through_the_buffer(self):
+        cache.set('view_buffer:next_flush', 1, timeout=3600)
+        view = {'type': 'view', 'target': 'post', 'id': self.posts[0].pk}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.statuses(self.send(view, view, view)), ['applied'] * 3)
+        flush_views()
+
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].views, 3)
+
+    def test_invalid_events_fail_alone(self):
+        response = self.send(
+            {'type': 'view', 'target': 'comment', 'id': self.comment.pk},
+            {'type': 'poke', 'target': 'post', 'id': self.posts[0].pk},
+            'like',
+            {'type': 'like', 'target': 'post', 'id': self.posts[0].pk},
+        )
+
+        self.assertEqual(self.statuses(response), ['invalid', 'invalid', 'invalid', 'applied'])
+        self.assertIn('errors', response.data['results'][0])
+        self.assertEqual(response.data['results'][3], {'type': 'like', 'target': 'post', 'id': self.posts[0].pk,
+                                                       'status': 'applied'})
+
+    @override_settings(INTERACTION_BATCH_MAX=2)
+    def test_batch_size_is_limited(self):
+        view = {'type': 'view', 'target': 'post', 'id': self.posts[0].pk}
+
+        self.assertEqual(self.send(view, view, view).status_code, 400)
+        self.assertEqual(self.send().status_code, 400)
+
+    def test_marks_only_go_where_the_caption_mentions_the_requester(self):
+        mentioned = create_post(self.author, description='sunset with @Viewer.')
+        named_elsewhere = create_post(self.author, description='with @viewer2 and viewer')
+        own = create_post(self.user, description='own')
+        models.MarkModel.objects.create(user=self.user, story=self.story)
+
+        response = self.send(
+            {'type': 'mark', 'target': 'post', 'id': mentioned.pk},
+            {'type': 'mark', 'target': 'post', 'id': named_elsewhere.pk},
+            {'type': 'mark', 'target': 'post', 'id': own.pk},
+            {'type': 'mark', 'target': 'story', 'id': self.story.pk},
+            {'type': 'unmark', 'target': 'story', 'id': self.story.pk},
+        )
+
+        self.assertEqual(self.statuses(response), ['applied', 'forbidden', 'forbidden', 'forbidden', 'applied'])
+        self.assertEqual(list(models.MarkModel.objects.filter(user=self.user).values_list('post', flat=True)),
+                         [mentioned.pk])
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def events(posts):
+            return [{'type': kind, 'target': 'post', 'id': post.pk} for post in posts for kind in ('like', 'mark')]
+
+        # Marks only go where the requester is mentioned
+        models.PostModel.objects.update(description='with @author')
+        self.client.force_authenticate(self.author)
+        with CaptureQueriesContext(connection) as small:
+            self.statuses(self.send(*events(self.posts[:1])))
+        with CaptureQueriesContext(connection) as large:
+            self.statuses(self.send(*events(self.posts[1:])))
+
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(models.LikePostModel.objects.filter(user=self.author).count(), 10)
+        self.assertEqual(models.MarkModel.objects.filter(user=self.author).count(), 10)
+
+
+@override_settings(VIEW_BUFFER_FLUSH_INTERVAL=3600, VIEW_BUFFER_MAX_PENDING=5)
+class ViewBufferTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.post = create_post(create_user('author'))
+        self.client.force_authenticate(self.user)
+        # Start inside a flush interval so only MAX_PENDING or an explicit flush writes views
+        cache.set('view_buffer:next_flush', 1, timeout=3600)
+
+    def test_views_are_buffered_until_flushed(self):
+        updated_at = models.PostModel.objects.get(pk=self.post.pk).updated_at
+
+        for _ in range(3):
+            self.client.get(f'/api/post/{self.post.pk}/')
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 0)
+
+        out = StringIO()
+        call_command('flush_views', stdout=out)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 3)
+        self.assertEqual(self.post.updated_at, updated_at)
+        self.assertIn('3 views flushed', out.getvalue())
+
+    def test_max_pending_forces_flush(self):
+        story = models.StoryModel.objects.create(user=self.user, description='story')
+
+        for _ in range(4):
+            record_view(self.post)
+        record_view(story)
+
+        self.post.refresh_from_db()
+        story.refresh_from_db()
+        self.assertEqual(self.post.views, 4)
+        self.assertEqual(story.views, 1)
+        self.assertEqual(flush_views(), 0)
+
+    def test_views_recorded_during_a_flush_are_kept(self):
+        get_many = cache.get_many
+        interleaved = []
+
+        def record_while_flushing(keys, *args, **kwargs):
+            counts = get_many(keys, *args, **kwargs)
+            if not interleaved and any(':count:' in key for key in keys):
+                # Between reading the counters and writing them out
+                interleaved.append(1)
+                record_view(self.post)
+            return counts
+
+        record_view(self.post)
+        record_view(self.post)
+        with mock.patch.object(cache, 'get_many', record_while_flushing):
+            self.assertEqual(flush_views(), 2)
+        self.assertEqual(flush_views(), 1)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 3)
+
+    def test_entry_numbered_before_it_is_written_is_not_skipped(self):
+        record_view(self.post)
+        # record_views() of another request between numbering its entry and writing it
+        seq = cache.incr('view_buffer:seq')
+        self.assertEqual(flush_views(), 1)
+
+        story = models.StoryModel.objects.create(user=self.user, description='story')
+        cache.set(f'view_buffer:count:app_post.storymodel:{story.pk}', 2)
+        cache.set(f'view_buffer:registered:app_post.storymodel:{story.pk}', 1)
+        cache.set(f'view_buffer:entry:{seq}', ('app_post.storymodel', story.pk))
+        self.assertEqual(flush_views(), 2)
+
+        story.refresh_from_db()
+        self.assertEqual(story.views, 2)
+
+    def test_emptied_counters_expire(self):
+        story = models.StoryModel.objects.create(user=self.user, description='story')
+        record_view(story)
+        record_view(self.post)
+        self.assertEqual(flush_views(), 2)
+        # Viewed again since: kept until the next flush
+        record_view(self.post)
+
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 60 * 60 + 1):
+            self.assertIsNone(cache.get(f'view_buffer:count:app_post.storymodel:{story.pk}'))
+            self.assertEqual(cache.get(f'view_buffer:count:app_post.postmodel:{self.post.pk}'), 1)
+
+    def test_flushes_follow_an_evicted_sequence(self):
+        story = models.StoryModel.objects.create(user=self.user, description='story')
+        record_view(self.post)
+        record_view(story)
+        self.assertEqual(flush_views(), 2)
+
+        cache.delete('view_buffer:seq')
+        record_view(self.post)
+        self.assertEqual(flush_views(), 1)
+
+        # Evicted again, with its restart racing a flush
+        cache.delete('view_buffer:seq')
+        record_view(story)
+        cache.set('view_buffer:flushed_seq', 10)
+        self.assertEqual(flush_views(), 1)
+
+        self.post.refresh_from_db()
+        story.refresh_from_db()
+        self.assertEqual((self.post.views, story.views), (2, 2))
+
+    def test_counter_evicted_during_a_flush_is_written(self):
+        incr = cache.incr
+
+        def evicted(key, delta=1, *args, **kwargs):
+            if delta < 0:
+                raise ValueError(key)
+            return incr(key, delta, *args, **kwargs)
+
+        record_view(self.post)
+        with mock.patch.object(cache, 'incr', evicted):
+            self.assertEqual(flush_views(), 1)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 1)
+
+
+class FeedTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.followed = create_user('followed')
+        self.stranger = create_user('stranger')
+        FollowModel.objects.create(follower=self.user, followed=self.followed)
+        self.client.force_authenticate(self.user)
+
+    def feed_ids(self, **params):
+        response = self.client.get('/api/post/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_feed_contains_only_followed_accounts(self):
+        post = create_post(self.followed)
+        create_post(self.stranger)
+
+        self.assertEqual(self.feed_ids(), [post.pk])
+
+    def test_new_post_is_fanned_out_to_cached_timelines(self):
+        self.assertEqual(self.feed_ids(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = create_post(self.followed)
+
+        self.assertEqual(cache.get(feed.timeline_key(self.user.pk)), [post.pk])
+        self.assertEqual(self.feed_ids(), [post.pk])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        post = create_post(self.stranger)
+        self.assertEqual(self.feed_ids(), [])
+
+        follow = FollowModel.objects.create(follower=self.user, followed=self.stranger)
+        self.assertEqual(self.feed_ids(), [post.pk])
+
+        follow.delete()
+        self.assertEqual(self.feed_ids(), [])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_follower_accounts_are_read_at_read_time(self):
+        self.assertEqual(self.feed_ids(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = create_post(self.followed)
+
+        self.assertEqual(cache.get(feed.timeline_key(self.user.pk)), [])
+        self.assertEqual(self.feed_ids(), [post.pk])
+
+    def test_feed_pages_with_before(self):
+        posts = [create_post(self.followed, description=f'post{i}') for i in range(7)]
+
+        response = self.client.get('/api/post/feed/')
+        first_page = [post['id'] for post in response.data['results']]
+        self.assertEqual(first_page, [post.pk for post in reversed(posts)][:5])
+
+        self.assertEqual(self.feed_ids(before=first_page[-1]), [posts[1].pk, posts[0].pk])
+
+    def test_concurrent_pushes_keep_both_posts(self):
+        key = feed.timeline_key(self.user.pk)
+        cache.set(key, [])
+        get_many = LocMemCache.get_many
+
+        def slow_get_many(self, keys, *args, **kwargs):
+            timelines = get_many(self, keys, *args, **kwargs)
+            # Both pushes read before either writes, unless the lock orders them
+            time.sleep(0.05)
+            return timelines
+
+        # Every thread has a cache instance of its own
+        with mock.patch.object(LocMemCache, 'get_many', slow_get_many):
+            threads = [threading.Thread(target=feed._push, args=(cache, [key], post_id)) for post_id in (1, 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(cache.get(key), [2, 1])
+
+    @override_settings(FEED_LOCK_TIMEOUT=0.05)
+    def test_timeline_locked_too_long_is_dropped(self):
+        key = feed.timeline_key(self.user.pk)
+        cache.set(key, [1])
+        cache.set(f'{key}:lock', 1)
+
+        feed._push(cache, [key], 2)
+
+        self.assertIsNone(cache.get(key))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class IndexPlanTest(TestCase):
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        print(f'\n{queryset.query}\n{plan}')
+
+        for line in plan.splitlines():
+            if 'SCAN' in line:
+                self.assertIn('USING', line, f'Full table scan in:\n{plan}')
+        self.assertRegex(plan, r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY')
+
+    def test_hot_queries_use_indexes(self):
+        hot_queries = [
+            models.LikePostModel.objects.filter(user_id=1, post_id=1),
+            models.LikeStoryModel.objects.filter(user_id=1, story_id=1),
+            models.LikeCommentModel.objects.filter(user_id=1, comment_id=1),
+            models.MarkModel.objects.filter(user_id=1, post_id=1),
+            models.MarkModel.objects.filter(user_id=1, story_id=1),
+            models.CommentPostModel.objects.filter(post_id=1, is_deleted=False),
+            models.CommentPostModel.objects.filter(post_id=1).order_by('-created_at', '-id'),
+            models.PostModel.objects.filter(id=1, is_deleted=False),
+            models.PostModel.objects.order_by('-trending_score')[:100],
+            models.PostModel.objects.order_by('-created_at', '-id'),
+            models.PostModel.objects.filter(user_id=1).order_by('-created_at', '-id'),
+            models.PostModel.objects.filter(user_id__in=[1, 2], is_deleted=False).order_by('-pk'),
+            models.StoryModel.objects.order_by('-created_at', '-id'),
+            stories.live().order_by('-expires_at', '-id'),
+            stories.live().filter(user_id__in=[1, 2]),
+            models.StoryModel.objects.filter(is_archived=False, expires_at__lte=timezone.now()),
+            models.LikePostModel.objects.filter(post_id=1).order_by('-created_at', '-id'),
+            FollowModel.objects.filter(followed_id=1).order_by('-created_at', '-id'),
+            FollowModel.objects.filter(follower_id=1).order_by('-created_at', '-id'),
+        ]
+
+        for queryset in hot_queries:
+            with self.subTest(query=str(queryset.query)):
+                self.assertUsesIndex(queryset)
+
+
+class SearchTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.client.force_authenticate(self.user)
+
+    def result_ids(self, url, q):
+        response = self.client.get(url, {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_ranked_prefix_search_on_posts(self):
+        weak = create_post(self.user, description='sunset over the sea')
+        strong = create_post(self.user, description='sunset sunset sunset')
+        create_post(self.user, description='mountains')
+
+        self.assertEqual(self.result_ids('/api/post/', 'suns'), [strong.pk, weak.pk])
+        self.assertEqual(self.result_ids('/api/post/', 'sunset sea'), [weak.pk])
+
+    def test_scoped_search_finds_matches_past_the_global_limit(self):
+        author = create_user('author')
+        other = create_user('other')
+        models.PostModel.objects.bulk_create([models.PostModel(user=other, description='sunset sunset sunset')
+                                              for _ in range(510)])
+        mine = create_post(author, description='a long walk with a sunset somewhere in the middle of it')
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(self.result_ids(f'/api/post/user/{author.pk}/', 'sunset'), [mine.pk])
+
+    def test_search_pages_keep_relevance_order(self):
+        weak = create_post(self.user, description='sunset over the sea')
+        strong = create_post(self.user, description='sunset sunset sunset')
+
+        response = self.client.get('/api/post/', {'q': 'sunset', 'page_size': 1})
+        self.assertEqual(response.data['results'][0]['id'], strong.pk)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['id'], weak.pk)
+        self.assertIsNone(response.data['next'])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = create_post(self.user, description='first draft')
+        self.assertEqual(self.result_ids('/api/post/', 'draft'), [post.pk])
+
+        post.description = 'final version'
+        post.save()
+        self.assertEqual(self.result_ids('/api/post/', 'draft'), [])
+        self.assertEqual(self.result_ids('/api/post/', 'final'), [post.pk])
+
+        post.delete()
+        self.assertEqual(self.result_ids('/api/post/', 'final'), [])
+
+    def test_comment_and_tag_search(self):
+        post = create_post(self.user, description='travel')
+        comment = models.CommentPostModel.objects.create(user=self.user, post=post, comment='Lovely colours')
+
+        self.assertEqual(self.result_ids('/api/post/comment/', 'lovel'), [comment.pk])
+        self.assertEqual(self.result_ids(f'/api/post/{post.pk}/comment/', 'colours'), [comment.pk])
+        self.assertEqual(self.result_ids('/api/post/tag/', 'trav'), [models.TagModel.objects.get(tag='#travel').pk])
+
+    def test_rebuild_search_index(self):
+        post = create_post(self.user, description='rebuilt')
+        models.PostModel.objects.filter(pk=post.pk).update(description='renamed')
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(self.result_ids('/api/post/', 'renamed'), [post.pk])
+
+
+class TrendingTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        self.client.force_authenticate(self.user)
+
+    def top_ids(self, **params):
+        response = self.client.get('/api/post/top/', params)
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_recent_engagement_outranks_old_engagement(self):
+        old = create_post(self.author, description='old')
+        new = create_post(self.author, description='new')
+        three_days_ago = timezone.now() - timedelta(days=3)
+
+        trending.record([old.pk], 'like', count=5, at=three_days_ago)
+        trending.record([new.pk], 'like')
+
+        self.assertEqual(self.top_ids(), [new.pk, old.pk])
+
+    def test_events_update_scores_incrementally(self):
+        post = create_post(self.author, description='liked')
+        other = create_post(self.author, description='commented')
+
+        like = models.LikePostModel.objects.create(user=self.user, post=post)
+        models.CommentPostModel.objects.create(user=self.user, post=other, comment='first')
+        self.assertEqual(self.top_ids(), [other.pk, post.pk])
+
+        like.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.trending_score, 0)
+        self.assertEqual(self.top_ids(), [other.pk])
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_top_posts_are_read_off_the_score_index(self):
+        for i in range(3):
+            trending.record([create_post(self.author, description=f'post{i}').pk], 'view')
+
+        self.top_ids()
+        with self.assertNumQueries(9):
+            self.top_ids()
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False, TRENDING_SIZE=2)
+    def test_scores_written_elsewhere_show_at_once(self):
+        posts = [create_post(self.author, description=f'post{i}') for i in range(3)]
+        trending.record([posts[0].pk, posts[1].pk], 'like')
+        self.assertEqual(self.top_ids(), [posts[1].pk, posts[0].pk])
+
+        # As another process would, without going through this one's memory
+        models.PostModel.objects.filter(pk=posts[2].pk).update(trending_score=10 ** 6)
+        models.PostModel.objects.filter(pk=posts[1].pk).update(is_deleted=True)
+        self.assertEqual(self.top_ids(), [posts[2].pk, posts[0].pk])
+
+    def test_search_within_top_posts(self):
+        match = create_post(self.author, description='sunset')
+        other = create_post(self.author, description='mountains')
+        trending.record([match.pk, other.pk], 'like')
+
+        self.assertEqual(self.top_ids(q='suns'), [match.pk])
+
+    def test_rebuild_trending(self):
+        post = create_post(self.author)
+        models.PostModel.objects.filter(pk=post.pk).update(likes_count=3, trending_score=0)
+
+        call_command('rebuild_trending', stdout=StringIO())
+
+        self.assertEqual(self.top_ids(), [post.pk])
+
+
+class AsyncViewTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        cache.set('view_buffer:next_flush', 1, timeout=3600)
+        self.user = create_user('viewer')
+        self.author = create_user('author')
+        self.post = create_post(self.author, likers=[self.user], commenters=[self.user], description='sunset')
+        create_post(self.author, description='mountains')
+        models.StoryModel.objects.create(user=self.author, description='story')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_async_views_answer_like_the_sync_ones(self):
+        self.client.force_authenticate(self.user)
+        for sync_url, async_url in [
+            ('/api/post/', '/api/post/async/'),
+            ('/api/post/?q=suns', '/api/post/async/?q=suns'),
+            (f'/api/post/{self.post.pk}/', f'/api/post/async/{self.post.pk}/'),
+            ('/api/post/story/', '/api/post/async/story/'),
+            ('/api/post/story/?page=2', '/api/post/async/story/?page=2'),
+        ]:
+            with self.subTest(url=async_url):
+                expected, response = self.client.get(sync_url), self.client.get(async_url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+
+    def test_jwt_and_errors(self):
+        self.assertEqual(self.client.get('/api/post/async/').status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(self.client.get('/api/post/async/').status_code, 200)
+        self.assertEqual(self.client.get('/api/post/async/0/').status_code, 404)
+        self.assertEqual(self.client.post('/api/post/async/', {}).status_code, 405)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual(self.client.get('/api/post/async/').status_code, 401)
+
+    async def test_served_on_the_event_loop(self):
+        # Through the async handler: a query run outside the async ORM would raise SynchronousOnlyOperation
+        response = await self.async_client.get(f'/api/post/async/{self.post.pk}/',
+                                               headers={'Authorization': f'Bearer {self.token}'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['description'], 'sunset')
+        self.assertTrue(response.json()['is_liked'])
+
+
+def jpeg_upload(width, height, orientation=None, name='photo.jpg'):
+    image = Image.new('RGB', (width, height), 'red')
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = 'Camera'
+    if orientation:
+        exif[ExifTags.Base.Orientation] = orientation
+
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(IMAGE_PROCESSING_SYNC=True, IMAGE_RENDITIONS={'thumbnail': 32, 'feed': 64})
+class ImageRenditionTest(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+        self.user = create_user('author')
+        self.client.force_authenticate(self.user)
+
+    def upload_photo(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = models.PhotoModel.objects.create(photo=jpeg_upload(**kwargs))
+        photo.refresh_from_db()
+        return photo
+
+    def test_renditions_are_resized_and_stripped(self):
+        # Orientation 6 means the camera was rotated, so the photo is 100 wide and 200 high
+        photo = self.upload_photo(width=200, height=100, orientation=6)
+
+        renditions = photo.renditions
+        self.assertEqual((renditions['width'], renditions['height']), (100, 200))
+        self.assertEqual((renditions['thumbnail']['width'], renditions['thumbnail']['height']), (16, 32))
+        self.assertEqual((renditions['feed']['width'], renditions['feed']['height']), (32, 64))
+
+        for ext, fmt in [('webp', 'WEBP'), ('jpeg', 'JPEG')]:
+            with photo.photo.storage.open(renditions['thumbnail'][ext]) as file, Image.open(file) as image:
+                self.assertEqual(image.format, fmt)
+                self.assertEqual(len(image.getexif()), 0)
+
+    def test_post_serves_the_requested_rendition(self):
+        photo = self.upload_photo(width=200, height=100)
+        post = models.PostModel.objects.create(user=self.user, description='photo')
+        post.photos.add(photo)
+
+        response = self.client.get(f'/api/post/{post.pk}/', {'image_size': 'thumbnail'}, HTTP_ACCEPT='application/json, image/webp')
+        [served] = response.data['photos']
+        self.assertTrue(served['url'].endswith('.webp'))
+        self.assertEqual((served['width'], served['height']), (32, 16))
+
+        response = self.client.get(f'/api/post/{post.pk}/')
+        [served] = response.data['photos']
+        self.assertEqual(served['url'], photo.photo.storage.url(photo.renditions['feed']['jpeg']))
+
+        response = self.client.get(f'/api/post/{post.pk}/', {'image_format': 'webp'})
+        [served] = response.data['photos']
+        self.assertEqual(served['url'], photo.photo.storage.url(photo.renditions['feed']['webp']))
+
+    def test_pending_until_renditions_exist(self):
+        photo = models.PhotoModel.objects.create(photo=jpeg_upload(width=20, height=20))
+        post = models.PostModel.objects.create(user=self.user, description='photo')
+        post.photos.add(photo)
+
+        [served] = self.client.get(f'/api/post/{post.pk}/').data['photos']
+        self.assertEqual(served, {'id': photo.pk, 'url': None, 'width': None, 'height': None, 'pending': True})
+
+    @override_settings(IMAGE_PROCESSING_SYNC=False)
+    def test_source_is_read_in_the_pool(self):
+        photo = models.PhotoModel.objects.create(photo=jpeg_upload(width=20, height=20))
+        pool = mock.Mock()
+
+        with mock.patch('app_post.images.get_pool', return_value=pool), \
+                mock.patch('builtins.open', side_effect=AssertionError('Read on the request thread')):
+            images.process(models.PhotoModel, photo.pk, photo.photo.name)
+
+        pool.submit.assert_called_once_with(images.render_file, photo.photo.path,
+                                            images.rendition_sizes(), images.image_quality())
+
+
+class ChunkedUploadTest(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        cache.clear()
+
+        self.user = create_user('author')
+        self.client.force_authenticate(self.user)
+        self.content = bytes(range(256)) * 40
+
+    def open_upload(self, **extra):
+        response = self.client.post('/api/post/upload/', {'filename': 'clip.mp4', 'size': len(self.content), **extra})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def put_chunk(self, upload_id, start, end, checksum=None):
+        chunk = self.content[start:end]
+        return self.client.generic(
+            'PUT', f'/api/post/upload/{upload_id}/', chunk, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.content)}',
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    def test_upload_in_chunks_and_attach_to_post(self):
+        upload_id = self.open_upload(sha256=hashlib.sha256(self.content).hexdigest())
+
+        self.assertEqual(self.put_chunk(upload_id, 0, 4000).data['received'], 4000)
+        response = self.put_chunk(upload_id, 4000, len(self.content))
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['is_complete'])
+
+        video = models.VideoModel.objects.get(pk=response.data['video'])
+        with video.video.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+
+        response = self.client.post('/api/post/', {'description': 'clip', 'video_ids': [video.pk]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(models.PostModel.objects.get(description='clip').videos.all()), [video])
+
+    def test_bad_chunk_is_discarded_and_upload_resumes(self):
+        upload_id = self.open_upload()
+        self.put_chunk(upload_id, 0, 4000)
+
+        response = self.put_chunk(upload_id, 4000, 8000, checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/post/upload/{upload_id}/').data['received'], 4000)
+
+        self.assertEqual(self.put_chunk(upload_id, 6000, 8000).status_code, 409)
+        self.assertEqual(self.put_chunk(upload_id, 4000, len(self.content)).status_code, 201)
+
+    def test_chunk_waits_for_no_row_lock(self):
+        upload_id = self.open_upload()
+        locked = mock.Mock()
+        # What NOWAIT raises while another process writes a chunk of the session
+        locked.get.side_effect = OperationalError('could not obtain lock on row')
+
+        with mock.patch.object(models.UploadSessionModel.objects, 'select_for_update', return_value=locked):
+            self.assertEqual(self.put_chunk(upload_id, 0, 4000).status_code, 409)
+        self.assertEqual(self.client.get(f'/api/post/upload/{upload_id}/').data['received'], 0)
+        self.assertEqual(self.put_chunk(upload_id, 0, 4000).status_code, 200)
+
+    def test_unfinished_or_foreign_uploads_cannot_be_attached(self):
+        upload_id = self.open_upload()
+        self.put_chunk(upload_id, 0, 4000)
+        stranger = create_user('stranger')
+        foreign = models.VideoModel.objects.create(video='Post/Videos/other.mp4')
+        models.UploadSessionModel.objects.create(user=stranger, filename='other.mp4', size=1, received=1,
+                                                 part='Uploads/other.part', video=foreign)
+
+        response = self.client.post('/api/post/', {'description': 'clip', 'video_ids': [foreign.pk]})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(IMAGE_PROCESSING_SYNC=True, IMAGE_RENDITIONS={'thumbnail': 8})
+class MediaDedupeTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def upload_photo(self, name='photo.jpg'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return models.PhotoModel.objects.create(photo=jpeg_upload(width=20, height=10, name=name))
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload_photo('first.jpg')
+        second = self.upload_photo('second.jpg')
+        first.refresh_from_db()
+
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertEqual(models.MediaBlobModel.objects.get(name=first.photo.name).ref_count, 2)
+        # The original and its WebP and JPEG thumbnail
+        self.assertEqual(models.MediaBlobModel.objects.count(), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(second.photo.storage.exists(second.photo.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        # Kept for the grace period, an upload of the same photo may be reusing the file
+        self.assertTrue(second.photo.storage.exists(second.photo.name))
+        self.assertEqual(media.sweep(), 0)
+
+        out = StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(hours=2)):
+            call_command('sweep_media', stdout=out)
+        self.assertIn('3 unreferenced blobs deleted', out.getvalue())
+        self.assertFalse(second.photo.storage.exists(second.photo.name))
+        self.assertFalse(models.MediaBlobModel.objects.exists())
+
+    def test_reused_file_is_kept_for_another_grace_period(self):
+        first = self.upload_photo('first.jpg')
+        storage = first.photo.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+
+        # An upload of the same photo 50 minutes later finds the file and skips writing it
+        later = timezone.now() + timedelta(minutes=50)
+        sha256, ext = os.path.splitext(os.path.basename(first.photo.name))
+        copy = storage.path('blobs/upload.tmp')
+        shutil.copyfile(storage.path(first.photo.name), copy)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            name = storage.adopt(copy, sha256, ext)
+        self.assertEqual(name, first.photo.name)
+
+        # Its renditions go, the original waits for the upload's row to reference it
+        self.assertEqual(media.sweep(now=later + timedelta(minutes=40)), 2)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(media.sweep(now=later + timedelta(hours=2)), 1)
+        self.assertFalse(storage.exists(name))
+
+    def test_dedupe_existing_media(self):
+        storage = models.PhotoModel._meta.get_field('photo').storage
+        content = jpeg_upload(width=20, height=10).read()
+        legacy = []
+        for name in ('Post/Photos/a.jpg', 'Post/Photos/b.jpg'):
+            path = storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+            legacy.append(models.PhotoModel.objects.create(photo=name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=StringIO())
+
+        names = {photo.photo.name for photo in models.PhotoModel.objects.all()}
+        [blob] = names
+        self.assertTrue(blob.startswith('blobs/'))
+        self.assertEqual(models.MediaBlobModel.objects.get(name=blob).ref_count, 2)
+        self.assertFalse(storage.exists('Post/Photos/a.jpg'))
+        self.assertFalse(storage.exists('Post/Photos/b.jpg'))
+
+
+class CaptionTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, IMAGE_PROCESSING_SYNC=True))
+
+        self.user = create_user('author')
+        self.friends = [create_user(f'friend{i}') for i in range(5)]
+        self.client.force_authenticate(self.user)
+        self.widths = iter(range(10, 100))
+
+    def create(self, caption, photos=2):
+        # Distinct photos: reusing a stored one costs a query (see app_post.media.touch)
+        uploads = [jpeg_upload(width=next(self.widths), height=10, name=f'{i}.jpg') for i in range(photos)]
+        response = self.client.post('/api/post/', {'description': caption, 'photos': uploads}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return models.PostModel.objects.get(pk=response.data['id'])
+
+    def test_extract(self):
+        tags, usernames = captions.extract('#Sun at the #beach with @Bob. and @bob, #beach again!')
+        self.assertEqual(tags, ['#Sun', '#beach'])
+        self.assertEqual(usernames, ['bob'])
+
+    def test_query_count_does_not_grow_with_the_caption(self):
+        caption = ' '.join([f'#tag{i}' for i in range(3)] + ['@friend0'])
+        with CaptureQueriesContext(connection) as short:
+            self.create(caption)
+
+        caption = ' '.join([f'#other{i}' for i in range(30)] + [f'@friend{i}' for i in range(5)] + ['@nobody'])
+        with CaptureQueriesContext(connection) as long:
+            post = self.create(caption, photos=5)
+
+        self.assertEqual(len(long), len(short))
+        self.assertEqual(post.tags.count(), 30)
+        self.assertEqual(post.photos.count(), 5)
+
+    def test_mentions_mark_the_mentioned_users(self):
+        post = self.create('with @friend1 and @FRIEND2 #trip')
+
+        marked = set(post.marks.values_list('user__username', flat=True))
+        self.assertEqual(marked, {'friend1', 'friend2'})
+        post.refresh_from_db()
+        self.assertEqual(post.marks_count, 2)
+        self.assertGreater(post.trending_score, 0)
+
+        response = self.client.get('/api/post/tag/', {'q': 'trip'})
+        self.assertEqual([tag['tag'] for tag in response.data['results']], ['#trip'])
+
+
+class StoryExpiryTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('viewer')
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.stranger = create_user('stranger')
+        FollowModel.objects.create(follower=self.user, followed=self.alice)
+        FollowModel.objects.create(follower=self.user, followed=self.bob)
+        self.client.force_authenticate(self.user)
+
+    def create_story(self, user, hours_ago=0):
+        story = models.StoryModel.objects.create(user=user, description='story')
+        created_at = timezone.now() - timedelta(hours=hours_ago)
+        models.StoryModel.objects.filter(pk=story.pk).update(created_at=created_at,
+                                                             expires_at=created_at + timedelta(days=1))
+        return story
+
+    def test_lists_serve_live_stories_only(self):
+        live = self.create_story(self.alice, hours_ago=1)
+        expired = self.create_story(self.alice, hours_ago=30)
+
+        response = self.client.get('/api/post/story/')
+        self.assertEqual([story['id'] for story in response.data['results']], [live.pk])
+
+        response = self.client.get(f'/api/post/story/{expired.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+        # The author still sees it
+        self.client.force_authenticate(self.alice)
+        response = self.client.get(f'/api/post/story/user/{self.alice.pk}/')
+        self.assertEqual({story['id'] for story in response.data['results']}, {live.pk, expired.pk})
+
+    def test_archive_expired_in_batches(self):
+        live = self.create_story(self.alice, hours_ago=1)
+        expired = [self.create_story(self.bob, hours_ago=25 + i) for i in range(5)]
+        models.MediaBlobModel.objects.create(name='blobs/aa/feed.webp', ref_count=1)
+        models.StoryModel.objects.filter(pk=expired[0].pk).update(photo_renditions={
+            'source': 'blobs/bb/photo.jpg', 'width': 640, 'height': 480,
+            'feed': {'width': 64, 'height': 48, 'webp': 'blobs/aa/feed.webp'},
+        })
+
+        self.assertEqual(stories.archive_expired(batch_size=2), 5)
+        self.assertEqual(stories.archive_expired(batch_size=2), 0)
+
+        self.assertEqual(set(models.StoryModel.objects.filter(is_archived=True).values_list('pk', flat=True)),
+                         {story.pk for story in expired})
+        self.assertFalse(models.StoryModel.objects.get(pk=live.pk).is_archived)
+
+        # Renditions are released, the dimensions of the original stay
+        expired[0].refresh_from_db()
+        self.assertEqual(expired[0].photo_renditions, {'width': 640, 'height': 480})
+        self.assertEqual(models.MediaBlobModel.objects.get(name='blobs/aa/feed.webp').ref_count, 0)
+
+    @override_settings(STORY_ARCHIVE_TTL=60 * 60 * 24)
+    def test_expire_stories_command_deletes_old_archives(self):
+        recent = self.create_story(self.alice, hours_ago=30)
+        old = self.create_story(self.alice, hours_ago=60)
+
+        out = StringIO()
+        call_command('expire_stories', stdout=out)
+
+        self.assertIn('2 stories archived, 1 archived stories deleted', out.getvalue())
+        self.assertEqual(list(models.StoryModel.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertFalse(models.StoryModel.objects.filter(pk=old.pk).exists())
+
+    def test_tray_groups_live_stories_per_author(self):
+        alice_first = self.create_story(self.alice, hours_ago=5)
+        alice_second = self.create_story(self.alice, hours_ago=1)
+        bob_story = self.create_story(self.bob, hours_ago=3)
+        self.create_story(self.bob, hours_ago=30)
+        self.create_story(self.stranger, hours_ago=1)
+
+        response = self.client.get('/api/post/story/tray/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(group['user']['username'], [story['id'] for story in group['stories']]) for group in response.data],
+            [('alice', [alice_first.pk, alice_second.pk]), ('bob', [bob_story.pk])]
+        )
+
+    def test_tray_query_count_does_not_grow_with_stories(self):
+        for i in range(2):
+            self.create_story(self.alice, hours_ago=i)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/api/post/story/tray/')
+
+        for i in range(6):
+            story = self.create_story(self.bob, hours_ago=i)
+            models.LikeStoryModel.objects.create(user=self.alice, story=story)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get('/api/post/story/tray/')
+
+        self.assertEqual(len(few), len(many))
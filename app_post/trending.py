@@ -0,0 +1,112 @@
+"""
+Time-decayed trending scores for /api/post/top/.
+
+Every view, like, comment and mark is worth weight * 2 ** ((t - TRENDING_EPOCH) / TRENDING_HALF_LIFE),
+so later events weigh exponentially more than older ones. That ranks posts the
+same way as decaying every score over time, but an event only has to update
+the post it belongs to.
+
+PostModel.trending_score stores log2 of that sum (0 means no engagement), so
+it grows by one per half-life instead of overflowing. The top list reads the
+best TRENDING_SIZE scores straight off its index (post_trending_idx), so
+every process sees the same list as soon as a score is written.
+"""
+from math import log2
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app_post.models import PostModel
+
+
+def _size():
+    return getattr(settings, 'TRENDING_SIZE', 100)
+
+
+def _half_lives(at=None):
+    return ((at or timezone.now()) - settings.TRENDING_EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+
+
+def event_score(kind, count=1, at=None):
+    """
+    log2 of what `count` events of `kind` at `at` (now by default) add to a post
+    """
+    return log2(settings.TRENDING_WEIGHTS[kind] * count) + _half_lives(at)
+
+
+def combine(score, delta, subtract=False):
+    """
+    log2(2 ** score + 2 ** delta), or log2(2 ** score - 2 ** delta) when subtracting
+    """
+    if score <= 0:
+        return 0 if subtract else delta
+
+    if subtract:
+        # Taking back everything that is left, up to float rounding
+        return 0 if delta >= score - 1e-9 else score + log2(1 - 2 ** (delta - score))
+
+    high, low = max(score, delta), min(score, delta)
+    return high + log2(1 + 2 ** (low - high))
+
+
+def record(post_ids, kind, count=1, at=None):
+    """
+    Adds `count` events of `kind` to each post in post_ids (a negative count
+    takes them back)
+    """
+    record_events([(post_id, kind, count, at) for post_id in post_ids])
+
+
+def record_events(events):
+    """
+    Applies (post_id, kind, count, at) events as record() does, with one read
+    and one write however many posts and kinds they cover
+    """
+    events = [event for event in events if event[0] and event[2]]
+    if not events:
+        return
+
+    with transaction.atomic():
+        posts = {post.pk: post for post in
+                 PostModel.objects.select_for_update().filter(pk__in={event[0] for event in events})
+                 .only('trending_score')}
+        for post_id, kind, count, at in events:
+            post = posts.get(post_id)
+            if post is not None:
+                post.trending_score = combine(post.trending_score, event_score(kind, abs(count), at),
+                                              subtract=count < 0)
+        PostModel.objects.bulk_update(list(posts.values()), ['trending_score'])
+
+
+def top_post_ids():
+    """
+    Pks of the TRENDING_SIZE live posts with the best scores, best first, as a subquery
+    """
+    return (PostModel.objects
+            .filter(trending_score__gt=0, is_deleted=False)
+            .order_by('-trending_score', '-id')
+            .values('pk')[:_size()])
+
+
+def rebuild_scores(batch_size=1000):
+    """
+    Recomputes every score from the stored counters, as if all engagement
+    had happened when the post was created
+    """
+    weights = settings.TRENDING_WEIGHTS
+    rows = PostModel.objects.values_list('pk', 'created_at', 'views', 'likes_count', 'comments_count', 'marks_count')
+    batch = []
+
+    for pk, created_at, views, likes, comments, marks in rows.iterator(chunk_size=batch_size):
+        total = (views * weights['view'] + likes * weights['like']
+                 + comments * weights['comment'] + marks * weights['mark'])
+        score = log2(total) + _half_lives(created_at) if total else 0
+        batch.append(PostModel(pk=pk, trending_score=score))
+
+        if len(batch) == batch_size:
+            PostModel.objects.bulk_update(batch, ['trending_score'])
+            batch = []
+
+    if batch:
+        PostModel.objects.bulk_update(batch, ['trending_score'])
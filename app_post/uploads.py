@@ -0,0 +1,202 @@
+"""
+Resumable chunked video uploads.
+
+POST /api/post/upload/ with {filename, size[, sha256]} opens a session, then
+every chunk is PUT to /api/post/upload/<id>/ as the raw request body with
+
+    Content-Range: bytes <first byte>-<last byte>/<size>
+    X-Chunk-SHA256: <hex digest of the chunk>
+
+A chunk is streamed into the session's part file UPLOAD_BLOCK_SIZE bytes at a
+time, so memory stays bounded whatever its size, and is dropped again if its
+length or checksum does not match. Chunks must arrive in order: each starts
+where the previous one ended, and GET /api/post/upload/<id>/ returns that
+offset so an interrupted client can resume.
+
+After the last chunk the part file is hashed once and moved (not copied) into
+the content-addressed media storage, then attached to a new VideoModel. Its
+id is what PostSerializer accepts in video_ids.
+
+Part files are written through the storage's local path, so the video storage
+must be a ContentAddressedStorage (a FileSystemStorage).
+
+One chunk of a session is written at a time: the writer holds the session's
+row lock (SELECT ... FOR UPDATE NOWAIT), so a concurrent chunk from any
+process gets 409. SQLite has no row locks, there a cache.add() key in
+UPLOAD_LOCK_CACHE is the lock, which needs a cache shared by every process
+(not locmem) once more than one serves uploads.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from app_post.models import UploadSessionModel, VideoModel
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The upload is busy or the chunk does not start at the current offset.'
+    default_code = 'upload_conflict'
+
+
+def _storage():
+    return VideoModel._meta.get_field('video').storage
+
+
+def _block_size():
+    return getattr(settings, 'UPLOAD_BLOCK_SIZE', 64 * 1024)
+
+
+def _lock_cache():
+    return caches[getattr(settings, 'UPLOAD_LOCK_CACHE', 'default')]
+
+
+def _lock_row(session):
+    """
+    The session re-read under its row lock, UploadConflict if another request holds it
+    """
+    nowait = connection.features.has_select_for_update_nowait
+    try:
+        return UploadSessionModel.objects.select_for_update(nowait=nowait).get(pk=session.pk)
+    except DatabaseError:
+        raise UploadConflict('Another chunk of this upload is being written.')
+
+
+def open_session(user, filename, size, sha256=''):
+    part = f'Uploads/{uuid.uuid4().hex}.part'
+    path = _storage().path(part)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+    return UploadSessionModel.objects.create(user=user, filename=os.path.basename(filename), size=size,
+                                             sha256=sha256.lower(), part=part)
+
+
+def parse_content_range(header, size):
+    """
+    Returns (start, end) of the chunk, end exclusive
+    """
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise ValidationError('Content-Range must look like "bytes <first>-<last>/<size>"')
+
+    start, last, total = map(int, match.groups())
+    if total != size or last < start or last >= size:
+        raise ValidationError(f'Content-Range does not fit an upload of {size} bytes')
+
+    if last - start + 1 > getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 * 1024):
+        raise ValidationError('Chunk is too large')
+
+    return start, last + 1
+
+
+def _write(stream, file, length):
+    """
+    Copies length bytes from stream to file in blocks, returns (bytes copied, sha256)
+    """
+    digest = hashlib.sha256()
+    copied = 0
+
+    while copied < length:
+        block = stream.read(min(_block_size(), length - copied)) if stream else b''
+        if not block:
+            break
+        file.write(block)
+        digest.update(block)
+        copied += len(block)
+
+    return copied, digest.hexdigest()
+
+
+def append_chunk(session, stream, content_range, checksum):
+    """
+    Appends one chunk read from stream to session, completing it after the last one
+    """
+    if session.is_complete:
+        raise UploadConflict('The upload is already complete.')
+
+    start, end = parse_content_range(content_range, session.size)
+    if not checksum:
+        raise ValidationError('X-Chunk-SHA256 header is required')
+
+    cache, lock = _lock_cache(), f'upload:lock:{session.pk}'
+    if not cache.add(lock, 1, timeout=getattr(settings, 'UPLOAD_LOCK_TIMEOUT', 300)):
+        raise UploadConflict('Another chunk of this upload is being written.')
+
+    try:
+        with transaction.atomic():
+            session = _lock_row(session)
+            if start != session.received:
+                raise UploadConflict(f'Expected a chunk starting at byte {session.received}.')
+
+            with open(_storage().path(session.part), 'r+b') as file:
+                # Anything past the offset is left over from a failed chunk
+                file.truncate(start)
+                file.seek(start)
+                copied, digest = _write(stream, file, end - start)
+
+                if copied != end - start or digest != checksum.lower():
+                    file.truncate(start)
+                    raise ValidationError('Chunk length or checksum does not match')
+
+            session.received = end
+            session.save(update_fields=['received', 'updated_at'])
+
+        # No chunk fits past the end, so nothing else writes to the session now
+        if session.received == session.size:
+            finish(session)
+    finally:
+        cache.delete(lock)
+
+    return session
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(_block_size()), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish(session):
+    """
+    Moves the complete part file into the media storage and attaches it to a new VideoModel
+    """
+    storage = _storage()
+    part_path = storage.path(session.part)
+
+    # The one read of the whole file: it is verified and content-addressed with the same hash
+    sha256 = file_sha256(part_path)
+    if session.sha256 and sha256 != session.sha256:
+        # Start over, the chunks were fine one by one but do not add up to the file
+        open(part_path, 'wb').close()
+        session.received = 0
+        session.save(update_fields=['received', 'updated_at'])
+        raise ValidationError('File checksum does not match, upload it again')
+
+    name = storage.adopt(part_path, sha256, os.path.splitext(session.filename)[1])
+
+    with transaction.atomic():
+        session.video = VideoModel.objects.create(video=name)
+        session.save(update_fields=['video', 'updated_at'])
+
+
+def discard(session):
+    """
+    Deletes an unfinished session and its part file
+    """
+    try:
+        os.remove(_storage().path(session.part))
+    except FileNotFoundError:
+        pass
+    session.delete()
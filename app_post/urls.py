@@ -5,6 +5,7 @@ from app_post import views
 
 urlpatterns = [
     path('', views.PostListView.as_view()),
+    path('feed/', views.FeedView.as_view()),
     path('<int:pk>/', views.PostDetailView.as_view()),
     path('user/<int:user_id>/', views.PostByUserListView.as_view()),
     path('<int:post_id>/like/', views.LikePostView.as_view()),
@@ -13,14 +14,26 @@ urlpatterns = [
     path('comment/', views.CommentListView.as_view()),
     path('<int:post_id>/comment/', views.CommentByPostListView.as_view()),
     path('comment/<int:pk>/', views.CommentDetailView.as_view()),
+    path('comment/user/<int:user_id>/', views.CommentByUserListView.as_view()),
     path('comment/<int:comment_id>/like/', views.LikeCommentView.as_view()),
 
     path('story/', views.StoryListView.as_view()),
     path('story/<int:pk>/', views.StoryDetailView.as_view()),
+    path('story/user/<int:user_id>/', views.StoryByUserListView.as_view()),
+    path('story/tray/', views.StoryTrayView.as_view()),
     path('story/<int:story_id>/like/', views.LikeStoryView.as_view()),
 
     path('tag/', views.TagListView.as_view()),
     path('tag/<int:pk>/', views.TagDetailView.as_view()),
 
     path('top/', views.TopPostsView.as_view()),
+
+    path('interactions/', views.InteractionBatchView.as_view()),
+
+    path('async/', views.AsyncPostListView.as_view()),
+    path('async/<int:pk>/', views.AsyncPostDetailView.as_view()),
+    path('async/story/', views.AsyncStoryListView.as_view()),
+
+    path('upload/', views.UploadListView.as_view()),
+    path('upload/<int:pk>/', views.UploadDetailView.as_view()),
 ]
\ No newline at end of file
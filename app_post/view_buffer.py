@@ -0,0 +1,181 @@
+"""
+Write-behind buffer for post and story view counters.
+
+Detail views call record_view() instead of saving the row. Pending views live
+in the Django cache and are written back as one UPDATE ... SET views = views + n
+per distinct n and model, either when VIEW_BUFFER_FLUSH_INTERVAL seconds have
+passed since the last flush or when VIEW_BUFFER_MAX_PENDING views are waiting.
+The latter is also the most views that can be lost if the cache goes away.
+
+Nothing is read and then deleted: a flush subtracts what it read from each
+counter, so views recorded meanwhile stay pending. An object is registered
+for the next flush whenever its flag is missing, and a flush clears the flag
+before reading the counter, so a view never lands in a counter no flush will
+look at.
+
+A counter a flush leaves at 0 expires after VIEW_BUFFER_IDLE_TTL seconds
+unless a view registers its object again; deleting it could drop a view
+recorded meanwhile. The sequence numbering the registrations starts over if
+the cache evicts it, and flushes follow it down.
+
+With the default local-memory cache every process buffers on its own; point
+VIEW_BUFFER_CACHE at a shared cache to buffer across processes and to let
+`manage.py flush_views` drain what the web workers recorded. Either way the
+cache must be sized so it does not cull pending keys (see CACHES).
+"""
+from collections import Counter
+from threading import Lock
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from app_post import trending
+from app_post.models import PostModel
+
+KEY_PREFIX = 'view_buffer'
+
+_flush_lock = Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'VIEW_BUFFER_CACHE', 'default')]
+
+
+def _incr(cache, key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, timeout=None):
+            return delta
+        return cache.incr(key, delta)
+
+
+def _count_key(label, pk):
+    return f'{KEY_PREFIX}:count:{label}:{pk}'
+
+
+def _entry_key(seq):
+    return f'{KEY_PREFIX}:entry:{seq}'
+
+
+def _registered_key(label, pk):
+    return f'{KEY_PREFIX}:registered:{label}:{pk}'
+
+
+def record_view(instance):
+    """
+    Counts one view of a post or story, flushing the buffer when it is due
+    """
+    record_views(instance._meta.model, [instance.pk])
+
+
+def record_views(model, pks):
+    """
+    Counts one view per pk of posts or stories (a repeated pk counts again),
+    flushing the buffer when it is due
+    """
+    if not pks:
+        return
+
+    cache = _cache()
+    label = model._meta.label_lower
+
+    for pk, views in Counter(pks).items():
+        _incr(cache, _count_key(label, pk), views)
+        if cache.add(_registered_key(label, pk), 1, timeout=None):
+            # First view since the last flush of this object: register it so flush_views() can find it,
+            # and keep its counter until then
+            cache.touch(_count_key(label, pk), None)
+            seq = _incr(cache, f'{KEY_PREFIX}:seq')
+            if seq == 1:
+                # The sequence (re)started, e.g. evicted: flushes count from it again
+                cache.delete_many([f'{KEY_PREFIX}:flushed_seq', f'{KEY_PREFIX}:stalled_seq'])
+            cache.set(_entry_key(seq), (label, pk), timeout=None)
+
+    pending = _incr(cache, f'{KEY_PREFIX}:pending', len(pks))
+    interval = getattr(settings, 'VIEW_BUFFER_FLUSH_INTERVAL', 10)
+    max_pending = getattr(settings, 'VIEW_BUFFER_MAX_PENDING', 500)
+
+    if pending >= max_pending or cache.add(f'{KEY_PREFIX}:next_flush', 1, timeout=interval):
+        flush_views()
+
+
+def flush_views():
+    """
+    Writes every pending view to the database. Returns the number of views written.
+    """
+    cache = _cache()
+
+    if not _flush_lock.acquire(blocking=False):
+        return 0
+
+    # Guards against a concurrent flush in another process sharing the cache
+    if not cache.add(f'{KEY_PREFIX}:flushing', 1, timeout=60):
+        _flush_lock.release()
+        return 0
+
+    try:
+        start = cache.get(f'{KEY_PREFIX}:flushed_seq', 0)
+        end = cache.get(f'{KEY_PREFIX}:seq', 0)
+        stalled = cache.get(f'{KEY_PREFIX}:stalled_seq')
+        if end < start:
+            # The sequence was evicted and started over below what was flushed
+            start, stalled = 0, None
+            cache.delete(f'{KEY_PREFIX}:stalled_seq')
+        if end <= start:
+            return 0
+
+        found = cache.get_many([_entry_key(seq) for seq in range(start + 1, end + 1)])
+        entries, flushed = [], start
+        for seq in range(start + 1, end + 1):
+            entry = found.get(_entry_key(seq))
+            if entry is None and seq != stalled:
+                # Numbered but not written by record_views() yet: stop short of it, and
+                # step over it next time if it is still missing then (evicted)
+                cache.set(f'{KEY_PREFIX}:stalled_seq', seq, timeout=None)
+                break
+            if entry is not None:
+                entries.append(entry)
+            flushed = seq
+
+        # Cleared before the counters are read, so a view recorded after the read registers again
+        cache.delete_many([_registered_key(label, pk) for label, pk in entries])
+        counts = cache.get_many([_count_key(label, pk) for label, pk in entries])
+        cache.delete_many([_entry_key(seq) for seq in range(start + 1, flushed + 1)])
+        cache.set(f'{KEY_PREFIX}:flushed_seq', flushed, timeout=None)
+
+        # (model label, increment) -> [pk, ...], so equal increments share one UPDATE
+        batches = {}
+        for label, pk in entries:
+            views = counts.get(_count_key(label, pk))
+            if views:
+                # Views recorded since the read stay in the counter
+                try:
+                    left = cache.incr(_count_key(label, pk), -views)
+                except ValueError:
+                    # Evicted since the read, what was read is written all the same
+                    left = None
+                if left == 0:
+                    cache.touch(_count_key(label, pk), getattr(settings, 'VIEW_BUFFER_IDLE_TTL', 60 * 60))
+                batches.setdefault((label, views), []).append(pk)
+
+        total = 0
+        for (label, views), pks in batches.items():
+            model = apps.get_model(label)
+            model.objects.filter(pk__in=pks).update(views=F('views') + views)
+            total += views * len(pks)
+
+            if model is PostModel:
+                trending.record(pks, 'view', count=views)
+
+        try:
+            cache.decr(f'{KEY_PREFIX}:pending', total)
+        except ValueError:
+            pass
+
+        return total
+    finally:
+        cache.delete(f'{KEY_PREFIX}:flushing')
+        _flush_lock.release()
@@ -1,9 +1,18 @@
+from asgiref.sync import sync_to_async
 from rest_framework import generics, status
 from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
-from app_post import serializers, models
+from app_post import feed, interactions, serializers, models, stories, trending, uploads
+from app_post.search import search_queryset
+from app_post.view_buffer import record_view
+from app_common import toggles
+from app_common.async_views import AsyncAPIViewMixin
+from app_common.response_cache import CachedResponseMixin
+from app_common.pagination import CreatedAtCursorPagination
 from app_common.permissions import IsOwnerOrReadOnly
 from app_user.serializers import UserModel
 
@@ -11,22 +20,50 @@ from app_user.serializers import UserModel
 class PostListView(generics.ListCreateAPIView):
     queryset = models.PostModel.objects.all()
     serializer_class = serializers.PostSerializer
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         q = self.request.GET.get('q')
         tag = self.request.GET.get('tag')
-        if q:
-            self.queryset = self.queryset.filter(description__icontains=q)
-
         if tag:
             self.queryset = self.queryset.filter(tags__name=tag)
 
-        return self.queryset
+        if q:
+            self.queryset = search_queryset(self.queryset, q)
 
+        return serializers.PostSerializer.setup_eager_loading(self.queryset, self.request.user)
 
-class PostByUserListView(generics.ListAPIView):
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        # Answer with the same eager loading as the list, the response reads every mark and tag
+        serializer.instance = serializers.PostSerializer.setup_eager_loading(
+            models.PostModel.objects.filter(pk=serializer.instance.pk), self.request.user
+        ).get()
+
+
+class LikedByViewerMixin:
+    """
+    Cached pages of posts were built for whoever asked first: is_liked is redone for the requester
+    """
+    def personalize(self, data):
+        posts = [post for post in data.get('results', []) if 'is_liked' in post]
+        liked = set(models.LikePostModel.objects
+                    .filter(user_id=self.request.user.pk, post_id__in=[post['id'] for post in posts])
+                    .values_list('post_id', flat=True)) if posts else set()
+        for post in posts:
+            post['is_liked'] = post['id'] in liked
+
+
+class PostByUserListView(LikedByViewerMixin, CachedResponseMixin, generics.ListAPIView):
     serializer_class = serializers.PostSerializer
     permission_classes = [IsOwnerOrReadOnly]
+    pagination_class = CreatedAtCursorPagination
+    cache_namespaces = ('posts',)
+
+    def get_visibility(self):
+        if str(self.request.user.pk) == str(self.kwargs.get('user_id')):
+            return 'owner'
+        return super().get_visibility()
 
     def get_queryset(self):
         q = self.request.GET.get('q')
@@ -38,13 +75,38 @@ class PostByUserListView(generics.ListAPIView):
         if not queryset.exists():
             raise NotFound('No posts found for this user.')
 
-        if q:
-            queryset = queryset.filter(description__icontains=q)
-
         if tag:
             queryset = queryset.filter(tags__name=tag)
 
-        return queryset
+        if q:
+            queryset = search_queryset(queryset, q)
+
+        return serializers.PostSerializer.setup_eager_loading(queryset, self.request.user)
+
+
+class FeedView(generics.ListAPIView):
+    serializer_class = serializers.PostSerializer
+    user_from_claims = True
+
+    def list(self, request, *args, **kwargs):
+        before = request.GET.get('before')
+        before = int(before) if before and before.isdigit() else None
+        page_size = api_settings.PAGE_SIZE
+
+        ids = feed.feed_page(request.user.pk, before=before, limit=page_size)
+        queryset = serializers.PostSerializer.setup_eager_loading(
+            models.PostModel.objects.filter(pk__in=ids), request.user
+        )
+        posts = {post.pk: post for post in queryset}
+
+        next_url = None
+        if len(ids) == page_size:
+            next_url = replace_query_param(request.build_absolute_uri(), 'before', ids[-1])
+
+        return Response({
+            'next': next_url,
+            'results': self.get_serializer([posts[pk] for pk in ids if pk in posts], many=True).data
+        })
 
 
 class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -52,12 +114,23 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = serializers.PostSerializer
     permission_classes = [IsOwnerOrReadOnly]
 
+    def get_queryset(self):
+        if self.request.method == 'DELETE':
+            # Nothing is serialized, the likes and comments would be loaded for nothing
+            return self.queryset
+        return serializers.PostSerializer.setup_eager_loading(self.queryset, self.request.user)
+
     def get_object(self):
         obj = super().get_object()
-        obj.views += 1
-        obj.save()
+        if self.request.method == 'GET':
+            record_view(obj)
         return obj
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # The update drops the prefetched rows, answer with them loaded again
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
 
 class StoryListView(generics.ListCreateAPIView):
     queryset = models.StoryModel.objects.all()
@@ -66,14 +139,36 @@ class StoryListView(generics.ListCreateAPIView):
     def get_queryset(self):
         q = self.request.GET.get('q')
         tag = self.request.GET.get('tag')
+        queryset = stories.live(self.queryset)
+
+        if tag:
+            queryset = queryset.filter(tags__name=tag)
 
         if q:
-            self.queryset = self.queryset.filter(description__icontains=q)
+            queryset = search_queryset(queryset, q)
 
-        if tag:
-            self.queryset = self.queryset.filter(tags__name=tag)
+        # Newest first: stories live for the same STORY_TTL, and story_live_idx is ordered by expires_at
+        queryset = queryset.order_by('-expires_at', '-id')
+        return serializers.StorySerializer.setup_eager_loading(queryset, self.request.user)
+
+
+class StoryTrayView(APIView):
+    """
+    Live stories of the users the requester follows, grouped per author
+    """
+    user_from_claims = True
 
-        return self.queryset
+    def get(self, request):
+        queryset = serializers.StorySerializer.setup_eager_loading(models.StoryModel.objects.all(), request.user)
+        context = {'request': request}
+
+        return Response([
+            {
+                'user': {'id': author.pk, 'username': author.username},
+                'stories': serializers.StorySerializer(group, many=True, context=context).data,
+            }
+            for author, group in stories.tray(request.user.pk, queryset)
+        ])
 
 
 class StoryDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -81,12 +176,37 @@ class StoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = serializers.StorySerializer
     permission_classes = [IsOwnerOrReadOnly]
 
+    def get_queryset(self):
+        # Authors still reach their archived stories
+        queryset = stories.live(self.queryset) | self.queryset.filter(user_id=self.request.user.pk)
+        if self.request.method == 'DELETE':
+            return queryset
+        return serializers.StorySerializer.setup_eager_loading(queryset, self.request.user)
+
     def get_object(self):
         obj = super().get_object()
-        obj.views += 1
-        obj.save()
+        if self.request.method == 'GET':
+            record_view(obj)
         return obj
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # As PostDetailView.perform_update
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+
+class StoryByUserListView(generics.ListAPIView):
+    serializer_class = serializers.StorySerializer
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        user_id = self.kwargs.get('user_id')
+        queryset = models.StoryModel.objects.filter(user_id=user_id)
+        # The author also sees their archive
+        if user_id != self.request.user.pk:
+            queryset = stories.live(queryset)
+        return serializers.StorySerializer.setup_eager_loading(queryset, self.request.user)
+
 
 class CommentListView(generics.ListAPIView):
     queryset = models.CommentPostModel.objects.all()
@@ -95,13 +215,14 @@ class CommentListView(generics.ListAPIView):
     def get_queryset(self):
         q = self.request.GET.get('q')
         if q:
-            self.queryset = self.queryset.filter(comment__icontains=q)
+            self.queryset = search_queryset(self.queryset, q)
 
-        return self.queryset
+        return serializers.CommentPostSerializer.setup_eager_loading(self.queryset, self.request.user)
 
 
 class CommentByPostListView(generics.ListCreateAPIView):
     serializer_class = serializers.CommentPostSerializer
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         q = self.request.GET.get('q')
@@ -112,8 +233,8 @@ class CommentByPostListView(generics.ListCreateAPIView):
             raise NotFound('No comments found for this post.')
 
         if q:
-            queryset = queryset.filter(comment__icontains=q)
-        return queryset
+            queryset = search_queryset(queryset, q)
+        return serializers.CommentPostSerializer.setup_eager_loading(queryset, self.request.user)
 
     def perform_create(self, serializer):
         post_id = self.kwargs.get('post_id')
@@ -127,107 +248,139 @@ class CommentByPostListView(generics.ListCreateAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class CommentByUserListView(generics.ListAPIView):
+    serializer_class = serializers.CommentPostSerializer
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        user_id = self.kwargs.get('user_id')
+        return serializers.CommentPostSerializer.setup_eager_loading(
+            models.CommentPostModel.objects.filter(user_id=user_id), self.request.user
+        )
+
+
 class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = models.CommentPostModel.objects.all()
     serializer_class = serializers.CommentPostSerializer
     permission_classes = [IsOwnerOrReadOnly]
 
+    def get_queryset(self):
+        if self.request.method == 'DELETE':
+            return self.queryset
+        return serializers.CommentPostSerializer.setup_eager_loading(self.queryset, self.request.user)
 
-class LikePostView(generics.ListCreateAPIView):
-    queryset = models.LikePostModel.objects.all()
-    serializer_class = serializers.LikePostSerializer
-
-    def perform_create(self, serializer):
-        post_id = self.kwargs.get('post_id')
-        post = models.PostModel.objects.filter(id=post_id, is_deleted=False).first()
-
-        if not post:
-            self.request.failed_status_code = status.HTTP_404_NOT_FOUND
-            raise NotFound("Post not found")
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # As PostDetailView.perform_update
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
 
-        like = self.queryset.filter(user=self.request.user, post=post)
 
-        if like.exists():
-            like.delete()
-            return Response({'message': 'Unliked Successfully'}, status=status.HTTP_200_OK)
+class LikePostView(toggles.ToggleViewMixin, generics.ListAPIView):
+    queryset = models.LikePostModel.objects.all()
+    serializer_class = serializers.LikePostSerializer
+    pagination_class = CreatedAtCursorPagination
+    target_queryset = models.PostModel.objects.filter(is_deleted=False)
+    target_kwarg = 'post_id'
+    target_field = 'post'
+    counter_field = 'likes_count'
+    state_key = 'liked'
 
-        serializer.save(user_id=self.request.user.pk, post_id=post.id)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        return self.queryset.filter(post_id=self.kwargs.get('post_id')).select_related('user', 'post__user')
 
 
-class LikeStoryView(generics.ListCreateAPIView):
+class LikeStoryView(toggles.ToggleViewMixin, generics.ListAPIView):
     queryset = models.LikeStoryModel.objects.all()
     serializer_class = serializers.LikeStorySerializer
+    pagination_class = CreatedAtCursorPagination
+    target_queryset = models.StoryModel.objects.filter(is_deleted=False)
+    target_kwarg = 'story_id'
+    target_field = 'story'
+    counter_field = 'likes_count'
+    state_key = 'liked'
 
-    def perform_create(self, serializer):
-        story_id = self.kwargs.get('story_id')
-        story = models.StoryModel.objects.filter(id=story_id, is_deleted=False)
-
-        if not story.exists():
-            self.request.failed_status_code = status.HTTP_404_NOT_FOUND
-            raise NotFound("Story not found")
-
-        like = self.queryset.filter(user=self.request.user, story=story.first())
-
-        if like.exists():
-            like.delete()
-            return Response({'message': 'Unliked Successfully'}, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        return self.queryset.filter(story_id=self.kwargs.get('story_id')).select_related('user', 'story__user')
 
-        serializer.save(story_id=story.first().id)
-        return Response(serializer.data, status.HTTP_200_OK)
+    def get_target_queryset(self):
+        # Expired stories cannot be liked
+        return stories.live(self.target_queryset)
 
 
-class LikeCommentView(generics.ListCreateAPIView):
+class LikeCommentView(toggles.ToggleViewMixin, generics.ListAPIView):
     queryset = models.LikeCommentModel.objects.all()
     serializer_class = serializers.LikeCommentSerializer
+    pagination_class = CreatedAtCursorPagination
+    target_queryset = models.CommentPostModel.objects.filter(is_deleted=False)
+    target_kwarg = 'comment_id'
+    target_field = 'comment'
+    counter_field = 'likes_count'
+    state_key = 'liked'
 
-    def perform_create(self, serializer):
-        comment_id = self.kwargs.get('comment_id')
-        comment = models.CommentPostModel.objects.filter(id=comment_id, is_deleted=False)
+    def get_queryset(self):
+        return self.queryset.filter(comment_id=self.kwargs.get('comment_id')).select_related('user', 'comment')
 
-        if not comment.exists():
-            self.request.failed_status_code = status.HTTP_404_NOT_FOUND
-            raise NotFound("Comment not found")
 
-        comment = comment.first()
+class InteractionBatchView(APIView):
+    """
+    Applies a batch of likes, views and marks in order (see app_post.interactions)
+    and answers with one result per event
+    """
+    def post(self, request):
+        serializer = serializers.InteractionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        like = self.queryset.filter(user=self.request.user, comment=comment)
+        results, valid = [], []
+        for event in serializer.validated_data['events']:
+            event_serializer = serializers.InteractionSerializer(data=event)
+            if event_serializer.is_valid():
+                valid.append(event_serializer.validated_data)
+                results.append(dict(event_serializer.validated_data))
+            else:
+                results.append({'event': event, 'status': interactions.INVALID, 'errors': event_serializer.errors})
 
-        if like.exists():
-            like.delete()
-            return Response({'message': 'Unliked Successfully'}, status=status.HTTP_200_OK)
+        statuses = iter(interactions.apply(request.user, valid))
+        for result in results:
+            if 'status' not in result:
+                result['status'] = next(statuses)
 
-        serializer.save(comment_id=comment.pk)
-        return Response(serializer.data, status.HTTP_200_OK)
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
 
-class TagListView(generics.ListAPIView):
+class TagListView(CachedResponseMixin, generics.ListAPIView):
     queryset = models.TagModel.objects.all()
     serializer_class = serializers.TagSerializer
+    cache_namespaces = ('tags',)
 
     def get_queryset(self):
         q = self.request.GET.get('q')
         if q:
-            self.queryset = self.queryset.filter(tag__icontains=q)
+            self.queryset = search_queryset(self.queryset, q)
 
-        return self.queryset
+        return serializers.TagSerializer.setup_eager_loading(self.queryset)
 
 
-class TagDetailView(generics.RetrieveAPIView):
+class TagDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     queryset = models.TagModel.objects.all()
     serializer_class = serializers.TagSerializer
+    cache_namespaces = ('tags',)
+
+    def get_queryset(self):
+        return serializers.TagSerializer.setup_eager_loading(self.queryset)
 
 
-class TopPostsView(generics.ListAPIView):
+class TopPostsView(LikedByViewerMixin, CachedResponseMixin, generics.ListAPIView):
     serializer_class = serializers.PostSerializer
+    cache_namespaces = ('posts',)
 
     def get_queryset(self):
-        queryset = models.PostModel.objects.filter(views__gt=1).order_by('-views')
+        queryset = models.PostModel.objects.filter(pk__in=trending.top_post_ids())
         q = self.request.GET.get('q')
         if q:
-            queryset = queryset.filter(title__icontains=q)
+            queryset = search_queryset(queryset, q)
 
-        return queryset
+        queryset = queryset.order_by('-trending_score', '-id')
+        return serializers.PostSerializer.setup_eager_loading(queryset, self.request.user)
 
 
 class ConnectUserToPostView(APIView):
@@ -249,5 +402,53 @@ class ConnectUserToPostView(APIView):
             return Response({'error': 'User unconnected from the post successfully'}, status=status.HTTP_200_OK)
 
         post.connected_users.add(user)
-        post.save()
+        post.save(update_fields=['updated_at'])
         return Response({'message': 'User connected to the post successfully'}, status=status.HTTP_200_OK)
+
+
+class UploadListView(generics.CreateAPIView):
+    serializer_class = serializers.UploadSessionSerializer
+
+
+class UploadDetailView(generics.RetrieveDestroyAPIView):
+    """
+    GET returns the offset to resume from, PUT appends one chunk (see app_post.uploads)
+    """
+    serializer_class = serializers.UploadSessionSerializer
+
+    def get_queryset(self):
+        return models.UploadSessionModel.objects.filter(user=self.request.user)
+
+    def put(self, request, *args, **kwargs):
+        # request.stream is read in blocks, request.data must not be touched
+        session = uploads.append_chunk(
+            self.get_object(),
+            request.stream,
+            request.headers.get('Content-Range'),
+            request.headers.get('X-Chunk-SHA256'),
+        )
+        return Response(self.get_serializer(session).data,
+                        status=status.HTTP_201_CREATED if session.is_complete else status.HTTP_200_OK)
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+
+
+# Async variants of the hot read endpoints, for ASGI deployments (see app_common.async_views)
+
+class AsyncPostListView(AsyncAPIViewMixin, PostListView):
+    async def get(self, request, *args, **kwargs):
+        return await self.alist()
+
+
+class AsyncPostDetailView(AsyncAPIViewMixin, PostDetailView):
+    async def get(self, request, *args, **kwargs):
+        post = await self.aget_object()
+        # Cache only, but the cache backend may block
+        await sync_to_async(record_view)(post)
+        return Response(await self.aserialize(post))
+
+
+class AsyncStoryListView(AsyncAPIViewMixin, StoryListView):
+    async def get(self, request, *args, **kwargs):
+        return await self.alist()
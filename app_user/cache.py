@@ -0,0 +1,48 @@
+"""
+Per-user cache of the parts of a profile that take queries to build
+(see ProfileSerializer). Follow, post, story, comment, mark and like writes
+call invalidate_profile() for the users they change, PROFILE_CACHE_TTL bounds
+how stale anything else (e.g. a renamed follower) can get.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[getattr(settings, 'PROFILE_CACHE', 'default')]
+
+
+def profile_key(user_id):
+    return f'profile:summary:{user_id}'
+
+
+def get_profile_summary(user_id, build):
+    """
+    Returns the cached summary of user_id, calling build() on a miss
+    """
+    cache = _cache()
+    summary = cache.get(profile_key(user_id))
+
+    if summary is None:
+        summary = build()
+        cache.set(profile_key(user_id), summary, timeout=getattr(settings, 'PROFILE_CACHE_TTL', 300))
+
+    return summary
+
+
+async def aget_profile_summary(user_id, build):
+    """
+    get_profile_summary() for async views, awaiting build() on a miss
+    """
+    cache = _cache()
+    summary = await cache.aget(profile_key(user_id))
+
+    if summary is None:
+        summary = await build()
+        await cache.aset(profile_key(user_id), summary, timeout=getattr(settings, 'PROFILE_CACHE_TTL', 300))
+
+    return summary
+
+
+def invalidate_profile(*user_ids):
+    _cache().delete_many([profile_key(user_id) for user_id in user_ids if user_id])
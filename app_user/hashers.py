@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2 hasher with PASSWORD_HASH_ITERATIONS rounds. Passwords hashed
+    with another count verify as before and are rehashed on the next login.
+    """
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or super().iterations
@@ -0,0 +1,91 @@
+"""
+Login by username, email or phone number.
+
+resolve() tells the three apart by shape (a valid email address, '+' and
+digits for a phone number, anything else is a username) and reads the user
+with one query through that column's unique index. Usernames and emails are
+unique lowercased (see UserModel.Meta.constraints) and compared lowercased.
+
+Failed logins are counted per identifier ('account') and per client IP under
+the 'login_failures' THROTTLE_RULES (see app_common.throttling). Past its
+limit, an IP is refused with 429 before any query or password hash, so
+credential stuffing mostly costs a counter read. An account past its limit is
+refused with 429 once its password was checked, right or wrong alike, so
+attackers rotating IPs learn nothing from the answer. A password is hashed for
+unknown identifiers too, so they answer as slowly as wrong passwords and do
+not reveal which accounts exist.
+"""
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db.models.functions import Lower
+from rest_framework.exceptions import Throttled
+
+from app_common import throttling
+
+EMAIL = 'email'
+PHONE_NUMBER = 'phone_number'
+USERNAME = 'username'
+
+
+def kind(identifier):
+    if '@' in identifier:
+        try:
+            validate_email(identifier)
+            return EMAIL
+        except ValidationError:
+            # Usernames may have an '@' too
+            pass
+    if identifier.startswith('+') and identifier[1:].isnumeric():
+        return PHONE_NUMBER
+    return USERNAME
+
+
+def resolve(identifier):
+    """
+    The user identifier (a lowercased username, email or phone number) names, or None
+    """
+    users = get_user_model().objects
+    column = kind(identifier)
+    if column == PHONE_NUMBER:
+        return users.filter(phone_number=identifier).first()
+    return users.alias(key=Lower(column)).filter(key=identifier).first()
+
+
+def authenticate(identifier, password):
+    """
+    The user identifier names if password is theirs, or None
+    """
+    user = resolve(identifier)
+    if user is None:
+        # As slow as a wrong password
+        get_user_model()().set_password(password)
+        return None
+    return user if user.check_password(password) else None
+
+
+def check_ip(ip):
+    """
+    Raises Throttled when ip failed too often lately, to be called before the password is checked
+    """
+    wait = throttling.check('login_failures', {'ip': ip})
+    if wait is not None:
+        raise Throttled(wait=wait)
+
+
+def check_account(identifier):
+    """
+    Raises Throttled when identifier failed too often lately, to be called once the attempt was recorded,
+    whether its password was right or not
+    """
+    wait = throttling.check('login_failures', {'account': identifier})
+    if wait is not None:
+        raise Throttled(wait=wait)
+
+
+def record_failure(identifier, ip):
+    throttling.hit('login_failures', {'account': identifier, 'ip': ip})
+
+
+def reset_failures(identifier):
+    throttling.reset('login_failures', {'account': identifier})
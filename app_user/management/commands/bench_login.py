@@ -0,0 +1,119 @@
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from app_common import throttling
+from app_common.management.commands.bench_endpoints import Rollback, git_commit, percentile
+from app_user.models import UserModel
+
+KINDS = ('valid', 'wrong_password', 'unknown_user')
+
+
+class Command(BaseCommand):
+    help = ('Logs in like a credential stuffing attack mixed with real users against the current database '
+            '(see generate_dataset) and reports p50/p99 latency per kind of attempt and over the run as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--valid', type=float, default=0.1, help='Share of attempts with the right password')
+        parser.add_argument('--attacker-ips', type=int, default=20, help='Client IPs the attack rotates through')
+        parser.add_argument('--password', default='password', help="The users' password")
+        parser.add_argument('--max-failures', type=int,
+                            help="Failed logins allowed per account and IP for the run, instead of THROTTLE_RULES'")
+        parser.add_argument('--iterations', type=int, help='PASSWORD_HASH_ITERATIONS for the run')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file to write the results to')
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        overrides = {'QUERY_PROFILING': False}
+        if options['max_failures'] is not None:
+            rules = dict(settings.THROTTLE_RULES)
+            rules['login_failures'] = {kind: (options['max_failures'], window)
+                                       for kind, (_, window) in rules.get('login_failures', {}).items()}
+            overrides['THROTTLE_RULES'] = rules
+        if options['iterations']:
+            overrides['PASSWORD_HASH_ITERATIONS'] = options['iterations']
+
+        # Issued tokens and rehashed passwords are rolled back
+        try:
+            with override_settings(**overrides), transaction.atomic():
+                results = self.run(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def run(self, requests, valid, attacker_ips, password, seed, **options):
+        rng = random.Random(seed)
+        usernames = list(UserModel.objects.filter(is_active=True).order_by('?').values_list('username', flat=True)[:500])
+        if not usernames:
+            raise SystemExit('The database has no users, run generate_dataset first')
+
+        client = APIClient(raise_request_exception=False, HTTP_HOST='localhost')
+        throttling.reset_stats()
+        timings = {kind: [] for kind in KINDS}
+        statuses = {kind: {} for kind in KINDS}
+        timeline = []
+        started = time.perf_counter()
+
+        for n in range(requests):
+            kind = 'valid' if rng.random() < valid else rng.choice(KINDS[1:])
+            if kind == 'valid':
+                # Real users log in from addresses of their own
+                identifier, secret, ip = rng.choice(usernames), password, f'10.1.{n // 256 % 256}.{n % 256}'
+            else:
+                identifier = rng.choice(usernames) if kind == 'wrong_password' else f'stuffed{rng.randrange(10 ** 9)}'
+                secret, ip = f'guess{rng.randrange(10 ** 9)}', f'10.0.0.{rng.randrange(attacker_ips)}'
+
+            start = time.perf_counter()
+            response = client.post('/api/auth/login/', {'username_or_email_or_phone_number': identifier,
+                                                         'password': secret}, REMOTE_ADDR=ip)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            timings[kind].append(elapsed)
+            timeline.append(elapsed)
+            statuses[kind][str(response.status_code)] = statuses[kind].get(str(response.status_code), 0) + 1
+
+        results = {}
+        for kind in KINDS:
+            if timings[kind]:
+                results[kind] = {
+                    'requests': len(timings[kind]),
+                    'statuses': statuses[kind],
+                    'p50_ms': round(percentile(timings[kind], 50), 3),
+                    'p99_ms': round(percentile(timings[kind], 99), 3),
+                }
+                self.stdout.write(f'{kind:<16} p50 {results[kind]["p50_ms"]:>8.2f} ms  '
+                                  f'p99 {results[kind]["p99_ms"]:>8.2f} ms  {statuses[kind]}')
+
+        # p99 of every tenth of the run: flat when the attack is shed as it goes on
+        size = max(1, len(timeline) // 10)
+        deciles = [round(percentile(timeline[i:i + size], 99), 3) for i in range(0, len(timeline), size)]
+        self.stdout.write(f'p99 over the run: {" ".join(f"{p99:.1f}" for p99 in deciles)} ms')
+        shed = {scope: counts for scope, counts in throttling.stats().items() if scope.startswith('login')}
+        self.stdout.write(f'Shed: {shed}')
+
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'requests': requests,
+                'valid': valid,
+                'attacker_ips': attacker_ips,
+                'seconds': round(time.perf_counter() - started, 3),
+            },
+            'kinds': results,
+            'p99_over_run_ms': deciles,
+            'shed': shed,
+        }
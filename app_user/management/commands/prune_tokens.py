@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from app_user import tokens
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired refresh tokens and their blacklist entries in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, batch_size, **options):
+        outstanding, blacklisted = tokens.prune_expired(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'{outstanding} expired tokens deleted, {blacklisted} of them blacklisted'
+        ))
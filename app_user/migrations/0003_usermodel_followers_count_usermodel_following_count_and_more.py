@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def repair_counter(model, field, related_model, fk_name):
+    # Frozen copy of app_common.counters.repair_counter as of this migration
+    counts = (related_model.objects
+              .filter(**{fk_name: OuterRef('pk')})
+              .order_by()
+              .values(fk_name)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    model.objects.update(**{field: Coalesce(Subquery(counts), Value(0))})
+
+
+def backfill_counters(apps, schema_editor):
+    UserModel = apps.get_model('app_user', 'UserModel')
+    FollowModel = apps.get_model('app_user', 'FollowModel')
+
+    repair_counter(UserModel, 'followers_count', FollowModel, 'followed')
+    repair_counter(UserModel, 'following_count', FollowModel, 'follower')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_user', '0002_usermodel_is_private'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermodel',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usermodel',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usermodel',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
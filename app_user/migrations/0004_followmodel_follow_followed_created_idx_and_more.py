@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_user', '0003_usermodel_followers_count_usermodel_following_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='followmodel',
+            index=models.Index(fields=['followed', '-created_at', '-id'], name='follow_followed_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='followmodel',
+            index=models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_created_idx'),
+        ),
+    ]
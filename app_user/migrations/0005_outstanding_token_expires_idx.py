@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index for app_user.tokens.prune_expired(): the table belongs to simplejwt's token_blacklist app
+    """
+
+    dependencies = [
+        ('app_user', '0004_followmodel_follow_followed_created_idx_and_more'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS outstanding_token_expires_idx ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX IF EXISTS outstanding_token_expires_idx',
+        ),
+    ]
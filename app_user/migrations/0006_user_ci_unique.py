@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:19
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_user', '0005_outstanding_token_expires_idx'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='usermodel',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('username'), name='user_username_ci_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='usermodel',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='user_email_ci_uniq'),
+        ),
+    ]
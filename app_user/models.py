@@ -1,28 +1,33 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
 
+from app_common.models import CounterFieldsMixin
 
-class UserModel(AbstractUser):
+
+class UserModel(CounterFieldsMixin, AbstractUser):
     email = models.EmailField(unique=True)
     phone_number = models.CharField(max_length=14, unique=True)
     avatar = models.ImageField(upload_to='User/', null=True, blank=True)
     is_deleted = models.BooleanField(default=False)
     is_private = models.BooleanField(default=False)
 
-    def __str__(self):
-        return f"{self.username}/{self.email}/{self.phone_number}"
+    # Denormalized counters, kept in sync by app_user.signals and app_post.signals
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
 
-    @property
-    def followers_count(self):
-        return self.followers.count()
+    counter_fields = ('followers_count', 'following_count', 'posts_count')
 
-    @property
-    def following_count(self):
-        return self.following.count()
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Login looks users up by lowercased username or email (see app_user.login)
+            models.UniqueConstraint(Lower('username'), name='user_username_ci_uniq'),
+            models.UniqueConstraint(Lower('email'), name='user_email_ci_uniq'),
+        ]
 
-    @property
-    def posts_count(self):
-        return self.posts.count()
+    def __str__(self):
+        return f"{self.username}/{self.email}/{self.phone_number}"
 
     @property
     def stories_count(self):
@@ -58,6 +63,10 @@ class FollowModel(models.Model):
         unique_together = ('follower', 'followed')
         verbose_name = "FollowModel"
         verbose_name_plural = "Follows"
+        indexes = [
+            models.Index(fields=['followed', '-created_at', '-id'], name='follow_followed_created_idx'),
+            models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.follower} follows {self.followed}"
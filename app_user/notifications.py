@@ -0,0 +1,306 @@
+"""
+Outbound notification queue for confirmation emails and SMS.
+
+enqueue() puts a message on a bounded queue and returns right away.
+NOTIFICATION_WORKERS background threads take up to NOTIFICATION_BATCH_SIZE
+messages at a time and hand them to the transport of their channel, so a burst
+of registrations costs a fixed number of threads and one SMTP connection per
+worker. When the queue is full enqueue() waits NOTIFICATION_ENQUEUE_TIMEOUT
+seconds and then drops the message.
+
+Failed messages are retried up to NOTIFICATION_MAX_ATTEMPTS times, waiting
+NOTIFICATION_RETRY_BACKOFF seconds, doubled after every attempt. The outcome of
+every message is kept in outcomes() (the latest NOTIFICATION_OUTCOMES_SIZE).
+
+Transports are configured per channel in NOTIFICATION_TRANSPORTS;
+InMemoryTransport collects messages in InMemoryTransport.outbox for tests.
+"""
+import time
+from collections import deque
+from itertools import count
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+SENT = 'sent'
+FAILED = 'failed'
+DROPPED = 'dropped'
+
+_ids = count(1)
+
+
+def _setting(name, default):
+    return getattr(settings, f'NOTIFICATION_{name}', default)
+
+
+class Notification:
+    def __init__(self, channel, to, body, subject=''):
+        self.id = next(_ids)
+        self.channel = channel
+        self.to = to
+        self.body = body
+        self.subject = subject
+        self.attempts = 0
+
+    def __repr__(self):
+        return f'<Notification {self.id} {self.channel} to {self.to}>'
+
+
+class BaseTransport:
+    def send_many(self, messages):
+        """
+        Sends messages, returns {message.id: error} for the ones that failed
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class EmailTransport(BaseTransport):
+    """
+    Sends a batch over one connection of EMAIL_BACKEND and keeps it open for
+    the next batch; it is reopened after an error
+    """
+    def __init__(self):
+        self.connection = None
+
+    def send_many(self, messages):
+        if self.connection is None:
+            self.connection = get_connection()
+
+        emails = [EmailMessage(message.subject, message.body, settings.EMAIL_HOST_USER, [message.to],
+                               connection=self.connection)
+                  for message in messages]
+        try:
+            # Opening first keeps send_messages() from closing the connection afterwards
+            self.connection.open()
+            self.connection.send_messages(emails)
+        except Exception as error:
+            self.close()
+            return {message.id: error for message in messages}
+
+        return {}
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class SMSTransport(BaseTransport):
+    """
+    Sends messages through one Twilio client, reused between batches
+    """
+    def __init__(self):
+        self.client = None
+
+    def send_many(self, messages):
+        if self.client is None:
+            from twilio.rest import Client
+            self.client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+
+        errors = {}
+        for message in messages:
+            try:
+                self.client.messages.create(from_=settings.TWILIO_PHONE_NUMBER, body=message.body, to=message.to)
+            except Exception as error:
+                errors[message.id] = error
+
+        return errors
+
+
+class InMemoryTransport(BaseTransport):
+    """
+    Keeps sent messages in InMemoryTransport.outbox; the next `fail_next`
+    messages fail instead
+    """
+    outbox = []
+    fail_next = 0
+
+    def send_many(self, messages):
+        errors = {}
+        for message in messages:
+            if InMemoryTransport.fail_next > 0:
+                InMemoryTransport.fail_next -= 1
+                errors[message.id] = ConnectionError('delivery failed')
+            else:
+                InMemoryTransport.outbox.append(message)
+
+        return errors
+
+
+DEFAULT_TRANSPORTS = {
+    'email': 'app_user.notifications.EmailTransport',
+    'sms': 'app_user.notifications.SMSTransport',
+}
+
+
+class NotificationQueue:
+    def __init__(self):
+        self.queue = Queue(maxsize=_setting('QUEUE_SIZE', 1000))
+        self.transport_paths = _setting('TRANSPORTS', DEFAULT_TRANSPORTS)
+        self.outcomes = deque(maxlen=_setting('OUTCOMES_SIZE', 1000))
+        self.workers = []
+        self.lock = Lock()
+
+    def put(self, message):
+        """
+        Queues message for delivery, returns False if it was dropped because the queue is full
+        """
+        self.start()
+        try:
+            self.queue.put(message, timeout=_setting('ENQUEUE_TIMEOUT', 1))
+        except Full:
+            self.record(message, DROPPED, 'queue is full')
+            return False
+
+        return True
+
+    def start(self):
+        with self.lock:
+            while len(self.workers) < _setting('WORKERS', 2):
+                worker = Thread(target=self.work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self, timeout=5):
+        """
+        Delivers what is already queued and stops the workers
+        """
+        with self.lock:
+            workers, self.workers = self.workers, []
+
+        for _ in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+
+    def join(self):
+        """
+        Blocks until every queued message has been delivered or given up on
+        """
+        self.queue.join()
+
+    def work(self):
+        transports = {channel: import_string(path)() for channel, path in self.transport_paths.items()}
+        batch_size = _setting('BATCH_SIZE', 50)
+        running = True
+
+        try:
+            while running:
+                batch = [self.queue.get()]
+                # A None asks this worker to stop, leave the rest for the other workers
+                while batch[-1] is not None and len(batch) < batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+
+                messages = [message for message in batch if message is not None]
+                running = len(messages) == len(batch)
+
+                try:
+                    self.deliver(transports, messages)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+        finally:
+            for transport in transports.values():
+                transport.close()
+
+    def deliver(self, transports, messages):
+        by_channel = {}
+        for message in messages:
+            by_channel.setdefault(message.channel, []).append(message)
+
+        max_attempts = _setting('MAX_ATTEMPTS', 4)
+        backoff = _setting('RETRY_BACKOFF', 1)
+
+        for channel, pending in by_channel.items():
+            transport = transports.get(channel)
+            if transport is None:
+                for message in pending:
+                    self.record(message, FAILED, f'no transport for {channel!r}')
+                continue
+
+            while pending:
+                for message in pending:
+                    message.attempts += 1
+
+                try:
+                    errors = transport.send_many(pending)
+                except Exception as error:
+                    errors = {message.id: error for message in pending}
+
+                retry = []
+                for message in pending:
+                    if message.id not in errors:
+                        self.record(message, SENT)
+                    elif message.attempts >= max_attempts:
+                        self.record(message, FAILED, errors[message.id])
+                    else:
+                        retry.append(message)
+
+                if retry:
+                    time.sleep(backoff * 2 ** (retry[0].attempts - 1))
+                pending = retry
+
+    def record(self, message, status, error=None):
+        self.outcomes.append({
+            'id': message.id,
+            'channel': message.channel,
+            'to': message.to,
+            'status': status,
+            'attempts': message.attempts,
+            'error': str(error) if error else None,
+        })
+
+
+_queue = None
+_queue_lock = Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = NotificationQueue()
+        return _queue
+
+
+def enqueue(channel, to, body, subject=''):
+    """
+    Queues a message for `to` on channel ('email' or 'sms'), returns False if it was dropped
+    """
+    return get_queue().put(Notification(channel, to, body, subject))
+
+
+def outcomes():
+    return list(get_queue().outcomes)
+
+
+def reset():
+    """
+    Stops the workers and discards the queue, the next enqueue() starts a new one
+    """
+    global _queue
+    with _queue_lock:
+        queue, _queue = _queue, None
+
+    if queue is not None:
+        queue.stop()
+
+
+@receiver(setting_changed)
+def reset_on_setting_changed(setting, **kwargs):
+    if setting.startswith(('NOTIFICATION_', 'EMAIL_')):
+        reset()
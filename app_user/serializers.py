@@ -1,12 +1,18 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 from rest_framework import serializers
 
+from app_common import throttling
+from app_common.counters import count_subquery
 from app_common.views import email_validator
-from app_post.models import MarkModel
+from app_post.models import (CommentPostModel, LikeCommentModel, LikePostModel, LikeStoryModel, MarkModel,
+                             StoryModel)
+from app_user import login
+from app_user.cache import get_profile_summary
 from app_user.models import VerifyCodeModel, FollowModel
 
 UserModel = get_user_model()
@@ -16,33 +22,35 @@ class LoginSerializer(serializers.Serializer):
     username_or_email_or_phone_number = serializers.CharField(max_length=64, required=True)
     password = serializers.CharField(max_length=64, required=True)
 
-    def validate(self, attrs):
-        username_or_email_or_phone_number: str = attrs.get('username_or_email_or_phone_number').strip().lower()
-
-        if email_validator(username_or_email_or_phone_number):
-            user = UserModel.objects.filter(email=username_or_email_or_phone_number)
-            if not user.exists():
-                raise serializers.ValidationError("Gmail or Password invalid!")
+    messages = {
+        login.EMAIL: "Email or Password invalid!",
+        login.PHONE_NUMBER: "Phone number or Password invalid!",
+        login.USERNAME: "Username or Password invalid!",
+    }
 
-        elif (username_or_email_or_phone_number.startswith('+')
-              and username_or_email_or_phone_number[1:].isnumeric()):
+    def validate(self, attrs):
+        identifier: str = attrs.get('username_or_email_or_phone_number').strip().lower()
+        kind = login.kind(identifier)
 
-            if not username_or_email_or_phone_number.startswith('+998'):
-                raise serializers.ValidationError("Phone number must start with +998")
+        if kind == login.PHONE_NUMBER and not identifier.startswith('+998'):
+            raise serializers.ValidationError("Phone number must start with +998")
 
-            user = UserModel.objects.filter(phone_number=username_or_email_or_phone_number)
-            if not user.exists():
-                raise serializers.ValidationError("Phone number or Password invalid!")
+        ip = throttling.client_ip(self.context['request'])
+        login.check_ip(ip)
 
-        else:
-            user = UserModel.objects.filter(username=username_or_email_or_phone_number)
-            if not user.exists():
-                raise serializers.ValidationError("Username or Password invalid!")
+        user = login.authenticate(identifier, attrs.get('password'))
+        if user is None:
+            login.record_failure(identifier, ip)
+        # Refuses the right password too, the answer must not tell
+        login.check_account(identifier)
+        if user is None:
+            raise serializers.ValidationError(self.messages[kind])
 
-        if not user.first().is_active:
+        if not user.is_active:
             raise serializers.ValidationError("User is not active")
 
-        attrs['user'] = user.first()
+        login.reset_failures(identifier)
+        attrs['user'] = user
 
         return attrs
 
@@ -78,7 +86,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         if user:
             raise serializers.ValidationError("Username already exists")
 
-        user = UserModel.objects.filter(email=email).first()
+        user = UserModel.objects.filter(email=email.lower()).first()
         if user:
             raise serializers.ValidationError("Email already exists")
 
@@ -102,6 +110,13 @@ class RegisterSerializer(serializers.ModelSerializer):
 
 
 class ProfileSerializer(serializers.ModelSerializer):
+    """
+    The lists are truncated to the newest PROFILE_LIST_LIMIT items, the rest
+    is paginated under the sub-resources in `links`.
+    The parts that take queries are cached per user (see app_user.cache).
+    Async views load them beforehand and pass them as the summary and
+    is_following context.
+    """
     class Meta:
         model = UserModel
         fields = ('id', 'username', 'email', 'phone_number', 'first_name', 'last_name', 'is_private')
@@ -109,79 +124,131 @@ class ProfileSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         request_user = self.context['request'].user
+        summary = self.context.get('summary')
+        if summary is None:
+            summary = get_profile_summary(instance.pk, lambda: self.build_summary(instance))
 
         if request_user != instance:
-            data['is_following'] = FollowModel.objects.filter(
-                follower_id=request_user.id, followed=instance
-            ).exists()
+            data['is_following'] = self.context['is_following'] if 'is_following' in self.context else (
+                FollowModel.objects.filter(follower_id=request_user.id, followed=instance).exists()
+            )
         else:
-            data['comments_count'] = instance.comments_count
-            data['likes_count'] = instance.likes_count
-            data['story_likes_count'] = instance.story_likes_count
-            data['comment_likes_count'] = instance.comment_likes_count
+            data['comments_count'] = summary['comments_count']
+            data['likes_count'] = summary['likes_count']
+            data['story_likes_count'] = summary['story_likes_count']
+            data['comment_likes_count'] = summary['comment_likes_count']
 
         data['followers_count'] = instance.followers_count
         data['following_count'] = instance.following_count
         data['posts_count'] = instance.posts_count
-        data['stories_count'] = instance.stories_count
+        data['stories_count'] = summary['stories_count']
 
         if instance.is_private is False:
-            data['followers'] = [
-                {
-                    'id': follower.pk,
-                    'user_id': follower.follower.pk,
-                    'username': follower.follower.username,
-                    'is_i_follow': True if FollowModel.objects.filter(followed__pk=follower.pk, follower__pk=instance.pk).exists() else False
-                }
-                for follower in instance.followers.all()
-            ]
-            data['following'] = [
-                {
-                    'id': following.pk,
-                    'user_id': following.followed.pk,
-                    'username': following.followed.username,
-                    'is_followed': True if FollowModel.objects.filter(followed__pk=instance.pk, follower__pk=instance.pk).exists() else False
-                }
-                for following in instance.following.all()
-            ]
-            data['posts'] = [
-                {
-                    'id': post.pk,
-                    'description': post.description[:33]
-                }
-                for post in instance.posts.all()
-            ]
-            data['stories'] = [
-                {
-                    'id': story.pk,
-                    'description': story.description[:33]
-                }
-                for story in instance.stories.all()
-            ]
-            data['comments'] = [
-                {
-                    'id': comment.pk,
-                    'post_id': comment.post.pk,
-                    'post_description': comment.post.description[:33],
-                    'comment': comment.comment[:33]
-                }
-                for comment in instance.comments.all()
-            ]
-
-            data['marks_count'] = instance.marks_count
-            data['marks'] = [
-                {
-                    'id': mark.pk,
-                    'post_id': mark.post.pk if mark.post else None,
-                    'post_description': mark.post.description[:33] if mark.post else None,
-                    'story_id': mark.story.pk if mark.story else None,
-                    'story_description': mark.story.description[:33] if mark.story else None
-                }
-                for mark in instance.marks.all()
-            ]
+            for key in ('followers', 'following', 'posts', 'stories', 'comments'):
+                data[key] = summary[key]
+            data['marks_count'] = summary['marks_count']
+            data['marks'] = summary['marks']
+            data['links'] = self.links(instance)
 
         return data
 
+    @staticmethod
+    def links(instance):
+        return {
+            'followers': f'/api/auth/followers/{instance.pk}/',
+            'following': f'/api/auth/following/{instance.pk}/',
+            'posts': f'/api/post/user/{instance.pk}/',
+            'stories': f'/api/post/story/user/{instance.pk}/',
+            'comments': f'/api/post/comment/user/{instance.pk}/',
+            'marks': f'/api/auth/mark/{instance.pk}/',
+        }
+
+    @staticmethod
+    def build_summary(instance):
+        """
+        Everything the profile needs beyond the user row, in a fixed number of queries
+        """
+        limit = getattr(settings, 'PROFILE_LIST_LIMIT', 20)
+        newest = ('-created_at', '-id')
+
+        summary = (UserModel.objects
+                   .filter(pk=instance.pk)
+                   .values(stories_count=count_subquery(StoryModel, 'user'),
+                           comments_count=count_subquery(CommentPostModel, 'user'),
+                           likes_count=count_subquery(LikePostModel, 'user'),
+                           story_likes_count=count_subquery(LikeStoryModel, 'user'),
+                           comment_likes_count=count_subquery(LikeCommentModel, 'user'),
+                           marks_count=count_subquery(MarkModel, 'user'))
+                   .get())
+
+        followers = list(instance.followers.order_by(*newest)
+                         .values('id', 'follower_id', 'follower__username')[:limit])
+        following = list(instance.following.order_by(*newest)
+                         .values('id', 'followed_id', 'followed__username')[:limit])
+        comments = (instance.comments.order_by(*newest)
+                    .values('id', 'post_id', 'post__description', 'comment')[:limit])
+        marks = (instance.marks.order_by(*newest)
+                 .values('id', 'post_id', 'post__description', 'story_id', 'story__description')[:limit])
+
+        # Which of the listed accounts follow each other with instance, as two sets
+        listed_ids = {row['follower_id'] for row in followers} | {row['followed_id'] for row in following}
+        followed_back = set(instance.following.filter(followed_id__in=listed_ids).values_list('followed_id', flat=True))
+        follows_back = set(instance.followers.filter(follower_id__in=listed_ids).values_list('follower_id', flat=True))
+
+        summary['followers'] = [
+            {
+                'id': row['id'],
+                'user_id': row['follower_id'],
+                'username': row['follower__username'],
+                'is_i_follow': row['follower_id'] in followed_back
+            }
+            for row in followers
+        ]
+        summary['following'] = [
+            {
+                'id': row['id'],
+                'user_id': row['followed_id'],
+                'username': row['followed__username'],
+                'is_followed': row['followed_id'] in follows_back
+            }
+            for row in following
+        ]
+        summary['posts'] = [
+            {
+                'id': row['id'],
+                'description': row['description'][:33]
+            }
+            for row in instance.posts.order_by(*newest).values('id', 'description')[:limit]
+        ]
+        summary['stories'] = [
+            {
+                'id': row['id'],
+                'description': row['description'][:33]
+            }
+            for row in instance.stories.order_by(*newest).values('id', 'description')[:limit]
+        ]
+        summary['comments'] = [
+            {
+                'id': row['id'],
+                'post_id': row['post_id'],
+                'post_description': row['post__description'][:33],
+                'comment': row['comment'][:33]
+            }
+            for row in comments
+        ]
+        summary['marks'] = [
+            {
+                'id': row['id'],
+                'post_id': row['post_id'],
+                'post_description': row['post__description'][:33] if row['post_id'] else None,
+                'story_id': row['story_id'],
+                'story_description': row['story__description'][:33] if row['story_id'] else None
+            }
+            for row in marks
+        ]
+
+        return summary
+
 
 class VerifyCodeSerializer(serializers.Serializer):
     email_or_phone_number = serializers.CharField(max_length=64, required=True)
@@ -1,11 +1,52 @@
-from threading import Thread
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from app_common.authentication import invalidate_user
+from app_common.counters import adjust_counter
+from app_user.cache import invalidate_profile
+from app_user.tokens import revoked_changed
+from app_user.models import FollowModel
 from app_user.views import send_confirmation
 
 
 @receiver(post_save, sender=get_user_model())
-def send_verification(sender, instance=None, created=False, **kwargs):
+def send_verification(sender, instance=None, created=False, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(partial(send_confirmation, instance))
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_cached_user(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        invalidate_user(instance)
+
+
+@receiver(post_delete, sender=get_user_model())
+def invalidate_deleted_user(sender, instance=None, **kwargs):
+    invalidate_user(instance, deleted=True)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def reload_revoked_tokens(sender, created=False, **kwargs):
+    # Deletes need no reload: prune_expired() only deletes expired tokens, which are rejected anyway
     if created:
-        Thread(target=send_confirmation, args=(instance,)).start()
+        revoked_changed()
+
+
+@receiver(post_save, sender=FollowModel)
+def count_follow(sender, instance=None, created=False, raw=False, **kwargs):
+    if created and not raw:
+        adjust_counter(get_user_model(), instance.follower_id, 'following_count', 1)
+        adjust_counter(get_user_model(), instance.followed_id, 'followers_count', 1)
+        invalidate_profile(instance.follower_id, instance.followed_id)
+
+
+@receiver(post_delete, sender=FollowModel)
+def count_unfollow(sender, instance=None, **kwargs):
+    adjust_counter(get_user_model(), instance.follower_id, 'following_count', -1)
+    adjust_counter(get_user_model(), instance.followed_id, 'followers_count', -1)
+    invalidate_profile(instance.follower_id, instance.followed_id)
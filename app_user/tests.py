@@ -1,3 +1,378 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from app_post.models import PostModel
+from app_user import login, models, notifications, tokens
+
+UserModel = get_user_model()
+
+
+def create_user(username, **kwargs):
+    with mock.patch('app_user.signals.send_confirmation'):
+        return UserModel.objects.create_user(
+            username=username,
+            email=f'{username}@gmail.com',
+            phone_number=f'+998{abs(hash(username)) % 10 ** 9:09d}',
+            password='password',
+            **kwargs
+        )
+
+
+class FollowCounterTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('follower')
+        self.other = create_user('followed')
+        self.client.force_authenticate(self.user)
+
+    def test_follow_toggle_keeps_counters(self):
+        self.client.post(f'/api/auth/{self.other.pk}/follow/')
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.user.following_count, 1)
+        self.assertEqual(self.other.followers_count, 1)
+
+        self.client.post(f'/api/auth/{self.other.pk}/follow/')
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.user.following_count, 0)
+        self.assertEqual(self.other.followers_count, 0)
+
+    def test_put_and_delete_follow_are_idempotent(self):
+        url = f'/api/auth/{self.other.pk}/follow/'
+
+        response = self.client.put(url)
+        self.assertEqual((response.status_code, response.data), (201, {'following': True, 'followers_count': 1}))
+        response = self.client.put(url)
+        self.assertEqual((response.status_code, response.data), (200, {'following': True, 'followers_count': 1}))
+
+        for _ in range(2):
+            response = self.client.delete(url)
+            self.assertEqual((response.status_code, response.data), (200, {'following': False, 'followers_count': 0}))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.following_count, 0)
+
+    def test_cannot_follow_yourself(self):
+        self.assertEqual(self.client.put(f'/api/auth/{self.user.pk}/follow/').status_code, 403)
+        self.assertEqual(self.client.put(f'/api/auth/{self.other.pk + 100}/follow/').status_code, 404)
+
+    def test_profile_reads_stored_counters(self):
+        UserModel.objects.filter(pk=self.other.pk).update(followers_count=3)
+
+        response = self.client.get(f'/api/auth/profile/{self.other.pk}/')
+        self.assertEqual(response.data['followers_count'], 3)
+
+
+@override_settings(PROFILE_LIST_LIMIT=5)
+class ProfileTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner')
+        self.viewer = create_user('viewer')
+        self.client.force_authenticate(self.viewer)
+
+    def follow(self, follower, followed):
+        return models.FollowModel.objects.create(follower=follower, followed=followed)
+
+    def get_profile(self):
+        response = self.client.get(f'/api/auth/profile/{self.owner.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_query_count_does_not_grow_with_followers(self):
+        for i in range(12):
+            fan = create_user(f'fan{i}')
+            self.follow(fan, self.owner)
+            self.follow(self.owner, fan)
+
+        with self.assertNumQueries(11):
+            data = self.get_profile()
+        with self.assertNumQueries(2):
+            self.get_profile()
+
+        self.assertEqual(data['followers_count'], 12)
+        self.assertEqual(len(data['followers']), 5)
+        self.assertEqual(data['links']['followers'], f'/api/auth/followers/{self.owner.pk}/')
+
+    def test_mutual_follow_flags(self):
+        mutual = create_user('mutual')
+        fan = create_user('fan')
+        idol = create_user('idol')
+        self.follow(mutual, self.owner)
+        self.follow(self.owner, mutual)
+        self.follow(fan, self.owner)
+        self.follow(self.owner, idol)
+
+        data = self.get_profile()
+
+        followers = {row['username']: row['is_i_follow'] for row in data['followers']}
+        following = {row['username']: row['is_followed'] for row in data['following']}
+        self.assertEqual(followers, {'mutual': True, 'fan': False})
+        self.assertEqual(following, {'mutual': True, 'idol': False})
+
+    def test_writes_invalidate_the_cached_profile(self):
+        self.assertEqual(self.get_profile()['followers'], [])
+
+        self.client.post(f'/api/auth/{self.owner.pk}/follow/')
+        PostModel.objects.create(user=self.owner, description='fresh post')
+
+        data = self.get_profile()
+        self.assertEqual([row['username'] for row in data['followers']], ['viewer'])
+        self.assertEqual([row['description'] for row in data['posts']], ['fresh post'])
+        self.assertTrue(data['is_following'])
+
+
+class AsyncProfileTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner')
+        self.viewer = create_user('viewer')
+        for i in range(3):
+            fan = create_user(f'fan{i}')
+            models.FollowModel.objects.create(follower=fan, followed=self.owner)
+        models.FollowModel.objects.create(follower=self.viewer, followed=self.owner)
+
+    def test_async_views_answer_like_the_sync_ones(self):
+        for user in (self.viewer, self.owner):
+            self.client.force_authenticate(user)
+            for sync_url, async_url in [
+                (f'/api/auth/profile/{self.owner.pk}/', f'/api/auth/async/profile/{self.owner.pk}/'),
+                (f'/api/auth/followers/{self.owner.pk}/', f'/api/auth/async/followers/{self.owner.pk}/'),
+                (f'/api/auth/followers/{self.owner.pk}/?page_size=2', f'/api/auth/async/followers/{self.owner.pk}/?page_size=2'),
+            ]:
+                with self.subTest(user=user.username, url=async_url):
+                    cache.clear()
+                    expected = self.client.get(sync_url).json()
+                    cache.clear()
+                    data = self.client.get(async_url).json()
+                    if 'results' in expected:
+                        # Links point back at the route they were served from
+                        self.assertEqual(bool(data['next']), bool(expected['next']))
+                        data, expected = data['results'], expected['results']
+                    self.assertEqual(data, expected)
+
+    def test_missing_profile(self):
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.client.get('/api/auth/async/profile/0/').status_code, 404)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000,
+                   THROTTLE_RULES={'login_failures': {'account': (3, 300), 'ip': (3, 300)}})
+class LoginTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('owner')
+        UserModel.objects.filter(pk=self.user.pk).update(email='owner@example.com')
+
+    def login(self, identifier, password='password', ip='127.0.0.1'):
+        return self.client.post('/api/auth/login/', {'username_or_email_or_phone_number': identifier,
+                                                     'password': password}, REMOTE_ADDR=ip)
+
+    def test_any_identifier_in_one_query(self):
+        for identifier in ('owner', 'OWNER', 'Owner@Example.com', self.user.phone_number):
+            with self.subTest(identifier=identifier):
+                # The user, then the outstanding refresh token
+                with self.assertNumQueries(2):
+                    response = self.login(identifier)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['username'], 'owner')
+
+    def test_password_is_checked(self):
+        response = self.login('owner', 'wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['non_field_errors'], ['Username or Password invalid!'])
+        self.assertEqual(self.login('nobody', 'wrong').data, response.data)
+
+    def test_usernames_and_emails_are_unique_in_any_case(self):
+        for kwargs in ({'username': 'OWNER'}, {'email': 'OWNER@example.com'}):
+            with self.subTest(**kwargs), self.assertRaises(IntegrityError), transaction.atomic():
+                UserModel.objects.create(**{'username': 'other', 'email': 'other@gmail.com',
+                                            'phone_number': '+998900000000', **kwargs})
+
+    def test_failures_are_limited_per_identifier_and_ip(self):
+        for _ in range(2):
+            self.assertEqual(self.login('owner', 'wrong').status_code, 400)
+        self.assertEqual(self.login('owner', 'wrong').status_code, 429)
+
+        # The IP is refused before any password is checked, even the right one
+        with mock.patch('app_user.login.authenticate') as authenticate:
+            self.assertEqual(self.login('nobody', 'wrong').status_code, 429)
+            self.assertEqual(self.login('owner').status_code, 429)
+        authenticate.assert_not_called()
+
+        # From other IPs the account answers the right password as it does wrong ones
+        for ip in ('10.0.0.2', '10.0.0.3'):
+            self.assertEqual(self.login('owner', 'wrong', ip=ip).status_code, 429)
+            response = self.login('owner', ip=ip)
+            self.assertEqual(response.status_code, 429)
+            self.assertNotIn('access', response.data)
+
+        # Guesses at a refused account still count against their IP
+        for _ in range(2):
+            self.assertEqual(self.login('owner', 'wrong', ip='10.0.0.2').status_code, 429)
+        with mock.patch('app_user.login.authenticate') as authenticate:
+            self.assertEqual(self.login('nobody', 'wrong', ip='10.0.0.2').status_code, 429)
+        authenticate.assert_not_called()
+
+    def test_failures_are_counted_per_ip_whatever_it_forwards_for(self):
+        for n in range(3):
+            self.client.post('/api/auth/login/', {'username_or_email_or_phone_number': f'nobody{n}',
+                                                  'password': 'wrong'}, HTTP_X_FORWARDED_FOR=f'192.168.0.{n}')
+
+        self.assertEqual(self.login('owner').status_code, 429)
+
+    def test_identifiers_with_an_at_sign_are_emails_only_if_they_look_like_one(self):
+        self.assertEqual(login.kind('owner@example.com'), login.EMAIL)
+        self.assertEqual(login.kind('owner@home'), login.USERNAME)
+        self.assertEqual(login.kind('+998901234567'), login.PHONE_NUMBER)
+
+        UserModel.objects.filter(pk=self.user.pk).update(username='owner@home')
+        self.assertEqual(self.login('owner@home').status_code, 200)
+
+    def test_success_resets_the_identifier_count(self):
+        for _ in range(2):
+            self.login('owner', 'wrong')
+        self.assertEqual(self.login('owner').status_code, 200)
+        # From another IP: only the identifier's count started over
+        for _ in range(2):
+            self.assertEqual(self.login('owner', 'wrong', ip='10.0.0.2').status_code, 400)
+
+    def test_bench_login(self):
+        out = StringIO()
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            call_command('bench_login', requests=40, valid=0.5, attacker_ips=1, stdout=out)
+
+        self.assertIn('p99 over the run', out.getvalue())
+        self.assertIn("'429'", out.getvalue())
+        # Issued tokens were rolled back
+        self.assertFalse(OutstandingToken.objects.exists())
+
+    def test_changed_work_count_rehashes_on_login(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login('owner').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password.split('$')[1], '2000')
+
+
+class TokenTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('owner')
+
+    def refresh(self, token):
+        return self.client.post('/api/auth/token/refresh/', {'refresh': str(token)})
+
+    def test_prune_deletes_expired_tokens_in_batches(self):
+        issued = [tokens.RefreshToken.for_user(self.user) for _ in range(5)]
+        for token in issued[:2]:
+            token.blacklist()
+        OutstandingToken.objects.filter(jti__in=[token['jti'] for token in issued[1:4]]).update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+
+        out = StringIO()
+        call_command('prune_tokens', batch_size=2, stdout=out)
+
+        self.assertIn('3 expired tokens deleted, 1 of them blacklisted', out.getvalue())
+        self.assertEqual(set(OutstandingToken.objects.values_list('jti', flat=True)),
+                         {issued[0]['jti'], issued[4]['jti']})
+        self.assertEqual(BlacklistedToken.objects.get().token.jti, issued[0]['jti'])
+
+    def test_refresh_checks_revocation_without_a_query(self):
+        token = tokens.RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.refresh(token).status_code, 200)
+
+    def test_blacklisting_takes_effect_at_once(self):
+        token = tokens.RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            token.blacklist()
+
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh(tokens.RefreshToken.for_user(self.user)).status_code, 200)
+
+
+IN_MEMORY_TRANSPORTS = {
+    'email': 'app_user.notifications.InMemoryTransport',
+    'sms': 'app_user.notifications.InMemoryTransport',
+}
+
+
+@override_settings(NOTIFICATION_TRANSPORTS=IN_MEMORY_TRANSPORTS, NOTIFICATION_WORKERS=1,
+                   NOTIFICATION_RETRY_BACKOFF=0, NOTIFICATION_MAX_ATTEMPTS=3)
+class NotificationQueueTest(APITestCase):
+    def setUp(self):
+        notifications.InMemoryTransport.outbox = []
+        notifications.InMemoryTransport.fail_next = 0
+
+    def tearDown(self):
+        notifications.reset()
+
+    def deliver(self, *messages):
+        for message in messages:
+            self.assertTrue(notifications.enqueue(*message))
+        notifications.get_queue().join()
+        return notifications.outcomes()
+
+    def test_registration_queues_email_and_sms(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = UserModel.objects.create_user(username='newcomer', email='newcomer@gmail.com',
+                                                 phone_number='+998901234567', password='password')
+        notifications.get_queue().join()
+
+        code = models.VerifyCodeModel.objects.get(user=user)
+        sent = {message.channel: message for message in notifications.InMemoryTransport.outbox}
+        self.assertEqual(sent['email'].to, 'newcomer@gmail.com')
+        self.assertIn(code.code_email, sent['email'].body)
+        self.assertIn(code.code_sms, sent['sms'].body)
+
+    def test_failed_delivery_is_retried(self):
+        notifications.InMemoryTransport.fail_next = 2
+
+        [outcome] = self.deliver(('email', 'a@gmail.com', 'hello'))
+
+        self.assertEqual(outcome['status'], notifications.SENT)
+        self.assertEqual(outcome['attempts'], 3)
+        self.assertEqual(len(notifications.InMemoryTransport.outbox), 1)
+
+    def test_delivery_gives_up_after_max_attempts(self):
+        notifications.InMemoryTransport.fail_next = 3
+
+        [outcome] = self.deliver(('email', 'a@gmail.com', 'hello'))
+
+        self.assertEqual(outcome['status'], notifications.FAILED)
+        self.assertEqual(outcome['attempts'], 3)
+        self.assertEqual(outcome['error'], 'delivery failed')
+
+    @override_settings(NOTIFICATION_WORKERS=0, NOTIFICATION_QUEUE_SIZE=1, NOTIFICATION_ENQUEUE_TIMEOUT=0)
+    def test_full_queue_drops_messages(self):
+        self.assertTrue(notifications.enqueue('sms', '+998901234567', 'first'))
+        self.assertFalse(notifications.enqueue('sms', '+998901234567', 'second'))
+
+        [outcome] = notifications.outcomes()
+        self.assertEqual(outcome['status'], notifications.DROPPED)
+
+    def test_email_batch_shares_one_connection(self):
+        transport = notifications.EmailTransport()
+        messages = [notifications.Notification('email', f'user{i}@gmail.com', 'hello') for i in range(3)]
+
+        self.assertEqual(transport.send_many(messages[:2]), {})
+        connection = transport.connection
+        self.assertEqual(transport.send_many(messages[2:]), {})
+
+        self.assertIs(transport.connection, connection)
+        self.assertEqual([email.to for email in mail.outbox], [[message.to] for message in messages])
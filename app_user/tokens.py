@@ -0,0 +1,111 @@
+"""
+Refresh token bookkeeping.
+
+simplejwt's token_blacklist app stores a row per issued refresh token
+(OutstandingToken) and per revoked one (BlacklistedToken) and never deletes
+them. prune_expired() (`manage.py prune_tokens`, run every hour or so) deletes
+the expired ones in batches, through the expires_at index of migration
+app_user 0005, so the tables hold about REFRESH_TOKEN_LIFETIME worth of logins.
+
+Refreshing checks revocation against the set of revoked, unexpired JTIs kept in
+every process instead of a query per refresh. The set is reloaded when
+blacklisting a token bumps the version in TOKEN_REVOCATION_CACHE (after the
+commit, so a reload always sees the row), and every
+TOKEN_REVOCATION_REFRESH_INTERVAL seconds, which bounds how late a revocation
+takes effect in a process that does not share that cache (e.g. locmem).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+VERSION_KEY = 'tokens:revoked:version'
+
+_revoked = {'jtis': frozenset(), 'version': None, 'loaded_at': 0.0}
+_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'TOKEN_REVOCATION_CACHE', 'default')]
+
+
+def _version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A version lost with the cache restarts from the clock, never at one a process loaded at
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def revoked_jtis():
+    """
+    JTIs of the blacklisted tokens that have not expired yet, reloaded when they changed
+    """
+    version = _version()
+    interval = getattr(settings, 'TOKEN_REVOCATION_REFRESH_INTERVAL', 60)
+    if version == _revoked['version'] and time.monotonic() - _revoked['loaded_at'] < interval:
+        return _revoked['jtis']
+
+    with _lock:
+        if version != _revoked['version'] or time.monotonic() - _revoked['loaded_at'] >= interval:
+            jtis = frozenset(BlacklistedToken.objects
+                             .filter(token__expires_at__gt=timezone.now())
+                             .values_list('token__jti', flat=True))
+            _revoked.update(jtis=jtis, version=version, loaded_at=time.monotonic())
+    return _revoked['jtis']
+
+
+def revoked_changed():
+    """
+    Makes every process reload the revoked JTIs, once the current transaction commits
+    """
+    def bump():
+        cache = _cache()
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def prune_expired(now=None, batch_size=None):
+    """
+    Deletes the outstanding tokens that expired by now and their blacklist entries,
+    returns how many of each
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'TOKEN_PRUNE_BATCH_SIZE', 1000)
+    outstanding = blacklisted = 0
+
+    while True:
+        ids = list(OutstandingToken.objects
+                   .filter(expires_at__lte=now)
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return outstanding, blacklisted
+
+        with transaction.atomic():
+            _, deleted = OutstandingToken.objects.filter(pk__in=ids).delete()
+        outstanding += deleted.get(OutstandingToken._meta.label, 0)
+        blacklisted += deleted.get(BlacklistedToken._meta.label, 0)
+
+
+class RefreshToken(tokens.RefreshToken):
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in revoked_jtis():
+            raise TokenError(_('Token is blacklisted'))
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
@@ -22,4 +22,7 @@ urlpatterns = [
 
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+
+    path('async/profile/<int:pk>/', views.AsyncProfileView.as_view()),
+    path('async/followers/<int:user_id>/', views.AsyncFollowersListView.as_view()),
 ]
\ No newline at end of file
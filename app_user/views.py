@@ -1,23 +1,31 @@
 import random
 import string
 
-from threading import Thread
-from twilio.rest import Client
-
-from django.core.mail import send_mail
-
+from asgiref.sync import sync_to_async
 from rest_framework import generics, status
-from rest_framework.exceptions import NotFound, PermissionDenied
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from app_post.models import MarkModel
 from conf import settings
-from app_user import serializers, models
+from app_user import notifications, serializers, models
+from app_user.cache import aget_profile_summary
+from app_common import toggles
+from app_common.async_views import AsyncAPIViewMixin
+from app_common.pagination import CreatedAtCursorPagination
 from app_common.permissions import IsItsOrReadOnly
 
 
+def destinations(request, *fields):
+    """
+    Addresses in the request fields, what the register, resend and verify limits count per
+    """
+    data = request.data if hasattr(request.data, 'get') else {}
+    return [str(data.get(field, '')).strip().lower() for field in fields]
+
+
 def randomer(code):
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=code))
 
@@ -34,35 +42,39 @@ def send_confirmation(user):
         code_email=code_email,
         code_sms=code_sms
     )
-    send_mail(
+    queued_email = notifications.enqueue(
+        'email',
+        user.email,
         subject="Email Confirmation",
-        message=f"Your confirmation code is: {code_email}\n"
-                f"It expires in 3 minutes!",
-        from_email=f"{settings.EMAIL_HOST_USER}",
-        recipient_list=[user.email],
+        body=f"Your confirmation code is: {code_email}\n"
+             f"It expires in 3 minutes!",
     )
-    client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-
-    message = client.messages.create(
-        from_=settings.TWILIO_PHONE_NUMBER,
+    queued_sms = notifications.enqueue(
+        'sms',
+        settings.TWILIO_RECEIVING_PHONE,
         body=f"Your confirmation code is: {code_sms}\n"
              f"It expires in 3 minutes!\n"
              f"Made By MasterPhone",
-        to=settings.TWILIO_RECEIVING_PHONE
     )
-    return code_email, code_sms
+    return queued_email or queued_sms
 
 
 class ResendEmailConfirmation(generics.CreateAPIView):
     serializer_class = serializers.ResendConfirmationSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'resend'
+
+    def get_throttle_keys(self, request):
+        return {'destination': destinations(request, 'email_or_phone_number')}
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data.get('user')
 
-        Thread(target=send_confirmation, args=(user,)).start()
+        if not send_confirmation(user):
+            return Response({'message': 'Too many requests, try again later'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         response_data = {
             'message': (
@@ -78,12 +90,16 @@ class ResendEmailConfirmation(generics.CreateAPIView):
 class VerifyEmailConfirmation(generics.CreateAPIView):
     serializer_class = serializers.VerifyCodeSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'verify'
     response_data = None
 
+    def get_throttle_keys(self, request):
+        return {'destination': destinations(request, 'email_or_phone_number')}
+
     def perform_create(self, serializer):
         user = serializer.validated_data.get('user')
         user.is_active = True
-        user.save()
+        user.save(update_fields=['is_active'])
 
         refresh = RefreshToken.for_user(user)
 
@@ -104,8 +120,12 @@ class VerifyEmailConfirmation(generics.CreateAPIView):
 class RegisterView(generics.CreateAPIView):
     serializer_class = serializers.RegisterSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'register'
     user = None
 
+    def get_throttle_keys(self, request):
+        return {'destination': destinations(request, 'email', 'phone_number')}
+
     def perform_create(self, serializer):
         self.user = serializer.save()
         return self
@@ -127,6 +147,7 @@ class RegisterView(generics.CreateAPIView):
 class LoginView(generics.CreateAPIView):
     serializer_class = serializers.LoginSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'login'
     refresh_token = None
     user = None
 
@@ -153,52 +174,75 @@ class ProfileView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsItsOrReadOnly]
 
 
-class FollowListView(generics.ListCreateAPIView):
-    queryset = models.FollowModel.objects.all()
+class FollowListView(toggles.ToggleViewMixin, generics.ListAPIView):
+    """
+    PUT follows and DELETE unfollows the user, POST toggles (see app_common.toggles.ToggleViewMixin)
+    """
+    queryset = models.FollowModel.objects.select_related('follower', 'followed')
     serializer_class = serializers.FollowSerializer
-
-    def perform_create(self, serializer):
-        user_id = self.kwargs.get('user_id')
-        user = models.UserModel.objects.filter(id=user_id, is_deleted=False).first()
-
-        if not user:
-            self.request.failed_status_code = status.HTTP_404_NOT_FOUND
-            raise NotFound("User not found")
-
+    target_queryset = models.UserModel.objects.filter(is_deleted=False)
+    target_kwarg = 'user_id'
+    target_field = 'followed'
+    actor_field = 'follower'
+    counter_field = 'followers_count'
+    state_key = 'following'
+
+    def get_target(self):
+        user = super().get_target()
         if user == self.request.user:
             self.request.failed_status_code = status.HTTP_403_FORBIDDEN
             raise PermissionDenied("You can't follow yourself")
 
-        follow = self.queryset.filter(follower=self.request.user, followed=user)
-
-        if follow.exists():
-            follow.delete()
-            return Response({'message': 'Unfollowed'}, status=status.HTTP_200_OK)
-
-        serializer.save(follower=self.request.user, followed_id=user.pk)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
+        return user
 
 
 class FollowersListView(generics.ListAPIView):
     serializer_class = serializers.FollowSerializer
+    pagination_class = CreatedAtCursorPagination
+    user_from_claims = True
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_id')
-        return models.FollowModel.objects.filter(followed=user_id)
+        return models.FollowModel.objects.filter(followed=user_id).select_related('follower', 'followed')
 
 
 class FollowingListView(generics.ListAPIView):
     serializer_class = serializers.FollowSerializer
+    pagination_class = CreatedAtCursorPagination
+    user_from_claims = True
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_id')
-        return models.FollowModel.objects.filter(follower=user_id)
+        return models.FollowModel.objects.filter(follower=user_id).select_related('follower', 'followed')
 
 
 class MarkListView(generics.ListAPIView):
     serializer_class = serializers.MarkSerializer
+    pagination_class = CreatedAtCursorPagination
+    user_from_claims = True
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_id')
-        return MarkModel.objects.filter(user_id=user_id)
+        return MarkModel.objects.filter(user_id=user_id).select_related('user', 'post', 'story')
+
+
+# Async variants of the hot read endpoints, for ASGI deployments (see app_common.async_views)
+
+class AsyncProfileView(AsyncAPIViewMixin, ProfileView):
+    async def get(self, request, *args, **kwargs):
+        user = await self.aget_object()
+        context = self.get_serializer_context()
+        context['summary'] = await aget_profile_summary(
+            user.pk, sync_to_async(lambda: serializers.ProfileSerializer.build_summary(user))
+        )
+        if request.user != user:
+            context['is_following'] = await models.FollowModel.objects.filter(
+                follower_id=request.user.id, followed=user
+            ).aexists()
+
+        return Response(serializers.ProfileSerializer(user, context=context).data)
+
+
+class AsyncFollowersListView(AsyncAPIViewMixin, FollowersListView):
+    async def get(self, request, *args, **kwargs):
+        return await self.alist()
@@ -9,7 +9,7 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from django.conf.global_settings import AUTH_USER_MODEL
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_common.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,6 +95,24 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Every *_CACHE setting below names one of these. Local memory is per process; use
+# django.core.cache.backends.filebased.FileBasedCache (LOCATION a directory) to share
+# entries between processes offline, or RedisCache / PyMemcacheCache in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        # Culled a third at a time once full, whatever the timeouts: sized so pending view counters
+        # (VIEW_BUFFER_CACHE) are not evicted before they are flushed, nor response versions and stats
+        # by a TTL's worth of cached responses (RESPONSE_CACHE)
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -113,6 +132,17 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Hashers of stored passwords, the first one hashes new ones
+PASSWORD_HASHERS = [
+    'app_user.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = 870000  # Django 5.1's default; passwords are rehashed on login when it changes
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -133,6 +163,20 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media/'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Uploaded photos and videos, stored once per distinct content (see app_post.storage)
+    'media': {
+        'BACKEND': 'app_post.storage.ContentAddressedStorage',
+    },
+}
+MEDIA_ORPHAN_GRACE = 60 * 60  # seconds an unreferenced blob is kept before sweep_media deletes it
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -142,7 +186,7 @@ AUTH_USER_MODEL = 'app_user.UserModel'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app_common.authentication.CachedJWTAuthentication',
     ),
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -151,7 +195,16 @@ REST_FRAMEWORK = {
 
     'DEFAULT_PERMISSION_CLASSES': (
        'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+
+    # Only views with a throttle_scope are limited (see THROTTLE_RULES)
+    'DEFAULT_THROTTLE_CLASSES': (
+        'app_common.throttling.SlidingWindowThrottle',
+    ),
+
+    # Proxies in front of the app whose X-Forwarded-For is trusted, none:
+    # client IPs are REMOTE_ADDR, a client cannot pick its own
+    'NUM_PROXIES': 0,
 }
 
 
@@ -188,7 +241,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
     "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "app_user.tokens.TokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
@@ -196,6 +249,144 @@ SIMPLE_JWT = {
 }
 
 
+# User rows behind request.user (see app_common.authentication)
+AUTH_USER_CACHE = 'default'
+AUTH_USER_CACHE_TTL = 60  # seconds, also how late a deactivation through QuerySet.update() takes effect
+
+# Refresh token pruning and revocation checks (see app_user.tokens)
+TOKEN_REVOCATION_CACHE = 'default'
+TOKEN_REVOCATION_REFRESH_INTERVAL = 60  # seconds, how late a revocation can take effect without a shared cache
+TOKEN_PRUNE_BATCH_SIZE = 1000
+
+# Rate limits per scope and kind of key: (requests, seconds) (see app_common.throttling)
+THROTTLE_STORE = 'app_common.throttling.CacheStore'  # or app_common.throttling.LocalStore
+THROTTLE_CACHE = 'default'
+THROTTLE_LOCAL_MAX_KEYS = 100000
+THROTTLE_RULES = {
+    'login': {'ip': (60, 60)},
+    'login_failures': {'account': (5, 300), 'ip': (20, 300)},  # see app_user.login
+    'register': {'ip': (10, 3600), 'destination': (3, 3600)},
+    'resend': {'ip': (10, 600), 'destination': (3, 600)},
+    'verify': {'ip': (30, 600), 'destination': (5, 600)},
+}
+
+# Post/story view counters are buffered and written back in batches (see app_post.view_buffer)
+VIEW_BUFFER_CACHE = 'default'
+VIEW_BUFFER_FLUSH_INTERVAL = 10  # seconds
+VIEW_BUFFER_IDLE_TTL = 60 * 60  # seconds a counter emptied by a flush is kept
+VIEW_BUFFER_MAX_PENDING = 500  # also the most views lost if the cache is lost
+
+# Home feed timelines (see app_post.feed)
+FEED_CACHE = 'default'
+FEED_TIMELINE_SIZE = 800
+FEED_TIMELINE_TTL = 60 * 60 * 24 * 7  # seconds
+FEED_FANOUT_MAX_FOLLOWERS = 10000  # authors above this are merged in at read time
+FEED_LOCK_TIMEOUT = 5  # seconds a timeline update waits for, and holds, its lock
+
+# Full-text search for ?q= filters (see app_post.search)
+SEARCH_BACKEND = 'app_post.search.SQLiteFTSSearchBackend'
+SEARCH_MAX_RESULTS = 500
+
+# Trending posts for /api/post/top/ (see app_post.trending)
+TRENDING_SIZE = 100
+TRENDING_HALF_LIFE = 60 * 60 * 24  # seconds
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TRENDING_WEIGHTS = {'view': 1, 'like': 5, 'comment': 10, 'mark': 10}
+
+# Profile summaries (see app_user.cache)
+PROFILE_CACHE = 'default'
+PROFILE_CACHE_TTL = 300  # seconds
+PROFILE_LIST_LIMIT = 20  # items embedded per list, the rest is under the sub-resources
+
+# Photo renditions (see app_post.images)
+IMAGE_RENDITIONS = {'thumbnail': 320, 'feed': 1080, 'full': 2048}  # longest side in pixels
+IMAGE_QUALITY = 80
+IMAGE_PROCESSING_WORKERS = None  # processes, None for one per core
+IMAGE_PROCESSING_SYNC = False  # True renders inline, e.g. in tests
+
+# Chunked video uploads (see app_post.uploads)
+UPLOAD_MAX_SIZE = 2 * 1024 ** 3  # bytes per file
+UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 ** 2  # bytes per PUT
+UPLOAD_BLOCK_SIZE = 64 * 1024  # bytes read from the request at a time
+UPLOAD_LOCK_CACHE = 'default'  # must be shared between processes on databases without row locks (SQLite)
+UPLOAD_LOCK_TIMEOUT = 300  # seconds a chunk may take
+UPLOAD_SESSION_TTL = 60 * 60 * 24  # seconds before unfinished uploads are pruned
+
+# Story expiry (see app_post.stories)
+STORY_TTL = 60 * 60 * 24  # seconds a story is live
+STORY_ARCHIVE_TTL = None  # seconds archived stories are kept, None for ever
+STORY_SWEEP_BATCH_SIZE = 500
+
+# Read-heavy GET responses (see app_common.response_cache)
+RESPONSE_CACHE = 'default'  # its MAX_ENTRIES must hold a TTL's worth of responses, see CACHES
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_TTL = 60  # seconds, also how stale buffered views and scores can get
+RESPONSE_CACHE_LOCK_TIMEOUT = 10  # seconds concurrent misses wait for the first one to build
+
+# Batched likes, views and marks (see app_post.interactions)
+INTERACTION_BATCH_MAX = 500  # events per request
+
+# SQL profiles and query budgets (see app_common.profiling)
+QUERY_PROFILING = DEBUG
+QUERY_BUDGET_MODE = 'warn'  # or 'raise', which the test runner uses
+QUERY_PROFILE_DIR = None  # set to write the costliest profile per endpoint there
+QUERY_BUDGETS = {  # route -> most queries per request at any page size, as a number or per method
+    # (a DELETE also runs the post_delete receivers of every row it takes along, budgets allow a few)
+    'api/post/': {'GET': 10, 'POST': 32},
+    'api/post/feed/': 12,
+    'api/post/<int:pk>/': {'GET': 14, 'PUT': 26, 'PATCH': 26, 'DELETE': 80},
+    'api/post/user/<int:user_id>/': 10,
+    'api/post/<int:post_id>/like/': {'GET': 4, '*': 16},
+    'api/post/<int:post_id>/connect/user/': 10,
+    'api/post/comment/': 6,
+    'api/post/<int:post_id>/comment/': {'GET': 6, 'POST': 16},
+    'api/post/comment/<int:pk>/': {'GET': 4, '*': 16},
+    'api/post/comment/user/<int:user_id>/': 4,
+    'api/post/comment/<int:comment_id>/like/': {'GET': 4, '*': 10},
+    'api/post/story/': {'GET': 6, 'POST': 14},
+    'api/post/story/<int:pk>/': {'GET': 6, '*': 16},
+    'api/post/story/user/<int:user_id>/': 5,
+    'api/post/story/tray/': 5,
+    'api/post/story/<int:story_id>/like/': {'GET': 4, '*': 10},
+    'api/post/tag/': 6,
+    'api/post/tag/<int:pk>/': 5,
+    'api/post/top/': 11,
+    'api/post/interactions/': 44,
+    'api/post/async/': 10,
+    'api/post/async/<int:pk>/': 10,
+    'api/post/async/story/': 6,
+    'api/post/upload/': 3,
+    'api/post/upload/<int:pk>/': 12,
+    'api/auth/login/': 5,
+    'api/auth/register/': 8,
+    'api/auth/profile/<int:pk>/': {'GET': 11, 'PUT': 13, 'PATCH': 13, 'DELETE': 56},
+    'api/auth/mark/<int:user_id>/': 4,
+    'api/auth/<int:user_id>/follow/': {'GET': 4, '*': 12},
+    'api/auth/followers/<int:user_id>/': 4,
+    'api/auth/following/<int:user_id>/': 4,
+    'api/auth/resend-email/': 4,
+    'api/auth/verify-email/': 4,
+    'api/auth/token/': 3,
+    'api/auth/token/refresh/': 3,
+    'api/auth/async/profile/<int:pk>/': 11,
+    'api/auth/async/followers/<int:user_id>/': 4,
+}
+TEST_RUNNER = 'app_common.profiling.QueryBudgetTestRunner'
+
+# Outbound email/SMS queue (see app_user.notifications)
+NOTIFICATION_TRANSPORTS = {
+    'email': 'app_user.notifications.EmailTransport',
+    'sms': 'app_user.notifications.SMSTransport',
+}
+NOTIFICATION_WORKERS = 2
+NOTIFICATION_QUEUE_SIZE = 1000
+NOTIFICATION_BATCH_SIZE = 50
+NOTIFICATION_ENQUEUE_TIMEOUT = 1  # seconds to wait for room before dropping
+NOTIFICATION_MAX_ATTEMPTS = 4
+NOTIFICATION_RETRY_BACKOFF = 1  # seconds, doubled after every failed attempt
+NOTIFICATION_OUTCOMES_SIZE = 1000
+
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587